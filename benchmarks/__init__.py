@@ -0,0 +1,5 @@
+"""
+    Micro-benchmarks for pycernan.
+
+    Each module is runnable on its own, e.g. `python -m benchmarks.schema_cache`.
+"""
@@ -0,0 +1,56 @@
+"""
+    Throughput of many concurrent asyncio publishes on a single event loop
+    against a local FakeCernanServer.
+
+    Usage: python -m benchmarks.aio_publish [--publishes N] [--maxsize N] [--ack-delay SECONDS]
+"""
+import argparse
+import asyncio
+import time
+
+from pycernan.avro.aio import v1
+from pycernan.avro.serde import serialize
+from pycernan.avro.testing import FakeCernanServer
+
+from benchmarks.schema_cache import SMALL_SCHEMA
+
+RECORD = {"name": "Foo Bar", "favorite_number": 13, "favorite_color": "Aqua"}
+
+
+async def publish_all(client, blob, publishes):
+    start = time.time()
+    await asyncio.gather(*[client.publish_blob(blob) for _ in range(publishes)])
+    return time.time() - start
+
+
+def run(publishes, maxsize, ack_delay):
+    blob = serialize(SMALL_SCHEMA, [RECORD])
+    with FakeCernanServer(ack_delay=ack_delay) as server:
+        client = v1.Client(host=server.host, port=server.port, maxsize=maxsize)
+        elapsed = asyncio.run(publish_all(client, blob, publishes))
+        client.close()
+        assert server.frame_count == publishes
+
+    return {
+        "publishes": publishes,
+        "maxsize": maxsize,
+        "ack_delay": ack_delay,
+        "elapsed_s": elapsed,
+        "publishes_per_s": publishes / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--publishes", type=int, default=5000)
+    parser.add_argument("--maxsize", type=int, default=100)
+    parser.add_argument("--ack-delay", type=float, default=0.001)
+    args = parser.parse_args()
+
+    result = run(args.publishes, args.maxsize, args.ack_delay)
+    print("{publishes} concurrent publishes over {maxsize} connections (ack delay {ack_delay}s): "
+          "{elapsed_s:.2f}s, {publishes_per_s:.0f} publishes/s".format(**result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+    Cutting a stream of records into payloads of at most `max_bytes` with BatchBuilder.
+
+    Reports the encode time per record, against serializing the same payloads after
+    the fact, and how full payloads other than the last are on average.  Records come from the tests/data
+    fixtures.
+
+    Usage: python -m benchmarks.batch_builder [--max-bytes N ...] [--records N]
+"""
+import argparse
+import time
+
+from pycernan.avro.batch import BatchBuilder
+from pycernan.avro.serde import deserialize, serialize
+
+from benchmarks.suite import load_datasets, make_batch
+
+MAX_BYTES = [128 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+CODECS = ['null', 'deflate']
+
+
+def build(schema, records, codec, max_bytes):
+    builder = BatchBuilder(schema, codec, max_bytes)
+    blobs = []
+    for record in records:
+        if builder.append(record):
+            blobs.append(builder.build())
+            builder.reset()
+            builder.append(record)
+    if builder.num_records:
+        blobs.append(builder.build())
+    return blobs
+
+
+def run(max_bytes=MAX_BYTES, num_records=20000):
+    results = []
+    for name, (schema, records) in sorted(load_datasets().items()):
+        records = make_batch(records, num_records)
+        for codec in CODECS:
+            for limit in max_bytes:
+                start = time.time()
+                blobs = build(schema, records, codec, limit)
+                built = time.time() - start
+
+                batches = [list(deserialize(blob)[1]) for blob in blobs]
+                start = time.time()
+                for batch in batches:
+                    serialize(schema, batch, codec=codec)
+                serialized = time.time() - start
+
+                # The last payload holds whatever remains, so only the others are full.
+                full = blobs[:-1]
+                results.append({
+                    "dataset": name,
+                    "codec": codec,
+                    "max_bytes": limit,
+                    "payloads": len(blobs),
+                    "fill_pct": 100.0 * sum(len(blob) for blob in full) / (len(full) * limit) if full else float('nan'),
+                    "builder_us": built / num_records * 1e6,
+                    "serialize_us": serialized / num_records * 1e6,
+                })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--max-bytes", type=int, nargs='+', default=MAX_BYTES)
+    parser.add_argument("--records", type=int, default=20000)
+    args = parser.parse_args()
+
+    for result in run(args.max_bytes, args.records):
+        print("{dataset:>6} {codec:>8} {max_bytes:>8}B: {payloads:5d} payloads {fill_pct:5.1f}% full "
+              "{builder_us:6.2f}us/record (serialize {serialize_us:6.2f}us/record)".format(**result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+    Encode time against bytes sent, per codec, level and batch size.
+
+    Records come from the tests/data fixtures.  The size of each fixture, as written
+    by its own codec, is printed first as a reference for the sizes measured.
+    Codecs whose compression library is not installed are skipped.
+
+    Usage: python -m benchmarks.codecs [--batch-sizes N ...]
+"""
+import argparse
+import glob
+import os
+
+from pycernan.avro.serde import Codec, available_codecs, deserialize, serialize
+
+from benchmarks.suite import FIXTURES, load_datasets, make_batch, timed
+
+BATCH_SIZES = [1, 10, 100, 1000]
+
+CODECS = [
+    ('null', Codec('null')),
+    ('deflate-1', Codec('deflate', level=1)),
+    ('deflate', Codec('deflate')),
+    ('deflate-9', Codec('deflate', level=9)),
+    ('adaptive-1k', Codec('deflate', min_bytes=1024)),
+    ('adaptive-4k', Codec('deflate', min_bytes=4096)),
+]
+
+if 'snappy' in available_codecs():
+    CODECS.append(('snappy', Codec('snappy')))
+
+if 'zstandard' in available_codecs():
+    CODECS.extend([('zstandard', Codec('zstandard')), ('zstandard-9', Codec('zstandard', level=9))])
+
+
+def reference_sizes(directory=FIXTURES):
+    """
+        Returns the size and record count of each fixture, readable or not.
+    """
+    sizes = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.avro'))):
+        try:
+            with open(path, 'rb') as fixture:
+                records = len(list(deserialize(fixture.read())[1]))
+        except ValueError:
+            records = None
+        sizes.append({"fixture": os.path.basename(path), "bytes": os.path.getsize(path), "records": records})
+    return sizes
+
+
+def run(batch_sizes=BATCH_SIZES):
+    results = []
+    for name, (schema, records) in sorted(load_datasets().items()):
+        for size in batch_sizes:
+            batch = make_batch(records, size)
+            for label, codec in CODECS:
+                calls, elapsed = timed(lambda: serialize(schema, batch, codec=codec))
+                results.append({
+                    "dataset": name,
+                    "codec": label,
+                    "batch_size": size,
+                    "encode_us": elapsed / calls * 1e6,
+                    "bytes": len(serialize(schema, batch, codec=codec)),
+                })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-sizes", type=int, nargs='+', default=BATCH_SIZES)
+    args = parser.parse_args()
+
+    for reference in reference_sizes():
+        print("{fixture:>20}: {bytes:9d} bytes, {records} records".format(**reference))
+
+    for result in run(args.batch_sizes):
+        print("{dataset:>6} {codec:>12} x{batch_size:<5}: {encode_us:10.1f}us {bytes:9d} bytes".format(**result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+    Encode time and bytes of serialize, which writes a container header per call,
+    against an Encoder, which writes it once, for records of 100B to 10KB.
+
+    Usage: python -m benchmarks.encoder [--record-sizes N ...] [--batch-sizes N ...] [--codecs NAME ...]
+"""
+import argparse
+import random
+import string
+
+from pycernan.avro.serde import Encoder, serialize
+
+from benchmarks.suite import timed
+
+SCHEMA = {
+    "namespace": "pycernan.benchmarks",
+    "type": "record",
+    "name": "Event",
+    "fields": [
+        {"name": "id", "type": "long"},
+        {"name": "kind", "type": "string"},
+        {"name": "ts", "type": ["null", "long"]},
+        {"name": "body", "type": "string"},
+    ]
+}
+
+RECORD_SIZES = [100, 1000, 10000]
+BATCH_SIZES = [1, 10, 100]
+CODECS = ['null', 'deflate']
+
+
+def make_records(record_size, count, seed=0):
+    rng = random.Random(seed)
+    # Roughly compressible text, padding each record to about `record_size` encoded bytes.
+    words = [''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 8))) for _ in range(200)]
+    records = []
+    for i in range(count):
+        body = ''
+        while len(body) < record_size - 20:
+            body += rng.choice(words) + ' '
+        records.append({"id": i, "kind": "click", "ts": 1500000000000 + i, "body": body[:record_size - 20]})
+    return records
+
+
+def run(record_sizes=RECORD_SIZES, batch_sizes=BATCH_SIZES, codecs=CODECS):
+    results = []
+    for record_size in record_sizes:
+        for batch_size in batch_sizes:
+            batch = make_records(record_size, batch_size)
+            for codec in codecs:
+                encoder = Encoder(SCHEMA, codec=codec)
+                modes = [
+                    ('serialize', lambda: serialize(SCHEMA, batch, codec=codec)),
+                    ('encoder', lambda: encoder.encode(batch)),
+                ]
+                for mode, fn in modes:
+                    calls, elapsed = timed(fn)
+                    results.append({
+                        "record_size": record_size,
+                        "batch_size": batch_size,
+                        "codec": codec,
+                        "mode": mode,
+                        "encode_us": elapsed / calls * 1e6,
+                        "bytes": len(fn()),
+                        "header_bytes": len(encoder.header()),
+                    })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--record-sizes", type=int, nargs='+', default=RECORD_SIZES)
+    parser.add_argument("--batch-sizes", type=int, nargs='+', default=BATCH_SIZES)
+    parser.add_argument("--codecs", nargs='+', default=CODECS)
+    args = parser.parse_args()
+
+    for result in run(args.record_sizes, args.batch_sizes, args.codecs):
+        print("{record_size:>6}B x{batch_size:<4} {codec:>8} {mode:>10}: {encode_us:9.1f}us "
+              "{bytes:8d} bytes ({header_bytes} header)".format(**result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+    Allocations and time per publish for concatenated frames versus
+    scatter/gather frames, for Avro bodies from 1KB to 1MB.
+
+    Usage: python -m benchmarks.frame_copies [--iterations N]
+"""
+import argparse
+import socket
+import struct
+import threading
+import time
+import tracemalloc
+
+from pycernan.avro import framing, v2
+
+SIZES = [2 ** 10, 2 ** 14, 2 ** 17, 2 ** 20]
+METADATA = {"source": "benchmark"}
+
+
+def concatenated_frame(avro_blob):
+    # Mirrors the pre scatter/gather V2 frame construction.
+    header = struct.pack(">LLQQ", 2, 1, 1, 1)
+    kv_encoded = struct.pack(">B", len(METADATA))
+    for key, val in METADATA.items():
+        kv_encoded += struct.pack(">B", len(key)) + key.encode("utf-8") + \
+            struct.pack(">H", len(val)) + val.encode("utf-8")
+    payload_len = len(header) + len(kv_encoded) + len(avro_blob)
+    return struct.pack(">L", payload_len) + header + kv_encoded + avro_blob
+
+
+def scatter_frame(avro_blob):
+    return v2.frame(avro_blob, payload_id=1, shard_by=1, metadata=METADATA)[2]
+
+
+def drain(sock):
+    buf = bytearray(1 << 20)
+    while sock.recv_into(buf):
+        pass
+
+
+def measure(build, avro_blob, iterations, sock):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.time()
+    for _ in range(iterations):
+        framing.sendall(sock, build(avro_blob))
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed / iterations * 1e6, peak
+
+
+def run(iterations):
+    left, right = socket.socketpair()
+    reader = threading.Thread(target=drain, args=(right,))
+    reader.daemon = True
+    reader.start()
+
+    results = []
+    for size in SIZES:
+        avro_blob = b'a' * size
+        n = max(10, iterations * SIZES[0] // size)
+        concat_us, concat_peak = measure(concatenated_frame, avro_blob, n, left)
+        scatter_us, scatter_peak = measure(scatter_frame, avro_blob, n, left)
+        results.append({
+            "size": size,
+            "concatenated_us": concat_us,
+            "concatenated_peak_bytes": concat_peak,
+            "scatter_us": scatter_us,
+            "scatter_peak_bytes": scatter_peak,
+        })
+
+    left.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    for result in run(args.iterations):
+        print("{size:>8} bytes: concatenated {concatenated_us:9.1f}us peak {concatenated_peak_bytes:>8}B  "
+              "scatter {scatter_us:9.1f}us peak {scatter_peak_bytes:>6}B".format(**result))
+
+
+if __name__ == "__main__":
+    main()
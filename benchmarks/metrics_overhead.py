@@ -0,0 +1,112 @@
+"""
+    Measures the per-publish cost of recording metrics with each backend.
+
+    Publishes go to an in-memory socket that acks immediately, so metrics are a
+    large share of what is measured.  `metrics_us` isolates the metric updates a
+    sync publish makes.
+
+    Usage: python -m benchmarks.metrics_overhead [--publishes N] [--threads N ...]
+"""
+import argparse
+import threading
+import time
+
+from pycernan.avro import metrics
+from pycernan.avro.v1 import Client
+
+BACKENDS = ['prometheus', 'aggregating', 'noop']
+
+
+class AckingSocket(object):
+    """
+        Acknowledges each frame sent to it, without any I/O.
+    """
+
+    def __init__(self):
+        self._ack = b''
+
+    def sendall(self, data):
+        # The id follows the length, version and control fields.
+        self._ack = bytes(data[12:20])
+
+    def recv(self, n_bytes):
+        ack, self._ack = self._ack[:n_bytes], self._ack[n_bytes:]
+        return ack
+
+    def close(self):
+        pass
+
+
+def publish_metrics(n_bytes):
+    # The updates made by one sync publish, see BaseClient._transmit_once.
+    with metrics.conn_acquire_latency.time():
+        pass
+    metrics.publish_count.inc()
+    metrics.bytes_sent.inc(n_bytes)
+    metrics.event_size_bytes.observe(n_bytes)
+    with metrics.publish_latency.time():
+        pass
+    metrics.ack_request_count.inc()
+    with metrics.ack_latency.time():
+        metrics.bytes_received.inc(8)
+    metrics.ack_count.inc()
+
+
+def in_threads(num_threads, fn, n):
+    threads = [threading.Thread(target=fn, args=(n // num_threads,)) for _ in range(num_threads)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start
+
+
+def run_backend(backend, publishes, num_threads):
+    metrics.use(backend)
+    client = Client(host='localhost', port=2002, maxsize=num_threads, pool_kwargs={'check_liveness': False})
+    client.pool._create_connection = AckingSocket
+
+    def publish(n):
+        for _ in range(n):
+            client.publish_blob(b'blob')
+
+    def update(n):
+        for _ in range(n):
+            publish_metrics(100)
+
+    publish_elapsed = in_threads(num_threads, publish, publishes)
+    metrics_elapsed = in_threads(num_threads, update, publishes)
+    client.close()
+    return {
+        "backend": backend,
+        "threads": num_threads,
+        "publish_us": publish_elapsed / publishes * 1e6,
+        "metrics_us": metrics_elapsed / publishes * 1e6,
+    }
+
+
+def run(publishes, thread_counts):
+    results = []
+    try:
+        for num_threads in thread_counts:
+            for backend in BACKENDS:
+                results.append(run_backend(backend, publishes, num_threads))
+    finally:
+        metrics.use('prometheus')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--publishes", type=int, default=100000)
+    parser.add_argument("--threads", type=int, nargs='+', default=[1, 4])
+    args = parser.parse_args()
+
+    for result in run(args.publishes, args.threads):
+        print("{backend:>12} x{threads} threads: {publish_us:6.2f}us per publish, "
+              "{metrics_us:6.2f}us of metric updates".format(**result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+    Measures publish throughput across 1..N local FakeCernanServers, each with
+    injected round trip time, through a single multi-endpoint client.
+
+    Usage: python -m benchmarks.multi_endpoint [--endpoints N] [--publishes N] [--rtt SECONDS] [--maxsize N]
+"""
+import argparse
+import contextlib
+import threading
+import time
+
+from pycernan.avro.serde import serialize
+from pycernan.avro.testing import FakeCernanServer
+from pycernan.avro.v1 import Client
+
+from benchmarks.schema_cache import SMALL_SCHEMA
+
+RECORD = {"name": "Foo Bar", "favorite_number": 13, "favorite_color": "Aqua"}
+
+
+def run_endpoints(servers, blob, publishes, maxsize):
+    client = Client(endpoints=[server.address for server in servers], maxsize=maxsize)
+    # Enough threads to keep every pooled connection busy.
+    num_threads = maxsize * len(servers)
+    counter = iter(range(publishes))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            client.publish_blob(blob, shard_by=i + 1)
+
+    threads = [threading.Thread(target=worker) for _ in range(num_threads)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    client.close()
+    return {
+        "endpoints": len(servers),
+        "publishes_per_s": publishes / elapsed,
+        "frames_per_endpoint": [server.frame_count for server in servers],
+    }
+
+
+def run(num_endpoints, publishes, rtt, maxsize):
+    blob = serialize(SMALL_SCHEMA, [RECORD])
+    results = []
+    with contextlib.ExitStack() as stack:
+        servers = [stack.enter_context(FakeCernanServer(ack_delay=rtt)) for _ in range(num_endpoints)]
+        n = 1
+        while n <= num_endpoints:
+            before = [server.frame_count for server in servers[:n]]
+            result = run_endpoints(servers[:n], blob, publishes, maxsize)
+            result["frames_per_endpoint"] = [after - b for after, b in zip(result["frames_per_endpoint"], before)]
+            results.append(result)
+            n *= 2
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--endpoints", type=int, default=4)
+    parser.add_argument("--publishes", type=int, default=4000)
+    parser.add_argument("--rtt", type=float, default=0.002)
+    parser.add_argument("--maxsize", type=int, default=2)
+    args = parser.parse_args()
+
+    baseline = None
+    for result in run(args.endpoints, args.publishes, args.rtt, args.maxsize):
+        baseline = baseline or result["publishes_per_s"]
+        print("{endpoints:>3} endpoints: {publishes_per_s:9.0f} publishes/s  ({scaling:.2f}x)  per endpoint {frames_per_endpoint}".format(
+            scaling=result["publishes_per_s"] / baseline, **result))
+
+
+if __name__ == "__main__":
+    main()
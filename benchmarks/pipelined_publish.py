@@ -0,0 +1,100 @@
+"""
+    Compares one-payload-per-connection publishing with pipelined publishing
+    against a local FakeCernanServer with injected round trip time.
+
+    Usage: python -m benchmarks.pipelined_publish [--publishes N] [--rtt SECONDS] [--maxsize N]
+"""
+import argparse
+import threading
+import time
+
+from pycernan.avro.serde import serialize
+from pycernan.avro.testing import FakeCernanServer
+from pycernan.avro.v1 import Client
+
+from benchmarks.schema_cache import SMALL_SCHEMA
+
+RECORD = {"name": "Foo Bar", "favorite_number": 13, "favorite_color": "Aqua"}
+WINDOWS = [1, 8, 64]
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100.0))]
+
+
+def summarize(mode, publishes, elapsed, latencies):
+    return {
+        "mode": mode,
+        "publishes_per_s": publishes / elapsed,
+        "latency_p50_ms": percentile(latencies, 50) * 1e3,
+        "latency_p99_ms": percentile(latencies, 99) * 1e3,
+    }
+
+
+def run_blocking(server, blob, publishes, maxsize):
+    # One thread per pooled connection, each waiting on its own ack.
+    client = Client(host=server.host, port=server.port, maxsize=maxsize)
+    latencies = []
+
+    def worker(n):
+        for _ in range(n):
+            start = time.time()
+            client.publish_blob(blob)
+            latencies.append(time.time() - start)
+
+    threads = [threading.Thread(target=worker, args=(publishes // maxsize,)) for _ in range(maxsize)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    client.close()
+    return summarize("blocking x{} threads".format(maxsize), len(latencies), elapsed, latencies)
+
+
+def run_pipelined(server, blob, publishes, maxsize, window):
+    client = Client(host=server.host, port=server.port, maxsize=maxsize, max_in_flight=window)
+    latencies = []
+
+    def record(started):
+        return lambda future: latencies.append(time.time() - started)
+
+    start = time.time()
+    futures = []
+    for _ in range(publishes):
+        future = client.publish_blob(blob)
+        future.add_done_callback(record(time.time()))
+        futures.append(future)
+    for future in futures:
+        future.result()
+    elapsed = time.time() - start
+    client.close()
+    return summarize("pipelined window={}".format(window), publishes, elapsed, latencies)
+
+
+def run(publishes, rtt, maxsize):
+    blob = serialize(SMALL_SCHEMA, [RECORD])
+    results = []
+    with FakeCernanServer(ack_delay=rtt) as server:
+        results.append(run_blocking(server, blob, publishes, maxsize))
+        for window in WINDOWS:
+            results.append(run_pipelined(server, blob, publishes, maxsize, window))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--publishes", type=int, default=2000)
+    parser.add_argument("--rtt", type=float, default=0.002)
+    parser.add_argument("--maxsize", type=int, default=4)
+    args = parser.parse_args()
+
+    for result in run(args.publishes, args.rtt, args.maxsize):
+        print("{mode:>24}: {publishes_per_s:9.0f} publishes/s  p50 {latency_p50_ms:7.2f}ms  "
+              "p99 {latency_p99_ms:7.2f}ms".format(**result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+    Serialization throughput of threads sharing one process versus ProcessSerializer
+    worker processes, for 10k record batches of each tests/data dataset.
+
+    Threads serialize behind the GIL, so their throughput stays flat as they are added,
+    while worker processes should scale with the number of cores available.
+
+    Usage: python -m benchmarks.process_serializer [--workers N ...] [--batch-size N] [--batches N]
+"""
+import argparse
+import multiprocessing
+import threading
+import time
+
+from pycernan.avro.executor import ProcessSerializer
+from pycernan.avro.serde import serialize
+
+from benchmarks.suite import load_datasets, make_batch
+
+
+def default_workers():
+    cpus = multiprocessing.cpu_count()
+    return sorted(set([1, 2, 4, cpus]) & set(range(1, cpus + 1)))
+
+
+def in_threads(num_threads, fn, batches):
+    threads = [threading.Thread(target=fn, args=(batches // num_threads,)) for _ in range(num_threads)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start
+
+
+def run_threads(schema, batch, workers, batches):
+    def work(n):
+        for _ in range(n):
+            serialize(schema, batch)
+
+    return in_threads(workers, work, batches)
+
+
+def run_processes(schema, batch, workers, batches, shared_memory):
+    with ProcessSerializer(max_workers=workers, schemas=[schema], shared_memory=shared_memory) as serializer:
+        # Starts the workers, so their start up is not measured.
+        for future in [serializer.submit(schema, batch) for _ in range(workers)]:
+            future.result()
+
+        def work(n):
+            for _ in range(n):
+                serializer.serialize(schema, batch)
+
+        # Two submitting threads per worker keep every worker busy.
+        return in_threads(workers * 2, work, batches)
+
+
+def run(workers=None, batch_size=10000, batches=32):
+    results = []
+    for name, (schema, records) in sorted(load_datasets().items()):
+        # Schemas are sent to workers as definitions, not in their parsed form.
+        schema = {k: v for k, v in schema.items() if not k.startswith('__')}
+        batch = make_batch(records, batch_size)
+        for num_workers in workers or default_workers():
+            modes = [
+                ('threads', lambda: run_threads(schema, batch, num_workers, batches)),
+                ('processes', lambda: run_processes(schema, batch, num_workers, batches, True)),
+                ('processes-pickled', lambda: run_processes(schema, batch, num_workers, batches, False)),
+            ]
+            for mode, fn in modes:
+                elapsed = fn()
+                results.append({
+                    "dataset": name,
+                    "mode": mode,
+                    "workers": num_workers,
+                    "batches_per_s": batches / elapsed,
+                    "records_per_s": batches * batch_size / elapsed,
+                })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs='+')
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--batches", type=int, default=32)
+    args = parser.parse_args()
+
+    for result in run(args.workers, args.batch_size, args.batches):
+        print("{dataset:>6} {mode:>17} x{workers}: {batches_per_s:8.1f} batches/s {records_per_s:10.0f} records/s".format(**result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+    Peak RSS and throughput of publish_file, reading the whole file into memory
+    versus streaming it to the socket.
+
+    Each publish runs in a fresh interpreter so its peak RSS is not inflated by
+    earlier runs, against a fake Cernan in another process.
+
+    Usage: python -m benchmarks.publish_file [--sizes MB ...] [--publishes N]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from pycernan.avro import client, v1
+
+from benchmarks.suite import ServerProcess
+
+MODES = ['read', 'stream']
+SIZES_MB = [16, 64, 256]
+
+
+def publish(mode, path, host, port, publishes):
+    c = v1.Client(host=host, port=port)
+    # client.Client.publish_file is the pre-streaming implementation, reading the file before framing it.
+    publish_file = client.Client.publish_file if mode == 'read' else v1.Client.publish_file
+
+    start = time.time()
+    for _ in range(publishes):
+        publish_file(c, path)
+    elapsed = time.time() - start
+    c.close()
+
+    # ru_maxrss is in KB on Linux and bytes on macOS.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        max_rss *= 1024
+    return {
+        "mode": mode,
+        "size_mb": os.path.getsize(path) / 2.0 ** 20,
+        "max_rss_mb": max_rss / 2.0 ** 20,
+        "mb_per_s": os.path.getsize(path) * publishes / 2.0 ** 20 / elapsed,
+    }
+
+
+def make_file(directory, size_mb):
+    path = os.path.join(directory, "{}mb.avro".format(size_mb))
+    chunk = os.urandom(2 ** 20)
+    with open(path, "wb") as file:
+        for _ in range(size_mb):
+            file.write(chunk)
+    return path
+
+
+def run(sizes_mb=SIZES_MB, publishes=3):
+    results = []
+    directory = tempfile.mkdtemp()
+    try:
+        with ServerProcess() as cernan:
+            for size_mb in sizes_mb:
+                path = make_file(directory, size_mb)
+                for mode in MODES:
+                    output = subprocess.check_output([
+                        sys.executable, "-m", "benchmarks.publish_file", "--worker", mode, path,
+                        cernan.host, str(cernan.port), "--publishes", str(publishes)])
+                    results.append(json.loads(output.decode("utf-8")))
+                os.remove(path)
+    finally:
+        os.rmdir(directory)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs='+', default=SIZES_MB, help="File sizes in MB.")
+    parser.add_argument("--publishes", type=int, default=3)
+    parser.add_argument("--worker", nargs=4, metavar=("MODE", "PATH", "HOST", "PORT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        mode, path, host, port = args.worker
+        print(json.dumps(publish(mode, path, host, int(port), args.publishes)))
+        return
+
+    for result in run(args.sizes, args.publishes):
+        print("{mode:>6} {size_mb:6.0f}MB file: {max_rss_mb:8.1f}MB peak RSS, {mb_per_s:8.1f}MB/s".format(**result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+    Measures the per-publish CPU saved by caching parsed schemas.  Exits with an
+    error if a cached lookup is slower than parsing the schema.
+
+    Usage: python -m benchmarks.schema_cache [--iterations N]
+"""
+import argparse
+import timeit
+
+from fastavro import parse_schema
+
+from pycernan.avro.schema_cache import SchemaCache
+from pycernan.avro.serde import serialize
+
+SMALL_SCHEMA = {
+    "namespace": "example.avro",
+    "type": "record",
+    "name": "User",
+    "fields": [
+        {"name": "name", "type": "string"},
+        {"name": "favorite_number",  "type": ["int", "null"]},
+        {"name": "favorite_color", "type": ["string", "null"]}
+    ]
+}
+
+LARGE_SCHEMA = {
+    "namespace": "example.avro",
+    "type": "record",
+    "name": "Wide",
+    "fields": [
+        {"name": "f{}".format(i), "type": ["null", "string", {"type": "long", "logicalType": "timestamp-micros"}], "default": None}
+        for i in range(40)
+    ] + [
+        {"name": "nested", "type": {"type": "record", "name": "Nested", "fields": [
+            {"name": "n{}".format(i), "type": "int"} for i in range(20)]}},
+    ]
+}
+
+
+def large_record():
+    record = {"f{}".format(i): "value" for i in range(40)}
+    record["nested"] = {"n{}".format(i): i for i in range(20)}
+    return record
+
+
+SCENARIOS = [
+    ("small", SMALL_SCHEMA, {"name": "Foo Bar", "favorite_number": 13, "favorite_color": "Aqua"}),
+    ("large", LARGE_SCHEMA, large_record()),
+]
+
+
+def per_call_us(fn, iterations):
+    return timeit.timeit(fn, number=iterations) / iterations * 1e6
+
+
+def run(iterations):
+    results = []
+    for name, schema, record in SCENARIOS:
+        cache = SchemaCache()
+        cache.parse(schema)
+
+        uncached_parse = per_call_us(lambda: parse_schema(schema), iterations)
+        cached_parse = per_call_us(lambda: cache.parse(schema), iterations)
+        publish = per_call_us(lambda: serialize(schema, [record]), iterations)
+
+        results.append({
+            "schema": name,
+            "parse_schema_us": uncached_parse,
+            "cached_parse_us": cached_parse,
+            "serialize_us": publish,
+            "saved_per_publish_us": uncached_parse - cached_parse,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    results = run(args.iterations)
+    slower = [result["schema"] for result in results if result["saved_per_publish_us"] < 0]
+    if slower:
+        parser.exit(1, "Cached parse is slower than parse_schema for: {}\n".format(", ".join(slower)))
+
+    for result in results:
+        print("{schema:>6}: parse {parse_schema_us:8.2f}us  cached {cached_parse_us:6.2f}us  "
+              "serialize {serialize_us:8.2f}us  saved/publish {saved_per_publish_us:8.2f}us".format(**result))
+
+
+if __name__ == "__main__":
+    main()
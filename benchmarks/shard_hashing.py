@@ -0,0 +1,49 @@
+"""
+    Compares deterministic shard hashing against the built-in hash() it replaced.
+
+    Usage: python -m benchmarks.shard_hashing [--iterations N]
+"""
+import argparse
+import timeit
+import uuid
+
+from pycernan.avro.hashing import ShardKey, hash_u64
+
+KEYS = {
+    "str": "user-1234567890",
+    "bytes": b"user-1234567890",
+    "int": 1234567890,
+    "uuid": uuid.UUID(int=1234567890),
+    "tuple": ("user", 1234567890),
+}
+
+
+def builtin_hash_u64(value):
+    return hash(value) % 2 ** 64
+
+
+def run(iterations):
+    results = []
+    for name, key in KEYS.items():
+        shard_key = ShardKey(key)
+        for impl, fn, arg in [
+            ("hash()", builtin_hash_u64, key),
+            ("hash_u64", hash_u64, key),
+            ("ShardKey", hash_u64, shard_key),
+        ]:
+            elapsed = timeit.timeit(lambda: fn(arg), number=iterations)
+            results.append({"key": name, "impl": impl, "ns_per_hash": elapsed / iterations * 1e9})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    for result in run(args.iterations):
+        print("{key:>6} {impl:>9}: {ns_per_hash:8.0f} ns".format(**result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+    Compares bytes-on-wire and encode time of one container per record
+    against a single container per batch.
+
+    Usage: python -m benchmarks.single_container [--iterations N]
+"""
+import argparse
+import timeit
+
+from io import BytesIO
+
+from fastavro import writer
+
+from pycernan.avro.serde import parse_schema, serialize
+
+SCHEMA = parse_schema({
+    "namespace": "example.avro",
+    "type": "record",
+    "name": "User",
+    "fields": [
+        {"name": "name", "type": "string"},
+        {"name": "favorite_number",  "type": ["int", "null"]},
+        {"name": "favorite_color", "type": ["string", "null"]}
+    ]
+})
+
+BATCH_SIZES = [1, 10, 100, 1000]
+
+
+def per_record_containers(schema, batch):
+    # Mirrors the pre-single-container behavior: one writer (header, sync marker
+    # and deflate stream) per record, concatenated into one blob.
+    blob = b''
+    for record in batch:
+        buf = BytesIO()
+        writer(buf, schema, [record], codec='deflate', validator=True)
+        blob += buf.getvalue()
+    return blob
+
+
+def make_batch(size):
+    return [
+        {"name": "User {}".format(i), "favorite_number": i, "favorite_color": "Greenish Gold"}
+        for i in range(size)
+    ]
+
+
+def run(iterations):
+    results = []
+    for size in BATCH_SIZES:
+        batch = make_batch(size)
+        n = max(1, iterations // size)
+
+        legacy_time = timeit.timeit(lambda: per_record_containers(SCHEMA, batch), number=n) / n
+        single_time = timeit.timeit(lambda: serialize(SCHEMA, batch), number=n) / n
+
+        results.append({
+            "batch_size": size,
+            "per_record_bytes": len(per_record_containers(SCHEMA, batch)),
+            "single_bytes": len(serialize(SCHEMA, batch)),
+            "per_record_encode_us": legacy_time * 1e6,
+            "single_encode_us": single_time * 1e6,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    for result in run(args.iterations):
+        print("batch {batch_size:>5}: bytes {per_record_bytes:>8} -> {single_bytes:>7}  "
+              "encode {per_record_encode_us:10.1f}us -> {single_encode_us:9.1f}us".format(**result))
+
+
+if __name__ == "__main__":
+    main()
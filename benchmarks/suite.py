@@ -0,0 +1,267 @@
+"""
+    Reproducible benchmark suite, run offline against a local FakeCernanServer.
+
+    Records are taken from the tests/data/*.avro fixtures.  Scenarios:
+
+        serialize - Encoding batches into Avro containers, per codec and batch size.
+        frame     - Building V1 / V2 frames around serialized batches.
+        sync      - Single threaded publishes, each awaiting its ack.
+        async     - Single threaded publishes without acks.
+        threaded  - Publishes awaiting acks from several threads sharing a client.
+
+    Results are written as JSON, so runs of different releases can be compared.
+    Publish scenarios run the server in a separate process by default, so it does
+    not compete with the client for the GIL.
+
+    Usage: python -m benchmarks.suite [--scenarios NAME ...] [--batch-sizes N ...] [--codecs NAME ...]
+                                      [--publishes N] [--threads N] [--ack-delay SECONDS]
+                                      [--server {process,thread}] [--output PATH]
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import threading
+import time
+import timeit
+
+from fastavro import reader
+
+import pycernan
+
+from pycernan.avro import serde, v1, v2
+from pycernan.avro.serde import parse_schema
+from pycernan.avro.testing import FakeCernanServer
+
+from benchmarks.pipelined_publish import percentile
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'data')
+
+SCENARIOS = ['serialize', 'frame', 'sync', 'async', 'threaded']
+PUBLISH_SCENARIOS = ['sync', 'async', 'threaded']
+BATCH_SIZES = [1, 10, 100, 1000]
+CODECS = ['null', 'deflate', 'snappy']
+
+
+def load_datasets(directory=FIXTURES):
+    """
+        Returns {name: (parsed schema, records)} for each fixture, e.g. data-null.avro
+        and data-deflate.avro both provide the `data` dataset.  Fixtures with codecs
+        that are not installed are skipped.
+    """
+    datasets = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.avro'))):
+        name = os.path.basename(path).split('-')[0]
+        if name in datasets:
+            continue
+        try:
+            with open(path, 'rb') as fixture:
+                container = reader(fixture)
+                records = list(container)
+        except ValueError:
+            continue
+        if records:
+            datasets[name] = (parse_schema(container.writer_schema), records)
+    return datasets
+
+
+def available_codecs(codecs):
+    """
+        Filters out codecs whose compression library is not installed.
+    """
+    return [codec for codec in codecs if codec in serde.available_codecs()]
+
+
+def make_batch(records, size):
+    return [records[i % len(records)] for i in range(size)]
+
+
+def serialize_batch(schema, batch, codec):
+    return serde.serialize(schema, batch, codec=codec)
+
+
+def timed(fn, min_seconds=0.2):
+    """
+        Returns (calls, seconds), calling fn for at least `min_seconds`.
+    """
+    number = 1
+    while True:
+        elapsed = timeit.timeit(fn, number=number)
+        if elapsed >= min_seconds:
+            return number, elapsed
+        number *= 2
+
+
+def run_serialize(schema, batch, codec, **_):
+    calls, elapsed = timed(lambda: serialize_batch(schema, batch, codec))
+    blob_bytes = len(serialize_batch(schema, batch, codec))
+    return {
+        "records_per_s": calls * len(batch) / elapsed,
+        "mb_per_s": calls * blob_bytes / elapsed / 1e6,
+        "blob_bytes": blob_bytes,
+    }
+
+
+def run_frame(blob, **_):
+    results = {}
+    for module in (v1, v2):
+        calls, elapsed = timed(lambda: module.frame(blob, shard_by=1))
+        results["v{}_frames_per_s".format(module.VERSION)] = calls / elapsed
+    return results
+
+
+def run_sync(client, blob, publishes, **_):
+    latencies = []
+    start = time.time()
+    for _ in range(publishes):
+        started = time.time()
+        client.publish_blob(blob)
+        latencies.append(time.time() - started)
+    return publish_result(publishes, time.time() - start, len(blob), latencies)
+
+
+def run_async(client, blob, publishes, **_):
+    start = time.time()
+    for _ in range(publishes - 1):
+        client.publish_blob(blob, sync=False)
+    # Frames on a connection are handled in order, so this ack covers the whole run.
+    client.publish_blob(blob)
+    return publish_result(publishes, time.time() - start, len(blob))
+
+
+def run_threaded(client, blob, publishes, threads, **_):
+    latencies = []
+
+    def worker(n):
+        for _ in range(n):
+            started = time.time()
+            client.publish_blob(blob)
+            latencies.append(time.time() - started)
+
+    workers = [threading.Thread(target=worker, args=(publishes // threads,)) for _ in range(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return publish_result(len(latencies), time.time() - start, len(blob), latencies)
+
+
+def publish_result(publishes, elapsed, blob_bytes, latencies=None):
+    result = {
+        "publishes_per_s": publishes / elapsed,
+        "mb_per_s": publishes * blob_bytes / elapsed / 1e6,
+    }
+    if latencies:
+        result.update({
+            "latency_p50_ms": percentile(latencies, 50) * 1e3,
+            "latency_p99_ms": percentile(latencies, 99) * 1e3,
+        })
+    return result
+
+
+RUNNERS = {
+    'serialize': run_serialize,
+    'frame': run_frame,
+    'sync': run_sync,
+    'async': run_async,
+    'threaded': run_threaded,
+}
+
+
+def _serve(conn, ack_delay):
+    with FakeCernanServer(ack_delay=ack_delay) as server:
+        conn.send(server.port)
+        # Serve until the parent asks to stop.
+        conn.recv()
+
+
+class ServerProcess(object):
+    """
+        Runs a FakeCernanServer in a child process.
+    """
+
+    def __init__(self, ack_delay=0):
+        self.host = '127.0.0.1'
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve, args=(child_conn, ack_delay))
+        self._process.daemon = True
+
+    def __enter__(self):
+        self._process.start()
+        self.port = self._conn.recv()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._conn.send(None)
+        self._process.join()
+
+
+def run(scenarios=SCENARIOS, batch_sizes=BATCH_SIZES, codecs=CODECS, publishes=2000, threads=4, ack_delay=0,
+        server='process'):
+    codecs = available_codecs(codecs)
+    datasets = load_datasets()
+    results = []
+
+    server_context = ServerProcess(ack_delay) if server == 'process' else FakeCernanServer(ack_delay=ack_delay)
+    with server_context as cernan:
+        for name, (schema, records) in sorted(datasets.items()):
+            for codec in codecs:
+                for size in batch_sizes:
+                    batch = make_batch(records, size)
+                    blob = serialize_batch(schema, batch, codec)
+                    # Larger batches are published fewer times, keeping records sent per scenario similar.
+                    count = max(threads, publishes // size)
+                    params = {"dataset": name, "codec": codec, "batch_size": size}
+                    for scenario in scenarios:
+                        if scenario in PUBLISH_SCENARIOS:
+                            client = v1.Client(host=cernan.host, port=cernan.port, maxsize=threads)
+                        else:
+                            client = None
+                        result = RUNNERS[scenario](schema=schema, batch=batch, codec=codec, blob=blob, client=client,
+                                                   publishes=count, threads=threads)
+                        if client is not None:
+                            client.close()
+
+                        result.update(params, scenario=scenario)
+                        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--batch-sizes", nargs='+', type=int, default=BATCH_SIZES)
+    parser.add_argument("--codecs", nargs='+', default=CODECS)
+    parser.add_argument("--publishes", type=int, default=2000, help="Publishes per scenario of single record batches.")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--ack-delay", type=float, default=0)
+    parser.add_argument("--server", choices=['process', 'thread'], default='process')
+    parser.add_argument("--output", help="Write JSON here instead of stdout.")
+    args = parser.parse_args()
+
+    report = {
+        "pycernan_version": pycernan.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "publishes": args.publishes,
+            "threads": args.threads,
+            "ack_delay": args.ack_delay,
+            "server": args.server,
+        },
+        "results": run(args.scenarios, args.batch_sizes, args.codecs, args.publishes, args.threads, args.ack_delay,
+                       args.server),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+    Per record encode time under each validation mode, for the schemas of
+    tests/unit/avro/test_serde.py.
+
+    Batches are written uncompressed, so the time saved by skipping validation is
+    not diluted by compression.  Savings are relative to validating every batch.
+
+    Usage: python -m benchmarks.validation [--batch-size N]
+"""
+import argparse
+from datetime import datetime
+from decimal import Decimal
+
+from pytz import timezone
+
+from pycernan.avro.serde import serialize
+from pycernan.avro.validation import Validation
+
+from benchmarks.suite import make_batch, timed
+from tests.unit.avro.test_serde import BOOK_SCHEMA_WRITE, TEST_SCHEMA_LOGICAL_TYPES, USER_SCHEMA
+
+DATASETS = {
+    'user': (USER_SCHEMA, [
+        {'name': 'Foo Bar Matic', 'favorite_number': 24, 'favorite_color': 'Nonyabusiness'},
+        {'name': 'Ms. Null', 'favorite_number': None, 'favorite_color': None},
+    ]),
+    'book': (BOOK_SCHEMA_WRITE, [
+        {'title': 'Moby Dick', 'first_sentence': 'Call me Ishmael.'},
+        {'title': 'A Tale of Two Cities', 'first_sentence': 'It was the best of times, it was the worst of times.'},
+    ]),
+    'logical': (TEST_SCHEMA_LOGICAL_TYPES, [
+        {
+            'ts': datetime(2018, 1, 1, tzinfo=timezone('UTC')),
+            'customer_uuid': 'some_random_uuid',
+            'decimal_bytes': Decimal('-2.90'),
+            'decimal_fixed': Decimal('3.68'),
+        },
+        {'ts': None, 'customer_uuid': None, 'decimal_bytes': None, 'decimal_fixed': None},
+    ]),
+}
+
+MODES = [
+    ('always', lambda: Validation('always')),
+    ('never', lambda: Validation('never')),
+    ('sampled-10', lambda: Validation('sampled', sample_rate=10)),
+    ('first_n-10', lambda: Validation('first_n', first_n=10)),
+]
+
+
+def run(batch_size=1000):
+    results = []
+    for name, (schema, records) in sorted(DATASETS.items()):
+        batch = make_batch(records, batch_size)
+        baseline = None
+        for mode, make_validation in MODES:
+            validation = make_validation()
+            calls, elapsed = timed(lambda: serialize(schema, batch, codec='null', validation=validation))
+            record_us = elapsed / calls / batch_size * 1e6
+            baseline = baseline or record_us
+            results.append({
+                "dataset": name,
+                "mode": mode,
+                "record_us": record_us,
+                "saved_pct": (1 - record_us / baseline) * 100,
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    for result in run(args.batch_size):
+        print("{dataset:>8} {mode:>10}: {record_us:7.3f}us/record {saved_pct:6.1f}% saved".format(**result))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from pycernan.avro.v1 import Client  # noqa
 from pycernan.avro.dummy import BaseDummyClient, DummyClient  # noqa
+from pycernan.avro.buffered import BufferedClient  # noqa
 
 __all__ = []
@@ -0,0 +1,6 @@
+"""
+    asyncio clients for Cernan's Avro source.
+"""
+from pycernan.avro.aio.v1 import Client  # noqa
+
+__all__ = []
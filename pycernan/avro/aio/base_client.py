@@ -0,0 +1,43 @@
+import asyncio
+
+from pycernan.avro.aio.client import Client
+from pycernan.avro.base_client import _ID, NUM_ID_BYTES
+from pycernan.avro.exceptions import ConnectionResetException, InvalidAckException
+from pycernan.avro import framing, metrics
+
+
+class BaseClient(Client):
+    async def _send_exact(self, conn, payload):
+        payload_len = framing.payload_len(payload)
+        metrics.bytes_sent.inc(payload_len)
+        metrics.event_size_bytes.observe(payload_len)
+        with metrics.publish_latency.time():
+            if isinstance(payload, (list, tuple)):
+                conn.writer.writelines(payload)
+            else:
+                conn.writer.write(payload)
+            await asyncio.wait_for(conn.writer.drain(), timeout=self.publish_timeout)
+
+    async def _recv_exact(self, conn, n_bytes):
+        try:
+            return await asyncio.wait_for(conn.reader.readexactly(n_bytes), timeout=self.publish_timeout)
+        except asyncio.IncompleteReadError:
+            raise ConnectionResetException()
+
+    async def _send(self, payload_id, sync, payload):
+        async with self.pool.connection() as conn:
+            metrics.publish_count.inc()
+            await self._send_exact(conn, payload)
+            if sync:
+                metrics.ack_request_count.inc()
+                with metrics.ack_latency.time():
+                    await self._wait_for_ack(conn, payload_id)
+                metrics.ack_count.inc()
+
+    async def _wait_for_ack(self, conn, payload_id):
+        id_bytes = await self._recv_exact(conn, NUM_ID_BYTES)
+        metrics.bytes_received.inc(len(id_bytes))
+        (recv_id,) = _ID.unpack(id_bytes)
+        if recv_id != payload_id:
+            metrics.ack_invalid_count.inc()
+            raise InvalidAckException()
@@ -0,0 +1,114 @@
+"""
+    Base asyncio Avro client from which all other asyncio clients derive.
+"""
+import asyncio
+import functools
+
+import pycernan.avro.config
+
+from abc import ABCMeta, abstractmethod
+
+from pycernan.avro.exceptions import EmptyBatchException
+from pycernan.avro.serde import as_codec, serialize
+from pycernan.avro.validation import as_validation
+from pycernan.avro import metrics
+from pycernan.avro.aio.tcp_conn_pool import TCPConnectionPool
+
+
+class Client(object, metaclass=ABCMeta):
+    """
+        Interface specification for all asyncio Avro clients.
+    """
+
+    def __init__(self, host=None, port=None, connect_timeout=50, publish_timeout=10, maxsize=10,
+                 offload_serialization=False, executor=None, codec=None, validation=None):
+        """
+            Kwargs:
+                host, port, connect_timeout, publish_timeout, maxsize - See pycernan.avro.client.Client.
+                offload_serialization: bool - Serialize batches and read files in `executor`
+                                       rather than on the event loop.  Default = False.
+                executor: concurrent.futures.Executor - Executor used when offloading.
+                          Default = None, the loop's default executor.
+                codec: pycernan.avro.serde.Codec or str - Compression of published batches.
+                       Default = None, pycernan.avro.serde.DEFAULT_CODEC.
+                validation: pycernan.avro.validation.Validation or str - Decides which batches are
+                            validated.  Default = None, the process wide policy.
+        """
+        host = host or pycernan.avro.config.host()
+        port = port or pycernan.avro.config.port()
+
+        self.connect_timeout = connect_timeout
+        self.publish_timeout = publish_timeout
+        self.offload_serialization = offload_serialization
+        self.executor = executor
+        self.codec = None if codec is None else as_codec(codec)
+        self.validation = None if validation is None else as_validation(validation)
+
+        self.pool = TCPConnectionPool(
+            host,
+            port,
+            maxsize=maxsize,
+            connect_timeout=connect_timeout,
+            read_timeout=publish_timeout)
+
+    def close(self):
+        """
+            Closes all previously established connections not actively in use.
+        """
+        self.pool.closeall()
+
+    async def _run(self, fn, *args, **kwargs):
+        if not self.offload_serialization:
+            return fn(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def publish(self, schema_map, batch, ephemeral_storage=False, codec=None, validation=None, **kwargs):
+        """
+            Publishes a batch of records corresponding to the given schema.
+
+            Args:
+                schema_map: dict - Avro schema defintion.
+                batch: list - List of Avro records (as dicts).
+
+            Kwargs:
+                ephemeral_storage: bool - Flag to indicate whether the batch
+                                          should be stored long-term.
+                codec: Codec or str - Compression of this batch.  Default = the client's codec.
+                validation: Validation, str or bool - Validation policy for this batch.
+                            Default = the client's policy.
+                Others  are version specific options.  See extending object.
+        """
+        with metrics.publish_failure_count.count_exceptions():
+            if not batch:
+                raise EmptyBatchException()
+
+            codec = self.codec if codec is None else codec
+            validation = self.validation if validation is None else validation
+            blob = await self._run(serialize, schema_map, batch, ephemeral_storage, codec=codec, validation=validation)
+            await self.publish_blob(blob, **kwargs)
+
+    async def publish_file(self, file_path, **kwargs):
+        """
+            Reads and publishes an Avro encoded file.
+
+            Args:
+                file_path : string  - Path to the file.
+
+            Kwargs:
+                Version specific options.  See extending object.
+        """
+        avro_blob = await self._run(_read_file, file_path)
+        await self.publish_blob(avro_blob, **kwargs)
+
+    @abstractmethod
+    async def publish_blob(self, avro_blob, **kwargs):
+        """
+            Version specific payload generation / publication.
+        """
+        pass  # pragma: no cover
+
+
+def _read_file(file_path):
+    with open(file_path, "rb") as file:
+        return file.read()
@@ -0,0 +1,127 @@
+import asyncio
+import contextlib
+
+from pycernan.avro.exceptions import EmptyPoolException
+from pycernan.avro import metrics
+
+_DefunctConnection = object()
+
+
+class StreamConnection(object):
+    """
+        Reader / writer pair for a single TCP connection.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        self.writer.close()
+
+
+class TCPConnectionPool(object):
+    """
+    asyncio streams counterpart of pycernan.avro.tcp_conn_pool.TCPConnectionPool.
+
+    Connections are created lazily, at most `maxsize` at a time, and connections
+    that raise while checked out are closed and regenerated on next use.
+
+    The queue of connections is created on first use, inside the running loop,
+    since on Python < 3.10 asyncio.Queue binds to the loop current at creation.
+    Pools may hence be constructed before the loop they are used in is running.
+    """
+
+    def __init__(self, host, port, maxsize, connect_timeout, read_timeout):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be > 0")
+
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = asyncio.Queue()
+            for _ in range(self.maxsize):
+                self._pool.put_nowait(_DefunctConnection)
+        return self._pool
+
+    async def _create_connection(self):
+        metrics.conn_create_count.inc()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port),
+            timeout=self.connect_timeout)
+        return StreamConnection(reader, writer)
+
+    async def _get(self, _block=True):
+        if _block:
+            connection = await self.pool.get()
+        else:
+            try:
+                connection = self.pool.get_nowait()
+            except asyncio.QueueEmpty:
+                # Expected to happen only when users override _block=False
+                raise EmptyPoolException()
+
+        # When a connection is defunct, we attempt to
+        # regenerate it.  Note - it is important that we always return
+        # something back to the queue here so that we don't erode our capacity.
+        if connection is _DefunctConnection:
+            try:
+                connection = await self._create_connection()
+            except BaseException:
+                # Always return a resource to the queue,
+                # even if it is defunct.  BaseException covers cancellation.
+                self._put(_DefunctConnection)
+                raise
+
+        return connection
+
+    def _put(self, item):
+        # Why this function?  It makes mocking in unit tests easier.
+        self.pool.put_nowait(item)
+
+    def closeall(self):
+        """
+            Close established connections currently not in-use.
+        """
+        if self._pool is None:
+            # Never used, so there is nothing to close.
+            return
+
+        try:
+            while True:
+                conn = self.pool.get_nowait()
+                if conn is _DefunctConnection:
+                    continue
+                conn.close()
+        except Exception:
+            pass
+
+    @contextlib.asynccontextmanager
+    async def connection(self, _block=True):
+        """
+            Async context manager for pooled connections.
+        """
+        conn = await self._get(_block)
+        try:
+            yield conn
+        except BaseException:
+            # Cancellation mid-frame leaves the stream in an unknown state,
+            # so it is treated like any other failure.
+            try:
+                conn.close()
+                metrics.conn_close_count.inc()
+            except Exception:
+                pass
+            conn = _DefunctConnection
+            metrics.conn_failure_count.inc()
+            raise
+        finally:
+            self._put(conn)
@@ -0,0 +1,21 @@
+"""
+    asyncio V1 Client for Cernan's Avro source.
+"""
+from pycernan.avro import v1
+from pycernan.avro.aio.base_client import BaseClient
+
+
+class Client(BaseClient):
+    """
+       V1 of the Avro source protocol.  See pycernan.avro.v1.Client.
+    """
+
+    VERSION = v1.VERSION
+
+    async def publish_blob(self, avro_blob, sync=True, payload_id=None, shard_by=None):
+        """
+            Publishes a length prefixed avro payload to a V1 Avro source.
+
+            See pycernan.avro.v1.Client.publish_blob for the payload layout and kwargs.
+        """
+        await self._send(*v1.frame(avro_blob, sync, payload_id, shard_by))
@@ -0,0 +1,21 @@
+"""
+    asyncio V2 Client for Cernan's Avro source.
+"""
+from pycernan.avro import v2
+from pycernan.avro.aio.base_client import BaseClient
+
+
+class Client(BaseClient):
+    """
+       V2 of the Avro source protocol.  See pycernan.avro.v2.Client.
+    """
+
+    VERSION = v2.VERSION
+
+    async def publish_blob(self, avro_blob, sync=True, payload_id=None, shard_by=None, metadata=None):
+        """
+            Publishes a length prefixed Avro payload to a V2 Avro source.
+
+            See pycernan.avro.v2.Client.publish_blob for the payload layout and kwargs.
+        """
+        await self._send(*v2.frame(avro_blob, sync, payload_id, shard_by, metadata))
@@ -1,26 +1,37 @@
 import random
+import socket
 import struct
 
+from concurrent.futures import Future
+
 from pycernan.avro.client import Client
-from pycernan.avro.exceptions import ConnectionResetException, InvalidAckException
-from pycernan.avro import metrics
+from pycernan.avro.exceptions import CircuitOpenException, ConnectionResetException, InvalidAckException
+from pycernan.avro import forking, framing, metrics
+from pycernan.avro.hashing import hash_u64 as _hash_u64
 
-NUM_ID_BYTES = 8
+_ID = struct.Struct(">Q")
+NUM_ID_BYTES = _ID.size
 
-def _hash_u64(value):
-    return hash(value) % 2 ** 64
+# Failures reaching Cernan after which a payload is spooled, if a spool is configured.
+SPOOLED_EXCEPTIONS = (socket.error, ConnectionResetException, CircuitOpenException)
 
 
 def _rand_u64():
     return random.randrange(2 ** 64)
 
 
+def _count_failure(future):
+    if future.exception() is not None:
+        metrics.publish_failure_count.inc()
+
+
 class BaseClient(Client):
     def _send_exact(self, sock, payload):
-        metrics.bytes_sent.inc(len(payload))
-        metrics.event_size_bytes.observe(len(payload))
+        payload_len = framing.payload_len(payload)
+        metrics.bytes_sent.inc(payload_len)
+        metrics.event_size_bytes.observe(payload_len)
         with metrics.publish_latency.time():
-            sock.sendall(payload)
+            framing.sendall(sock, payload)
 
     def _recv_exact(self, sock, n_bytes):
         buf = bytearray(b'')
@@ -33,8 +44,77 @@ class BaseClient(Client):
 
         return bytes(buf)
 
-    def _send(self, payload_id, sync, payload):
-        with self.pool.connection() as sock:
+    def _send(self, payload_id, sync, payload, shard_by=None):
+        forking.check(self)
+        shard = _hash_u64(shard_by) if shard_by and self.routed else None
+        if self.spool is None:
+            return self._deliver(payload_id, sync, payload, shard)
+
+        # While anything is spooled new payloads are spooled behind it, preserving order.
+        if self.spool.empty():
+            try:
+                return self._deliver(payload_id, sync, payload, shard)
+            except SPOOLED_EXCEPTIONS:
+                pass
+
+        self.spool.append(framing.join(payload))
+        if self.pipelined:
+            future = Future()
+            future.set_result(None)
+            return future
+
+    def publish_file(self, file_path, **kwargs):
+        """
+            Publishes an Avro encoded file.
+
+            The frame header is computed from the file's size and the body is streamed
+            to the socket with socket.sendfile, or from an mmap, so memory use does not
+            grow with the size of the file.  The file must not change while published.
+
+            Args:
+                file_path : string  - Path to the file.
+
+            Kwargs:
+                Version specific options.  See publish_blob.
+        """
+        with open(file_path, "rb") as file:
+            return self.publish_blob(framing.FileRegion(file), **kwargs)
+
+    def spool_blob(self, avro_blob, **kwargs):
+        """
+            Frames an avro payload and writes it to the spool, to be published by the replayer.
+
+            Kwargs:
+                Version specific options.  See publish_blob.
+
+            Raises:
+                SpoolFullException - The spool is full.
+        """
+        if self.spool is None:
+            raise ValueError("Client has no spool configured")
+
+        payload_id, sync, payload = self.frame(avro_blob, **kwargs)
+        self.spool.append(framing.join(payload))
+
+    def _deliver(self, payload_id, sync, payload, shard):
+        # Retries resend the same framed payload, id included, so Cernan can deduplicate.
+        if self.retry is None:
+            return self._transmit(payload_id, sync, payload, shard)
+        return self.retry.call(self._transmit, payload_id, sync, payload, shard)
+
+    def _transmit(self, payload_id, sync, payload, shard=None):
+        # The breaker guards each attempt, so retries stop as soon as it opens.
+        if self.breaker is None:
+            return self._transmit_once(payload_id, sync, payload, shard)
+        return self.breaker.call(self._transmit_once, payload_id, sync, payload, shard)
+
+    def _transmit_once(self, payload_id, sync, payload, shard=None):
+        if self.pipelined:
+            future = self.pool.submit(payload_id, sync, payload)
+            future.add_done_callback(_count_failure)
+            return future
+
+        with (self.pool.connection(shard) if self.routed else self.pool.connection()) as sock:
             metrics.publish_count.inc()
             self._send_exact(sock, payload)
             if sync:
@@ -46,7 +126,7 @@ class BaseClient(Client):
     def _wait_for_ack(self, sock, payload_id):
         id_bytes = self._recv_exact(sock, NUM_ID_BYTES)
         metrics.bytes_received.inc(len(id_bytes))
-        (recv_id,) = struct.unpack(">Q", id_bytes)
+        (recv_id,) = _ID.unpack(id_bytes)
         if recv_id != payload_id:
             metrics.ack_invalid_count.inc()
             raise InvalidAckException()
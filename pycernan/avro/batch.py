@@ -0,0 +1,294 @@
+"""
+    Incremental, size bounded construction of Avro payloads.
+"""
+import zlib
+
+from io import BytesIO
+
+from fastavro import schemaless_writer
+from fastavro.validation import validate
+
+from pycernan.avro.exceptions import DatumTypeException
+from pycernan.avro.schema_cache import parse as cached_parse_schema
+from pycernan.avro.serde import _DATUM_ERRORS, CODEC_DEFLATE, CODEC_NULL, Encoder, _compress_bound, as_codec
+from pycernan.avro.validation import should_validate
+
+# Bytes of the sync marker ending each data block.
+SYNC_SIZE = 16
+
+# Bytes of the longer of the two varints, record count and data size, of a block.
+MAX_LONG_SIZE = 10
+
+# Allowance for deflate re-emitting the Huffman tables of a block it extends, added to
+# size estimates that are not measured.
+DEFLATE_SLACK = 320
+
+# Measuring the deflate stream costs a flush of a copy of the compressor.  Once a batch is
+# within 1 / FILL_DIVISOR of max_bytes, records are only appended while the estimate allows it.
+FILL_DIVISOR = 64
+
+# Default bound on the encoded, uncompressed, bytes of a batch, as a multiple of max_bytes.
+# Records are buffered uncompressed until the batch is built, and Cernan decompresses them.
+ENCODED_BYTES_RATIO = 8
+
+
+def _long_size(n):
+    # Bytes of the zig-zag varint encoding of a non-negative Avro long.
+    n <<= 1
+    size = 1
+    while n > 0x7f:
+        n >>= 7
+        size += 1
+    return size
+
+
+def _write_long(buf, n):
+    n <<= 1
+    while n > 0x7f:
+        buf.write(bytearray([(n & 0x7f) | 0x80]))
+        n >>= 7
+    buf.write(bytearray([n]))
+
+
+class BatchBuilder(object):
+    """
+        Encodes records into a single Avro container of at most `max_bytes` bytes.
+
+        Records are encoded as they are appended, so the size of the container is known
+        before it is built.  A record that would take the container past `max_bytes` (or
+        past `max_records` records, or its encoded records past `max_encoded_bytes`) is
+        refused, so callers can cut payloads exactly at the limit:
+
+            builder = BatchBuilder(schema, 'deflate', 1024 * 1024)
+            for record in records:
+                if builder.append(record):
+                    client.publish_blob(builder.build())
+                    builder.reset()
+                    builder.append(record)
+
+        Deflate compresses records as they are appended.  The compressed size is measured
+        when an estimate cannot rule out the record overflowing the container, until the
+        container is within 1 / FILL_DIVISOR of `max_bytes`, so compressed containers are
+        filled close to the limit.  Snappy and zstandard
+        blocks are compressed by `build`, and sized by their worst case until then.
+
+        Not thread safe.
+    """
+
+    def __init__(self, schema_map, codec=None, max_bytes=1024 * 1024, max_records=None, ephemeral_storage=False,
+                 validation=None, max_encoded_bytes=None, **metadata):
+        """
+            Args:
+                schema_map: dict or pycernan.avro.serde.parse_schema - Avro schema defintion.
+
+            Kwargs:
+                codec: Codec or str - Compression of the container.  Default = DEFAULT_CODEC.
+                max_bytes: int - Upper bound on the size of the container.
+                max_records: int - Maximum records in the container.  Default = None, unbounded.
+                ephemeral_storage: bool - Flag to indicate whether the batch
+                                          should be stored long-term.
+                validation: pycernan.avro.validation.Validation, str or bool - Decides whether the
+                            records of each batch are validated.  Default = None, the process wide policy.
+                max_encoded_bytes: int - Upper bound on the encoded records of the container before
+                                   compression, which are buffered until it is built.  A record that
+                                   exceeds it on its own is still appended to an empty batch.
+                                   Default = None, ENCODED_BYTES_RATIO * max_bytes.
+                **metadata: dict - User defined metadata included in the header.
+
+            Raises:
+                ValueError - max_encoded_bytes is not positive.
+        """
+        if max_encoded_bytes is None:
+            max_encoded_bytes = ENCODED_BYTES_RATIO * max_bytes
+        if max_encoded_bytes <= 0:
+            raise ValueError("max_encoded_bytes must be > 0")
+
+        self.parsed_schema = cached_parse_schema(schema_map)
+        self.codec = as_codec(codec)
+        self.max_bytes = max_bytes
+        self.max_records = max_records
+        self.max_encoded_bytes = max_encoded_bytes
+        self.validation = validation
+        self.encoder = Encoder(self.parsed_schema, self.codec, ephemeral_storage, **metadata)
+        self._headers = {}
+        self._block = BytesIO()
+        self._record = BytesIO()
+        self._compressed = BytesIO()
+        # Bytes of a container besides its data, whichever codec it is built with.
+        self._overhead = max(self._header_size(CODEC_NULL), self._header_size(self.codec.name)) + 2 * MAX_LONG_SIZE + SYNC_SIZE
+        self.reset()
+
+    def reset(self):
+        """
+            Empties the builder, keeping its buffers for the next batch.
+        """
+        self._block.seek(0)
+        self._block.truncate()
+        self._compressed.seek(0)
+        self._compressed.truncate()
+        self.num_records = 0
+        self._validate = None
+        self._deflater = None
+        # Compressed size when last measured, and encoded bytes appended since.
+        self._measured = 0
+        self._unmeasured = 0
+        if self.codec.name == CODEC_DEFLATE:
+            level = zlib.Z_DEFAULT_COMPRESSION if self.codec.level is None else self.codec.level
+            self._deflater = zlib.compressobj(level, zlib.DEFLATED, -15)
+            self._measured = len(self._deflater.copy().flush())
+        self._update_headroom()
+
+    def _update_headroom(self):
+        # Encoded bytes that can be appended, beyond the unmeasured ones, without sizing the container.
+        if self.codec.name == CODEC_NULL:
+            self._headroom = self.max_bytes - self._overhead
+        elif self._deflater is not None:
+            available = self.max_bytes - self._overhead - self._measured - DEFLATE_SLACK - _compress_bound(CODEC_DEFLATE, 0)
+            # The deflate bound grows by less than 16390 / 16384 bytes per byte.
+            self._headroom = available * 16384 // 16390
+        else:
+            self._headroom = 0
+
+    @property
+    def encoded_bytes(self):
+        """
+            Bytes of the records appended, before compression.
+        """
+        return self._block.tell()
+
+    @property
+    def compressed_bytes(self):
+        """
+            Bytes of the data block as compressed by the codec the container is built with.
+            Exact for null and deflate, a worst case bound for other codecs.
+        """
+        return self._data_size(self.encoded_bytes, measure=True)
+
+    @property
+    def size(self):
+        """
+            Bytes of the container `build` returns.  Exact for null and deflate, a worst
+            case bound for other codecs.
+        """
+        return self._container_size(self.num_records, self.encoded_bytes, self.compressed_bytes)
+
+    def __len__(self):
+        return self.num_records
+
+    def _header_size(self, name):
+        size = self._headers.get(name)
+        if size is None:
+            size = self._headers[name] = len(self.encoder.header(name))
+        return size
+
+    def _container_size(self, num_records, encoded_bytes, data_size):
+        name = self.codec.name_for(encoded_bytes)
+        return self._header_size(name) + _long_size(num_records) + _long_size(data_size) + data_size + SYNC_SIZE
+
+    def _data_size(self, encoded_bytes, measure=False):
+        name = self.codec.name_for(encoded_bytes)
+        if name == CODEC_NULL:
+            return encoded_bytes
+        if name != CODEC_DEFLATE:
+            return _compress_bound(name, encoded_bytes)
+        if measure and self._unmeasured:
+            self._measured = self._compressed.tell() + len(self._deflater.copy().flush())
+            self._unmeasured = 0
+            self._update_headroom()
+        # Estimated by the deflate bound on the bytes since the last measurement, plus DEFLATE_SLACK.
+        unmeasured = encoded_bytes - self.encoded_bytes + self._unmeasured
+        if not unmeasured:
+            return self._measured
+        return self._measured + _compress_bound(name, unmeasured) + DEFLATE_SLACK
+
+    def _fits(self, record_bytes):
+        """
+            Returns (fits, compressed size with the record if it was measured).
+        """
+        encoded_bytes = self.encoded_bytes + len(record_bytes)
+        num_records = self.num_records + 1
+        if self._container_size(num_records, encoded_bytes, self._data_size(encoded_bytes)) <= self.max_bytes:
+            return True, None
+        if self._deflater is None or self.codec.name_for(encoded_bytes) != CODEC_DEFLATE:
+            return False, None
+        if self._container_size(self.num_records, self.encoded_bytes, self._measured) >= self.max_bytes - self.max_bytes // FILL_DIVISOR:
+            return False, None
+
+        # Measures the compressed size with the record, without committing the compressor to it.
+        trial = self._deflater.copy()
+        data_size = self._compressed.tell() + len(trial.compress(record_bytes)) + len(trial.flush())
+        return self._container_size(num_records, encoded_bytes, data_size) <= self.max_bytes, data_size
+
+    def append(self, record):
+        """
+            Encodes and appends a record, unless the batch is full.
+
+            Args:
+                record: dict - Avro record.
+
+            Returns:
+                bool - True if the batch is full, by max_bytes, max_records or max_encoded_bytes,
+                       and the record was not appended.  The record belongs to the next batch.
+
+            Raises:
+                DatumTypeException - The record does not match the schema.
+                ValueError - The record cannot fit in an empty batch.
+        """
+        if self.max_records is not None and self.num_records >= self.max_records:
+            return True
+        if self._validate is None:
+            # Validation is decided once per batch.
+            self._validate = should_validate(self.validation, self.parsed_schema)
+
+        self._record.seek(0)
+        self._record.truncate()
+        try:
+            if self._validate:
+                validate(record, self.parsed_schema, raise_errors=True)
+            schemaless_writer(self._record, self.parsed_schema, record)
+        except _DATUM_ERRORS as e:
+            raise DatumTypeException(e)
+        record_bytes = self._record.getvalue()
+        record_len = len(record_bytes)
+        if self.num_records and self.encoded_bytes + record_len > self.max_encoded_bytes:
+            return True
+
+        measured = None
+        if self._unmeasured + record_len > self._headroom or self.encoded_bytes + record_len < self.codec.min_bytes:
+            fits, measured = self._fits(record_bytes)
+            if not fits:
+                if not self.num_records:
+                    raise ValueError("Record of {} bytes cannot fit in a {} byte payload".format(record_len, self.max_bytes))
+                return True
+
+        self._block.write(record_bytes)
+        self.num_records += 1
+        if self._deflater is not None:
+            self._compressed.write(self._deflater.compress(record_bytes))
+        if measured is None:
+            self._unmeasured += record_len
+        else:
+            self._measured, self._unmeasured = measured, 0
+            self._update_headroom()
+        return False
+
+    def build(self):
+        """
+            Returns the records appended as an Avro object container file, ready for
+            `publish_blob`.  Records are not encoded again.  The builder is left as is.
+
+            Returns:
+                bytes
+        """
+        name = self.codec.name_for(self.encoded_bytes)
+        if name != CODEC_DEFLATE or self._deflater is None:
+            return self.encoder.encode_block(self._block, self.num_records)
+
+        data = self._compressed.getvalue() + self._deflater.copy().flush()
+        avro_buf = BytesIO()
+        avro_buf.write(self.encoder.header(name))
+        _write_long(avro_buf, self.num_records)
+        _write_long(avro_buf, len(data))
+        avro_buf.write(data)
+        avro_buf.write(self.encoder.sync_marker)
+        return avro_buf.getvalue()
@@ -0,0 +1,152 @@
+"""
+    Circuit breaker failing publishes fast while Cernan is unhealthy.
+"""
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import Future
+
+from pycernan.avro import metrics
+from pycernan.avro.exceptions import CircuitOpenException
+from pycernan.avro.retry import RETRYABLE_EXCEPTIONS
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+
+class CircuitBreaker(object):
+    """
+        Three state circuit breaker.
+
+        Closed: calls proceed.  The breaker opens after `failure_threshold`
+        consecutive failures or, once the last `window` calls include at least
+        `min_calls`, when their failure rate reaches `failure_rate`.
+
+        Open: calls raise CircuitOpenException without touching the network,
+        until `reset_timeout` seconds have passed.
+
+        Half open: up to `probes` calls proceed.  A success closes the breaker,
+        a failure opens it again.
+
+        Only `failure_exceptions` count as failures.  Other exceptions, such as
+        application errors, leave the breaker's state unchanged.
+    """
+
+    def __init__(self, failure_threshold=5, failure_rate=None, window=20, min_calls=10, reset_timeout=30, probes=1,
+                 failure_exceptions=RETRYABLE_EXCEPTIONS):
+        """
+            Kwargs:
+                failure_threshold: int - Consecutive failures that open the breaker.
+                failure_rate: float - Fraction of failed calls, among the last `window`, that opens
+                              the breaker.  Default = None, consecutive failures only.
+                window: int - Number of recent calls the failure rate is computed over.
+                min_calls: int - Calls required in the window before the failure rate applies.
+                reset_timeout: float - Seconds the breaker stays open before probing.
+                probes: int - Concurrent calls allowed while half open.
+                failure_exceptions: tuple - Exception types counted as failures.
+        """
+        if failure_threshold <= 0 or probes <= 0:
+            raise ValueError("failure_threshold and probes must be > 0")
+        if failure_rate is not None and not 0 < failure_rate <= 1:
+            raise ValueError("failure_rate must be within (0, 1]")
+
+        self.failure_threshold = failure_threshold
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.probes = probes
+        self.failure_exceptions = failure_exceptions
+
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._probes_in_flight = 0
+        self.state = CLOSED
+        metrics.circuit_state.set(_STATE_VALUES[CLOSED])
+
+    def _transition(self, state):
+        # Called with self._lock held.
+        self.state = state
+        self._consecutive_failures = 0
+        self._outcomes.clear()
+        self._probes_in_flight = 0
+        self._opened_at = time.time() if state == OPEN else None
+        metrics.circuit_state.set(_STATE_VALUES[state])
+        metrics.circuit_transition_count.labels(state).inc()
+
+    def allow(self):
+        """
+            Reserves a call.
+
+            Raises:
+                CircuitOpenException - The breaker is open, or half open with every probe in flight.
+        """
+        with self._lock:
+            if self.state == OPEN and time.time() - self._opened_at >= self.reset_timeout:
+                self._transition(HALF_OPEN)
+
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and self._probes_in_flight < self.probes:
+                self._probes_in_flight += 1
+                return
+
+        metrics.circuit_rejected_count.inc()
+        raise CircuitOpenException()
+
+    def record(self, exc=None):
+        """
+            Records the outcome of a call reserved by `allow`.
+
+            Kwargs:
+                exc: Exception - The call's failure.  Default = None, success.
+        """
+        failed = isinstance(exc, self.failure_exceptions)
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if failed:
+                    self._transition(OPEN)
+                elif exc is None:
+                    self._transition(CLOSED)
+                return
+
+            if self.state != CLOSED or (exc is not None and not failed):
+                return
+
+            self._outcomes.append(failed)
+            self._consecutive_failures = self._consecutive_failures + 1 if failed else 0
+            if self._consecutive_failures >= self.failure_threshold or self._rate_exceeded():
+                self._transition(OPEN)
+
+    def _rate_exceeded(self):
+        if self.failure_rate is None or len(self._outcomes) < self.min_calls:
+            return False
+        return sum(self._outcomes) >= self.failure_rate * len(self._outcomes)
+
+    def call(self, fn, *args):
+        """
+            Calls fn(*args) if the breaker allows it, recording the outcome.
+
+            A returned concurrent.futures.Future is recorded once it resolves.
+
+            Raises:
+                CircuitOpenException - The call was rejected.
+        """
+        self.allow()
+        try:
+            result = fn(*args)
+        except Exception as e:
+            self.record(e)
+            raise
+
+        if isinstance(result, Future):
+            result.add_done_callback(lambda future: self.record(future.exception()))
+        else:
+            self.record()
+        return result
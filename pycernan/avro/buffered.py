@@ -0,0 +1,376 @@
+"""
+    Background batching producer.
+"""
+import logging
+import threading
+import time
+
+from collections import deque
+from io import BytesIO
+
+from pycernan.avro import config, forking, metrics
+from pycernan.avro.exceptions import BufferFullException, ClientClosedException, EmptyBatchException
+from pycernan.avro.schema_cache import parse as cached_parse_schema
+from pycernan.avro.serde import Encoder, _flatten, as_codec, encode_record
+from pycernan.avro.validation import as_validation, should_validate
+from pycernan.avro.v1 import Client
+
+logger = logging.getLogger(__name__)
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+FULL_POLICY_BLOCK = 'block'
+FULL_POLICY_DROP = 'drop'
+FULL_POLICY_SPOOL = 'spool'
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+def _freeze_kwargs(kwargs):
+    # Publish options are part of the accumulator key, so must be hashable.
+    frozen = _freeze(kwargs)
+    for name, value in frozen:
+        try:
+            hash(value)
+        except TypeError:
+            raise ValueError("publish option '{}' must be hashable, got {}".format(name, type(value).__name__))
+    return frozen
+
+
+class _Accumulator(object):
+    """
+        Records, already block encoded, destined for a single payload.
+    """
+
+    def __init__(self, key, parsed_schema, ephemeral_storage, codec, publish_kwargs):
+        self.key = key
+        self.parsed_schema = parsed_schema
+        self.ephemeral_storage = ephemeral_storage
+        self.codec = codec
+        self.publish_kwargs = publish_kwargs
+        self.created = _monotonic()
+        self.block = BytesIO()
+        self.num_records = 0
+        self.full_reason = None
+
+    @property
+    def num_bytes(self):
+        return self.block.tell()
+
+
+class BufferedClient(object):
+    """
+        Publishes records asynchronously, batching them per schema.
+
+        Records handed to `publish` are validated, encoded and appended to an
+        in-memory accumulator keyed by schema and publish options.  Background
+        workers serialize and publish an accumulator through the wrapped client
+        once it has lingered for `linger_ms`, or holds `max_records` records or
+        `max_bytes` encoded bytes.  Payloads sharing an accumulator key are
+        published in order.
+
+        In a forked child, records buffered by the parent are discarded, since
+        the parent publishes them, and fresh workers are started.
+    """
+
+    def __init__(self, client=None, linger_ms=100, max_records=1000, max_bytes=1024 * 1024,
+                 max_buffered_records=100000, full_policy=FULL_POLICY_BLOCK, full_timeout=None,
+                 num_workers=1, codec=None, validation=None, **client_kwargs):
+        """
+            Kwargs:
+                client: pycernan.avro.client.Client - Client used to publish batches.
+                        Default = pycernan.avro.Client(**client_kwargs).
+                linger_ms: int - Maximum time a record waits to be batched.
+                max_records: int - Records per batch that trigger an immediate flush.
+                max_bytes: int - Encoded bytes per batch that trigger an immediate flush.
+                max_buffered_records: int - Records buffered, across all batches, before the buffer is full.
+                full_policy: str - 'block' waits for buffer space, 'drop' discards records, 'spool' writes
+                             each record to the wrapped client's spool.  Default = 'block'.
+                full_timeout: float - Seconds to wait for buffer space before raising BufferFullException.
+                              Default = None, wait indefinitely.
+                num_workers: int - Number of background publishing threads.
+                codec: pycernan.avro.serde.Codec or str - Compression of published batches.
+                       Default = None, pycernan.avro.serde.DEFAULT_CODEC.
+                validation: pycernan.avro.validation.Validation or str - Decides which batches passed
+                            to `publish` are validated.  Default = None, the process wide policy.
+        """
+        if full_policy not in (FULL_POLICY_BLOCK, FULL_POLICY_DROP, FULL_POLICY_SPOOL):
+            raise ValueError("full_policy must be one of 'block', 'drop', 'spool'")
+        if min(max_records, max_bytes, max_buffered_records, num_workers) <= 0:
+            raise ValueError("max_records, max_bytes, max_buffered_records and num_workers must be > 0")
+
+        self.client = client or Client(**client_kwargs)
+        if full_policy == FULL_POLICY_SPOOL and getattr(self.client, 'spool', None) is None:
+            raise ValueError("full_policy 'spool' requires a client with a spool")
+        self.linger = linger_ms / 1000.0
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.max_buffered_records = max_buffered_records
+        self.full_policy = full_policy
+        self.full_timeout = full_timeout
+        self.codec = None if codec is None else as_codec(codec)
+        self.validation = None if validation is None else as_validation(validation)
+
+        self.num_workers = num_workers
+        self._closed = False
+        self._reset()
+        forking.register(self)
+
+    def _after_fork(self):
+        # The parent publishes what it buffered; its workers did not survive the fork.
+        metrics.buffer_depth.dec(self._buffered)
+        self._reset()
+
+    def _reset(self):
+        self._cond = threading.Condition()
+        self._accumulators = {}
+        self._full = deque()
+        self._in_flight = set()
+        self._buffered = 0
+        self._flush_requested = False
+        # Encoders, sharing container headers across payloads, by schema identity and options.
+        # Guarded by their own lock, since workers use them outside of self._cond.
+        self._encoders = {}
+        self._encoders_lock = threading.Lock()
+
+        self._workers = []
+        if self._closed:
+            return
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._run, name='pycernan-buffered-{}'.format(i))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def publish(self, schema_map, batch, ephemeral_storage=False, codec=None, validation=None, **kwargs):
+        """
+            Buffers a batch of records corresponding to the given schema.
+
+            Args:
+                schema_map: dict - Avro schema defintion.
+                batch: list - List of Avro records (as dicts) or generators of records.
+
+            Kwargs:
+                ephemeral_storage: bool - Flag to indicate whether the batch
+                                          should be stored long-term.
+                codec: Codec or str - Compression of the payload.  Default = the buffered client's codec.
+                validation: Validation, str or bool - Validation policy for this batch.
+                            Default = the buffered client's policy.
+                Others are passed through to the wrapped client's `publish_blob`.  They
+                key the batches records are buffered in, so must be hashable.
+
+            Raises:
+                ValueError - A publish option is not hashable.
+                DatumTypeException - A record does not match the schema.  None of the batch is buffered.
+                BufferFullException - No buffer space became available within `full_timeout`.
+                SpoolFullException - The buffer and the client's spool are both full.
+                ClientClosedException - The client has been closed.
+        """
+        if not batch:
+            raise EmptyBatchException()
+
+        forking.check(self)
+        parsed_schema = cached_parse_schema(schema_map)
+        codec = self.codec if codec is None else as_codec(codec)
+        key = (id(parsed_schema), bool(ephemeral_storage), codec, _freeze_kwargs(kwargs))
+        validate = should_validate(self.validation if validation is None else validation, parsed_schema)
+
+        # The whole batch is encoded, outside of the lock, before any of it is buffered, so a
+        # record that does not match the schema leaves nothing buffered.
+        encoded = BytesIO()
+        records = []
+        for record in _flatten(batch):
+            encoded.seek(0)
+            encoded.truncate()
+            encode_record(parsed_schema, record, encoded, validate)
+            records.append(encoded.getvalue())
+
+        for record_bytes in records:
+            with self._cond:
+                if not self._reserve():
+                    if self.full_policy == FULL_POLICY_SPOOL:
+                        # Spooled records are replayed independently of, and may overtake, buffered ones.
+                        blob = self._encoder(parsed_schema, ephemeral_storage, codec).encode_block(BytesIO(record_bytes), 1)
+                        self.client.spool_blob(blob, **kwargs)
+                    else:
+                        metrics.buffer_drop_count.inc()
+                    continue
+
+                acc = self._accumulators.get(key)
+                if acc is None:
+                    acc = _Accumulator(key, parsed_schema, ephemeral_storage, codec, kwargs)
+                    self._accumulators[key] = acc
+                    # Wake workers to pick up the new linger deadline.
+                    self._cond.notify_all()
+
+                acc.block.write(record_bytes)
+                acc.num_records += 1
+                if acc.num_records >= self.max_records:
+                    acc.full_reason = 'max_records'
+                elif acc.num_bytes >= self.max_bytes:
+                    acc.full_reason = 'max_bytes'
+
+                if acc.full_reason:
+                    # Subsequent records start a new accumulator.
+                    del self._accumulators[key]
+                    self._full.append(acc)
+                    self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """
+            Publishes all buffered records.
+
+            Kwargs:
+                timeout: float - Seconds to wait.  Default = None, wait indefinitely.
+
+            Returns:
+                bool - True if the buffer was drained within `timeout`.
+        """
+        forking.check(self)
+        deadline = None if timeout is None else _monotonic() + timeout
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            try:
+                while self._buffered:
+                    remaining = None if deadline is None else deadline - _monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._flush_requested = False
+        return True
+
+    def close(self, timeout=None):
+        """
+            Flushes buffered records, stops workers and closes the wrapped client.
+
+            Kwargs:
+                timeout: float - Seconds to wait for buffered records to be published.
+                         Default = None, wait indefinitely.
+
+            Returns:
+                bool - True if every buffered record was published within `timeout`.
+        """
+        forking.check(self)
+        deadline = None if timeout is None else _monotonic() + timeout
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+        for worker in self._workers:
+            remaining = None if deadline is None else max(0, deadline - _monotonic())
+            worker.join(remaining)
+
+        drained = not any(worker.is_alive() for worker in self._workers)
+        if drained:
+            self.client.close()
+        return drained
+
+    def _reserve(self):
+        # Called with self._cond held.
+        if self._closed:
+            raise ClientClosedException()
+
+        deadline = None if self.full_timeout is None else _monotonic() + self.full_timeout
+        while self._buffered >= self.max_buffered_records:
+            if self.full_policy in (FULL_POLICY_DROP, FULL_POLICY_SPOOL):
+                return False
+
+            remaining = None if deadline is None else deadline - _monotonic()
+            if remaining is not None and remaining <= 0:
+                raise BufferFullException()
+            self._cond.wait(remaining)
+
+            if self._closed:
+                raise ClientClosedException()
+
+        self._buffered += 1
+        metrics.buffer_depth.inc()
+        return True
+
+    def _release(self, num_records):
+        # Called with self._cond held.
+        self._buffered -= num_records
+        metrics.buffer_depth.dec(num_records)
+        self._cond.notify_all()
+
+    def _next_ready(self):
+        """
+            Returns (accumulator, reason, wait) where accumulator is the next batch to
+            publish, if any, and wait is the number of seconds until one is due.
+
+            Called with self._cond held.
+        """
+        # Full accumulators are published first, oldest first, which preserves
+        # per key ordering.  Keys with a publish in flight are skipped.
+        for acc in self._full:
+            if acc.key not in self._in_flight:
+                self._full.remove(acc)
+                return acc, acc.full_reason, None
+
+        now = _monotonic()
+        wait = None
+        for key, acc in self._accumulators.items():
+            if key in self._in_flight:
+                continue
+
+            reason = None
+            if self._closed:
+                reason = 'close'
+            elif self._flush_requested:
+                reason = 'flush'
+            elif acc.created + self.linger <= now:
+                reason = 'linger'
+
+            if reason:
+                del self._accumulators[key]
+                return acc, reason, None
+
+            due = acc.created + self.linger - now
+            wait = due if wait is None else min(wait, due)
+
+        return None, None, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                acc, reason, wait = self._next_ready()
+                while acc is None:
+                    if self._closed and not (self._accumulators or self._full):
+                        return
+                    self._cond.wait(wait)
+                    acc, reason, wait = self._next_ready()
+
+                self._in_flight.add(acc.key)
+
+            try:
+                self._publish(acc, reason)
+            finally:
+                with self._cond:
+                    self._in_flight.discard(acc.key)
+                    self._release(acc.num_records)
+
+    def _encoder(self, parsed_schema, ephemeral_storage, codec):
+        key = (id(parsed_schema), bool(ephemeral_storage), codec)
+        with self._encoders_lock:
+            encoder = self._encoders.get(key)
+            if encoder is None or encoder.parsed_schema is not parsed_schema:
+                if len(self._encoders) >= config.schema_cache_size():
+                    self._encoders.clear()
+                encoder = self._encoders[key] = Encoder(parsed_schema, codec, ephemeral_storage)
+        return encoder
+
+    def _publish(self, acc, reason):
+        metrics.buffer_flush_count.labels(reason).inc()
+        try:
+            encoder = self._encoder(acc.parsed_schema, acc.ephemeral_storage, acc.codec)
+            blob = encoder.encode_block(acc.block, acc.num_records)
+            self.client.publish_blob(blob, **acc.publish_kwargs)
+        except Exception:
+            metrics.buffer_flush_failure_count.inc()
+            logger.exception("Failed to publish %d buffered records", acc.num_records)
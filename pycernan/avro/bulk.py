@@ -0,0 +1,306 @@
+"""
+    Parallel publication of Avro container files, resumable through a checkpoint manifest.
+
+    Run standalone with `python -m pycernan.avro.bulk --manifest backfill.manifest /data/avro`.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from pycernan.avro import metrics
+
+AVRO_SUFFIX = '.avro'
+
+
+def _stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime
+
+
+class Manifest(object):
+    """
+        Append-only record of the files published, one JSON line per file.
+
+        A file is considered published while its size and modification time match
+        those recorded, so files rewritten since are published again.  A line torn
+        by a crash, or otherwise not a valid entry, is ignored, and the file it names
+        is republished.
+    """
+
+    def __init__(self, path):
+        """
+            Args:
+                path: str - Manifest file.  Created if missing.
+        """
+        self.path = path
+        self._published = {}
+        self._lock = threading.Lock()
+
+        line = '\n'
+        if os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                        self._published[entry['path']] = (entry['size'], entry['mtime'])
+                    except (ValueError, KeyError, TypeError):
+                        # Torn, corrupt or not an entry.
+                        continue
+
+        self._file = open(path, 'a')
+        if not line.endswith('\n'):
+            # Terminate a torn line so the next entry starts on a line of its own.
+            self._file.write('\n')
+
+    def __contains__(self, path):
+        recorded = self._published.get(os.path.abspath(path))
+        try:
+            return recorded is not None and tuple(recorded) == _stat(path)
+        except OSError:
+            return False
+
+    def __len__(self):
+        return len(self._published)
+
+    def record(self, path, stat):
+        """
+            Durably records `path` as published.
+
+            Args:
+                path: str - Published file.
+                stat: tuple - (size, mtime) of the file when it was published.
+        """
+        path = os.path.abspath(path)
+        line = json.dumps({'path': path, 'size': stat[0], 'mtime': stat[1]}) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._published[path] = stat
+
+    def close(self):
+        self._file.close()
+
+
+class Progress(object):
+    """
+        Running totals of a publish_files call, and its result once complete.
+
+        `failures` maps each file that was not published to the exception raised.
+    """
+
+    def __init__(self, total_files, total_bytes):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.published = 0
+        self.skipped = 0
+        self.published_bytes = 0
+        self.failures = OrderedDict()
+        self.start = time.time()
+        self.end = None
+
+    @property
+    def failed(self):
+        return len(self.failures)
+
+    @property
+    def done(self):
+        return self.published + self.skipped + self.failed
+
+    @property
+    def elapsed(self):
+        return (self.end or time.time()) - self.start
+
+    @property
+    def bytes_per_second(self):
+        return self.published_bytes / max(self.elapsed, 1e-9)
+
+    @property
+    def files_per_second(self):
+        return self.published / max(self.elapsed, 1e-9)
+
+    def __repr__(self):
+        return "{}/{} files, {} published, {} skipped, {} failed, {:.1f} MB/s".format(
+            self.done, self.total_files, self.published, self.skipped, self.failed,
+            self.bytes_per_second / 2.0 ** 20)
+
+
+def find_files(paths, suffix=AVRO_SUFFIX):
+    """
+        Expands directories into the files beneath them ending in `suffix`, in sorted order.
+
+        Args:
+            paths: list - Files and directories.
+
+        Kwargs:
+            suffix: str - Suffix of files found in directories.  Files named explicitly are always kept.
+
+        Returns:
+            list - File paths.
+    """
+    found = []
+    for path in paths:
+        if not os.path.isdir(path):
+            found.append(path)
+            continue
+
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            found.extend(os.path.join(root, name) for name in sorted(files) if name.endswith(suffix))
+    return found
+
+
+def _directory(path):
+    return os.path.dirname(os.path.abspath(path))
+
+
+def _groups(paths, shard_by):
+    if shard_by is None:
+        return [(None, [path]) for path in paths]
+
+    groups = OrderedDict()
+    for path in paths:
+        groups.setdefault(shard_by(path), []).append(path)
+    return list(groups.items())
+
+
+def publish_files(client, paths, concurrency=4, shard_by=None, manifest=None, progress=None, **kwargs):
+    """
+        Publishes Avro container files across `concurrency` worker threads.
+
+        Files are grouped by `shard_by`.  The files of a group are published one after
+        another, in the order given, all with the same shard, so their order is preserved
+        downstream.  If one fails, the rest of its group are not published and are
+        reported as failed with the same exception.  Failures do not stop other groups.
+
+        Args:
+            client: pycernan.avro.client.Client - Client to publish with.  Its pool should
+                    allow at least `concurrency` connections.
+            paths: list - Files to publish.
+
+        Kwargs:
+            concurrency: int - Number of files published at once.
+            shard_by: callable - Maps a path to the `shard_by` value it is published with.
+                      Default = None, each file is published independently.
+            manifest: Manifest or str - Files recorded here are skipped, and files published
+                      are recorded, so an interrupted run can be resumed.  Default = None.
+            progress: callable - Called with the Progress after each file is handled.
+            Others are passed to `client.publish_file`.
+
+        Returns:
+            Progress - Counts, throughput and failures of the run.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    owns_manifest = manifest is not None and not isinstance(manifest, Manifest)
+    if owns_manifest:
+        manifest = Manifest(manifest)
+
+    total_bytes = 0
+    for path in paths:
+        try:
+            total_bytes += os.path.getsize(path)
+        except OSError:
+            pass
+
+    result = Progress(len(paths), total_bytes)
+    lock = threading.Lock()
+
+    def handled(path, outcome, n_bytes=0, exc=None):
+        with lock:
+            if outcome == 'published':
+                result.published += 1
+                result.published_bytes += n_bytes
+            elif outcome == 'skipped':
+                result.skipped += 1
+            else:
+                result.failures[path] = exc
+            metrics.bulk_file_count.labels(outcome).inc()
+            if progress is not None:
+                progress(result)
+
+    def publish_group(key, group):
+        for i, path in enumerate(group):
+            if manifest is not None and path in manifest:
+                handled(path, 'skipped')
+                continue
+
+            try:
+                stat = _stat(path)
+                publish_kwargs = dict(kwargs, shard_by=key) if key is not None else kwargs
+                future = client.publish_file(path, **publish_kwargs)
+                if client.pipelined:
+                    future.result()
+            except Exception as e:
+                for failed in group[i:]:
+                    handled(failed, 'failed', exc=e)
+                return
+
+            if manifest is not None:
+                manifest.record(path, stat)
+            handled(path, 'published', stat[0])
+
+    try:
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            for future in [executor.submit(publish_group, key, group) for key, group in _groups(paths, shard_by)]:
+                future.result()
+        finally:
+            executor.shutdown()
+    finally:
+        result.end = time.time()
+        if owns_manifest:
+            manifest.close()
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publishes Avro container files to Cernan.")
+    parser.add_argument("paths", nargs='+', help="Files, or directories searched for *.avro files.")
+    parser.add_argument("--host", help="Cernan host.  Default = pycernan.avro.config.host().")
+    parser.add_argument("--port", type=int, help="Port of Cernan's Avro source.  Default = pycernan.avro.config.port().")
+    parser.add_argument("--protocol", type=int, choices=[1, 2], default=1, help="Wire protocol version.")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--manifest", help="Checkpoint manifest; files recorded in it are skipped.")
+    parser.add_argument("--shard-by-dir", action='store_true', help="Publish the files of each directory in order.")
+    parser.add_argument("--interval", type=float, default=5, help="Seconds between progress lines.")
+    args = parser.parse_args()
+
+    if args.protocol == 1:
+        from pycernan.avro.v1 import Client
+    else:
+        from pycernan.avro.v2 import Client
+
+    client = Client(host=args.host, port=args.port, maxsize=args.concurrency)
+    paths = find_files(args.paths)
+    last = [time.time()]
+
+    def report(progress):
+        if time.time() - last[0] >= args.interval:
+            last[0] = time.time()
+            print(repr(progress))
+            sys.stdout.flush()
+
+    shard_by = _directory if args.shard_by_dir else None
+    try:
+        result = publish_files(client, paths, concurrency=args.concurrency, shard_by=shard_by,
+                               manifest=args.manifest, progress=report)
+    finally:
+        client.close()
+
+    for path, exc in result.failures.items():
+        print("Failed: {} ({!r})".format(path, exc))
+    print("{!r} in {:.1f}s".format(result, result.elapsed))
+    sys.exit(1 if result.failures else 0)
+
+
+if __name__ == "__main__":
+    main()
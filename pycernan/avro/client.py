@@ -1,16 +1,32 @@
 """
     Base Avro client from which all other clients derive.
 """
+import random
 
 import pycernan.avro.config
 
 from abc import ABCMeta, abstractmethod
 
+from pycernan.avro.batch import BatchBuilder
+from pycernan.avro.endpoints import EndpointPool
 from pycernan.avro.exceptions import EmptyBatchException
-from pycernan.avro.serde import serialize
-from pycernan.avro import metrics
+from pycernan.avro.schema_cache import parse as cached_parse_schema
+from pycernan.avro.serde import _flatten, as_codec, serialize
+from pycernan.avro.validation import as_validation
+from pycernan.avro import forking, metrics
+from pycernan.avro.pipeline import PipelinedConnectionPool
+from pycernan.avro.spool import SpoolReplayer
 from pycernan.avro.tcp_conn_pool import TCPConnectionPool
 
+DEFAULT_MAX_FRAME_BYTES = 1024 * 1024
+
+
+def _schema_name(schema_map):
+    name = schema_map.get('name') if isinstance(schema_map, dict) else None
+    if name and '.' not in name and schema_map.get('namespace'):
+        return '{}.{}'.format(schema_map['namespace'], name)
+    return name
+
 
 class Client(object):
     """
@@ -18,28 +34,134 @@ class Client(object):
     """
     __metaclass__ = ABCMeta
 
-    def __init__(self, host=None, port=None, connect_timeout=50, publish_timeout=10, maxsize=10):
+    def __init__(self, host=None, port=None, connect_timeout=50, publish_timeout=10, maxsize=10, max_in_flight=None,
+                 spool=None, endpoints=None, pool_kwargs=None, retry=None,
+                 breaker=None, serializer=None, codec=None, schema_codecs=None, validation=None):
+        """
+            Kwargs:
+                host: str - Cernan host.  Default = pycernan.avro.config.host().
+                port: int - Port of Cernan's Avro source.  Default = pycernan.avro.config.port().
+                connect_timeout: float - Seconds to wait when establishing connections.
+                publish_timeout: float - Seconds to wait on socket operations.
+                maxsize: int - Maximum number of pooled connections.
+                max_in_flight: int - Enables pipelined mode, in which up to `max_in_flight`
+                               payloads await acknowledgement on each connection and
+                               publish methods return a concurrent.futures.Future
+                               resolved by the ack.  Default = None, one payload at a time.
+                spool: pycernan.avro.spool.Spool - Payloads that cannot reach Cernan are written
+                       here and replayed, in order, by a background thread.  A spool belongs to
+                       the process that created it; forked children publish without one.
+                       Default = None.
+                endpoints: list - (host, port) pairs of Cernan instances to publish to, in place
+                           of host and port.  Payloads are routed between them by `shard_by`.
+                           See pycernan.avro.endpoints.EndpointPool.  Default = None.
+                pool_kwargs: dict - Connection health and TCP options, such as `prewarm`, `max_idle`
+                             and `sndbuf`.  See pycernan.avro.tcp_conn_pool.TCPConnectionPool.
+                             Unused in pipelined mode.
+                retry: pycernan.avro.retry.RetryPolicy - Resends payloads after connection failures,
+                       timeouts and invalid acks.  In pipelined mode only failures to submit
+                       are retried.  Default = None, failures are raised immediately.
+                breaker: pycernan.avro.breaker.CircuitBreaker - Fails publishes fast, raising
+                         CircuitOpenException, while Cernan is failing.  Each retry attempt
+                         passes through the breaker.  With a spool, rejected payloads are
+                         spooled.  Default = None.
+                serializer: pycernan.avro.executor.ProcessSerializer - Serializes batches passed
+                            to `publish` in worker processes.  Default = None, batches are
+                            serialized in the calling thread.
+                codec: pycernan.avro.serde.Codec or str - Compression of published batches,
+                       e.g. 'null', 'deflate' or Codec('deflate', level=9, min_bytes=4096).
+                       Default = None, pycernan.avro.serde.DEFAULT_CODEC.
+                schema_codecs: dict - Codecs by schema full name, e.g. 'example.avro.User',
+                               overriding `codec` for batches of those schemas.
+                validation: pycernan.avro.validation.Validation or str - Decides which batches are
+                            validated before they are encoded, e.g. 'never' or
+                            Validation('sampled', sample_rate=100).  Default = None, the process
+                            wide policy set by PYCERNAN_AVRO_VALIDATION.
+        """
+        if endpoints and max_in_flight:
+            raise ValueError("endpoints cannot be combined with max_in_flight")
+
         host = host or pycernan.avro.config.host()
         port = port or pycernan.avro.config.port()
 
         self.connect_timeout = connect_timeout
         self.publish_timeout = publish_timeout
+        self.pipelined = bool(max_in_flight)
+        self.routed = bool(endpoints)
+        pool_kwargs = pool_kwargs or {}
 
-        self.pool = TCPConnectionPool(
-            host,
-            port,
-            maxsize=maxsize,
-            connect_timeout=connect_timeout,
-            read_timeout=publish_timeout)
+        if self.routed:
+            self.pool = EndpointPool(
+                endpoints,
+                maxsize=maxsize,
+                connect_timeout=connect_timeout,
+                read_timeout=publish_timeout,
+                **pool_kwargs)
+        elif self.pipelined:
+            self.pool = PipelinedConnectionPool(
+                host,
+                port,
+                maxsize=maxsize,
+                connect_timeout=connect_timeout,
+                read_timeout=publish_timeout,
+                max_in_flight=max_in_flight)
+        else:
+            self.pool = TCPConnectionPool(
+                host,
+                port,
+                maxsize=maxsize,
+                connect_timeout=connect_timeout,
+                read_timeout=publish_timeout,
+                **pool_kwargs)
+
+        self.retry = retry
+        self.breaker = breaker
+        self.serializer = serializer
+        self.codec = None if codec is None else as_codec(codec)
+        self.schema_codecs = {name: as_codec(c) for name, c in (schema_codecs or {}).items()}
+        self.validation = None if validation is None else as_validation(validation)
+        self.spool = spool
+        self.replayer = SpoolReplayer(self, spool) if spool is not None else None
+        forking.register(self)
+
+    def _after_fork(self):
+        # Segment files must have a single writer, and the replayer did not survive the fork.
+        self.spool = None
+        self.replayer = None
 
     def close(self):
         """
             Closes all previously established connections not actively in use.
+
+            Stops replaying spooled payloads.  The spool itself is left open.
         """
+        if self.replayer is not None:
+            self.replayer.stop()
         self.pool.closeall()
 
+    def codec_for(self, schema_map, codec=None):
+        """
+            Resolves the codec a batch of `schema_map` is published with.
+
+            Args:
+                schema_map: dict - Avro schema defintion.
+
+            Kwargs:
+                codec: Codec or str - Codec requested for this batch, taking precedence.
+
+            Returns:
+                pycernan.avro.serde.Codec, or None for pycernan.avro.serde.DEFAULT_CODEC.
+        """
+        if codec is not None:
+            return as_codec(codec)
+        if self.schema_codecs:
+            schema_codec = self.schema_codecs.get(_schema_name(schema_map))
+            if schema_codec is not None:
+                return schema_codec
+        return self.codec
+
     @metrics.publish_failure_count.count_exceptions()
-    def publish(self, schema_map, batch, ephemeral_storage=False, **kwargs):
+    def publish(self, schema_map, batch, ephemeral_storage=False, codec=None, validation=None, **kwargs):
         """
             Publishes a batch of records corresponding to the given schema.
 
@@ -50,13 +172,98 @@ class Client(object):
             Kwargs:
                 ephemeral_storage: bool - Flag to indicate whether the batch
                                           should be stored long-term.
+                codec: Codec or str - Compression of this batch.  Default = the client's codec.
+                validation: Validation, str or bool - Validation policy for this batch.
+                            Default = the client's policy.
                 Others  are version specific options.  See extending object.
+
+            Returns:
+                concurrent.futures.Future in pipelined mode, None otherwise.
         """
         if not batch:
             raise EmptyBatchException()
 
-        blob = serialize(schema_map, batch, ephemeral_storage)
-        self.publish_blob(blob, **kwargs)
+        # Only passed when set, so serializers predating these options keep working.
+        serialize_kwargs = {}
+        codec = self.codec_for(schema_map, codec)
+        if codec is not None:
+            serialize_kwargs['codec'] = codec
+        validation = self.validation if validation is None else validation
+        if validation is not None:
+            serialize_kwargs['validation'] = validation
+
+        if self.serializer is not None:
+            blob = self.serializer.serialize(schema_map, batch, ephemeral_storage, **serialize_kwargs)
+        else:
+            blob = serialize(schema_map, batch, ephemeral_storage, **serialize_kwargs)
+        return self.publish_blob(blob, **kwargs)
+
+    @metrics.publish_failure_count.count_exceptions()
+    def publish_iter(self, schema_map, iterable, max_frame_bytes=DEFAULT_MAX_FRAME_BYTES, max_records=None,
+                     ephemeral_storage=False, codec=None, validation=None, max_encoded_bytes=None, **kwargs):
+        """
+            Publishes a stream of records, of any length, as a sequence of size bounded payloads.
+
+            Records are consumed lazily and encoded into a reusable buffer.  A payload is
+            published whenever the next record would take the Avro container past
+            `max_frame_bytes`, once it holds `max_records` records, or once its records
+            would exceed `max_encoded_bytes` before compression, so memory use does not
+            grow with the length of the stream, however well the records compress.
+
+            Payloads are published one after another with the same `shard_by`, which
+            defaults to a random value shared by the whole stream, so their relative
+            order is preserved downstream.  In pipelined mode each payload's ack is
+            awaited before the next is published.
+
+            Args:
+                schema_map: dict - Avro schema defintion.
+                iterable: iterable - Avro records (as dicts) or generators of records.
+
+            Kwargs:
+                max_frame_bytes: int - Upper bound on the size of each Avro payload.
+                max_records: int - Maximum records per payload.  Default = None, unbounded.
+                ephemeral_storage: bool - Flag to indicate whether the records
+                                          should be stored long-term.
+                codec: Codec or str - Compression of each payload.  Default = the client's codec.
+                validation: Validation, str or bool - Validation policy, consulted once per payload.
+                            Default = the client's policy.
+                max_encoded_bytes: int - Maximum bytes of records per payload before compression.
+                                   Default = None, pycernan.avro.batch.ENCODED_BYTES_RATIO * max_frame_bytes.
+                Others  are version specific options.  See extending object.
+
+            Returns:
+                int - Number of payloads published.
+
+            Raises:
+                ValueError - A single record cannot fit within `max_frame_bytes`.
+        """
+        parsed_schema = cached_parse_schema(schema_map)
+        if not kwargs.get('shard_by'):
+            kwargs['shard_by'] = random.randrange(1, 2 ** 64)
+
+        validation = self.validation if validation is None else validation
+        builder = BatchBuilder(parsed_schema, self.codec_for(schema_map, codec), max_frame_bytes, max_records=max_records,
+                               ephemeral_storage=ephemeral_storage, validation=validation,
+                               max_encoded_bytes=max_encoded_bytes)
+        num_payloads = 0
+
+        def publish_batch():
+            result = self.publish_blob(builder.build(), **kwargs)
+            if self.pipelined:
+                result.result()
+            builder.reset()
+
+        for record in _flatten(iterable):
+            if builder.append(record):
+                publish_batch()
+                num_payloads += 1
+                builder.append(record)
+
+        if builder.num_records:
+            publish_batch()
+            num_payloads += 1
+
+        return num_payloads
 
     def publish_file(self, file_path, **kwargs):
         """
@@ -71,7 +278,25 @@ class Client(object):
         with open(file_path, "rb") as file:
             avro_blob = file.read()
 
-        self.publish_blob(avro_blob, **kwargs)
+        return self.publish_blob(avro_blob, **kwargs)
+
+    def publish_files(self, paths, concurrency=4, **kwargs):
+        """
+            Publishes many Avro encoded files in parallel.
+
+            Args:
+                paths : list  - Files to publish.
+
+            Kwargs:
+                concurrency: int - Number of files published at once.  Should not exceed `maxsize`.
+                Others are passed to pycernan.avro.bulk.publish_files, such as `shard_by` and `manifest`.
+
+            Returns:
+                pycernan.avro.bulk.Progress - Counts, throughput and failures of the run.
+        """
+        # Imported here so `python -m pycernan.avro.bulk` does not find the module already loaded.
+        from pycernan.avro import bulk
+        return bulk.publish_files(self, paths, concurrency=concurrency, **kwargs)
 
     @abstractmethod
     def publish_blob(self, avro_blob, **kwargs):
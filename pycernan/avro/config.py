@@ -9,3 +9,15 @@ def host():
 
 def port():
     return int(os.getenv("PYCERNAN_AVRO_PORT", "2002"))
+
+
+def schema_cache_size():
+    return int(os.getenv("PYCERNAN_AVRO_SCHEMA_CACHE_SIZE", "128"))
+
+
+def metrics_backend():
+    return os.getenv("PYCERNAN_AVRO_METRICS_BACKEND", "prometheus")
+
+
+def validation_mode():
+    return os.getenv("PYCERNAN_AVRO_VALIDATION", "always")
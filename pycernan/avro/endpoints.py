@@ -0,0 +1,161 @@
+"""
+    Connection pooling across several Cernan endpoints.
+"""
+import bisect
+import contextlib
+import random
+import socket
+import threading
+import time
+
+from pycernan.avro import forking, metrics
+from pycernan.avro.exceptions import ConnectionResetException
+from pycernan.avro.hashing import hash_u64
+from pycernan.avro.tcp_conn_pool import TCPConnectionPool
+
+# Errors counted against an endpoint's health.  Others, such as an invalid ack, are caused by the payload.
+_ENDPOINT_ERRORS = (socket.error, ConnectionResetException)
+
+
+class Endpoint(object):
+    """
+        A single Cernan endpoint: its connection pool, load and health.
+    """
+
+    def __init__(self, host, port, pool):
+        self.host = host
+        self.port = port
+        self.pool = pool
+        self.active = 0
+        self.failures = 0
+        self.ejected_until = 0
+
+    @property
+    def address(self):
+        return '{}:{}'.format(self.host, self.port)
+
+    def ejected(self, now):
+        return self.ejected_until > now
+
+
+class EndpointPool(object):
+    """
+        One TCPConnectionPool per endpoint, with routing between them.
+
+        Sharded payloads are routed by consistent hashing: each endpoint owns
+        `replicas` points on a 64 bit ring and a shard belongs to the first
+        admitted endpoint at or after its hash.  A shard therefore sticks to one
+        endpoint, preserving order within it, and only shards owned by an endpoint
+        move when it is ejected or re-admitted.  Unsharded payloads go to the
+        admitted endpoint with the fewest connections in use.
+
+        An endpoint is ejected for `eject_seconds` after `max_failures` consecutive
+        connection failures.  Once re-admitted, a single further failure ejects it
+        again.  If every endpoint is ejected, all are treated as admitted.
+    """
+
+    def __init__(self, endpoints, maxsize, connect_timeout, read_timeout, replicas=64, max_failures=3, eject_seconds=30,
+                 **pool_kwargs):
+        """
+            Args:
+                endpoints: list - (host, port) pairs.
+                maxsize: int - Maximum number of pooled connections per endpoint.
+                connect_timeout: float - Seconds to wait when establishing connections.
+                read_timeout: float - Seconds to wait on socket operations.
+
+            Kwargs:
+                replicas: int - Ring points per endpoint.
+                max_failures: int - Consecutive connection failures before an endpoint is ejected.
+                eject_seconds: float - Seconds an ejected endpoint receives no payloads.
+                Others are passed to each endpoint's TCPConnectionPool.
+        """
+        if not endpoints:
+            raise ValueError("At least one endpoint is required")
+        if replicas <= 0 or max_failures <= 0:
+            raise ValueError("replicas and max_failures must be > 0")
+
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+
+        self._lock = threading.Lock()
+        forking.register(self)
+        self.endpoints = [
+            Endpoint(host, port, TCPConnectionPool(host, port, maxsize, connect_timeout, read_timeout, **pool_kwargs))
+            for host, port in endpoints
+        ]
+
+        ring = sorted(
+            (hash_u64((endpoint.address, replica)), i)
+            for i, endpoint in enumerate(self.endpoints)
+            for replica in range(replicas))
+        self._ring_points = [point for point, _ in ring]
+        self._ring_owners = [i for _, i in ring]
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        for endpoint in self.endpoints:
+            endpoint.active = 0
+
+    def _admitted(self):
+        now = time.time()
+        admitted = [endpoint for endpoint in self.endpoints if not endpoint.ejected(now)]
+        return admitted or self.endpoints
+
+    def route(self, shard=None):
+        """
+            Returns the Endpoint a payload should be sent to.
+
+            Kwargs:
+                shard: int - 64 bit shard hash.  Default = None, the least loaded endpoint.
+        """
+        admitted = self._admitted()
+        if shard is None:
+            fewest = min(endpoint.active for endpoint in admitted)
+            return random.choice([endpoint for endpoint in admitted if endpoint.active == fewest])
+
+        start = bisect.bisect_left(self._ring_points, shard)
+        for offset in range(len(self._ring_owners)):
+            endpoint = self.endpoints[self._ring_owners[(start + offset) % len(self._ring_owners)]]
+            if endpoint in admitted:
+                return endpoint
+
+    @contextlib.contextmanager
+    def connection(self, shard=None):
+        """
+            Context manager for a pooled connection to the endpoint chosen by `route`.
+
+            Socket errors and connection resets count towards ejecting the endpoint,
+            other errors are left to the caller.
+        """
+        forking.check(self)
+        endpoint = self.route(shard)
+        with self._lock:
+            endpoint.active += 1
+        try:
+            with endpoint.pool.connection() as conn:
+                yield conn
+        except _ENDPOINT_ERRORS:
+            self._record_failure(endpoint)
+            raise
+        else:
+            with self._lock:
+                endpoint.failures = 0
+        finally:
+            with self._lock:
+                endpoint.active -= 1
+
+    def _record_failure(self, endpoint):
+        with self._lock:
+            endpoint.failures += 1
+            if endpoint.failures >= self.max_failures and not endpoint.ejected(time.time()):
+                endpoint.ejected_until = time.time() + self.eject_seconds
+                # Re-admitted endpoints are ejected again on their next failure.
+                endpoint.failures = self.max_failures - 1
+                metrics.endpoint_ejection_count.labels(endpoint.address).inc()
+
+    def closeall(self):
+        """
+            Close established connections currently not in-use, on every endpoint.
+        """
+        for endpoint in self.endpoints:
+            endpoint.pool.closeall()
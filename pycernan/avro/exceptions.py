@@ -23,3 +23,19 @@ class ConnectionResetException(Exception):
 
 class EmptyPoolException(Exception):
     pass
+
+
+class BufferFullException(Exception):
+    pass
+
+
+class ClientClosedException(Exception):
+    pass
+
+
+class SpoolFullException(Exception):
+    pass
+
+
+class CircuitOpenException(Exception):
+    pass
@@ -0,0 +1,201 @@
+"""
+    Serialization of batches in worker processes, off the publishing process's GIL.
+"""
+import multiprocessing
+import threading
+
+from concurrent.futures import Future, ProcessPoolExecutor
+
+try:
+    from multiprocessing import resource_tracker, shared_memory as _shared_memory
+except ImportError:
+    resource_tracker = _shared_memory = None
+
+from pycernan.avro import config, forking
+from pycernan.avro.schema_cache import cached_fingerprint, is_parsed, parse as cached_parse_schema
+from pycernan.avro.serde import _flatten, serialize
+from pycernan.avro.validation import should_validate
+
+# Blobs at least this large are returned through shared memory rather than pickled over a pipe.
+SHARED_MEMORY_THRESHOLD = 64 * 1024
+
+# Parsed schemas held by a worker process, by fingerprint.
+_worker_schemas = {}
+
+
+def _worker_schema(fp, schema_map):
+    if fp is None:
+        return schema_map
+
+    parsed = _worker_schemas.get(fp)
+    if parsed is None:
+        if len(_worker_schemas) >= config.schema_cache_size():
+            _worker_schemas.clear()
+        parsed = _worker_schemas[fp] = cached_parse_schema(schema_map)
+    return parsed
+
+
+def _init_worker(schemas):
+    for fp, schema_map in schemas:
+        _worker_schema(fp, schema_map)
+
+
+def _create_shared_memory(size):
+    try:
+        return _shared_memory.SharedMemory(create=True, size=size, track=False)
+    except TypeError:
+        # Before Python 3.13 the segment is always tracked, and would be unlinked when
+        # this worker exits.  The parent unlinks it once read.
+        shm = _shared_memory.SharedMemory(create=True, size=size)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _serialize_in_worker(fp, schema_map, records, ephemeral_storage, codec, validate, metadata, use_shared_memory):
+    blob = serialize(_worker_schema(fp, schema_map), records, ephemeral_storage, codec=codec, validation=validate, **metadata)
+    if not use_shared_memory or len(blob) < SHARED_MEMORY_THRESHOLD:
+        return blob
+
+    shm = _create_shared_memory(len(blob))
+    shm.buf[:len(blob)] = blob
+    shm.close()
+    return shm.name, len(blob)
+
+
+def _read_shared_memory(name, size):
+    shm = _shared_memory.SharedMemory(name=name)
+    try:
+        view = shm.buf[:size]
+        try:
+            return bytes(view)
+        finally:
+            view.release()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+class ProcessSerializer(object):
+    """
+        Serializes batches into Avro containers in a pool of worker processes.
+
+        Encoding and compression hold the GIL, so threads sharing a client serialize
+        one batch at a time.  Offloading serialization to worker processes lets batches
+        be encoded in parallel, while framing and sending stay in the client's pool.
+
+        Each worker keeps its own cache of parsed schemas, keyed by fingerprint, so a
+        schema is parsed once per worker.  Schemas passed as `schemas` are parsed as each
+        worker starts.  Large blobs are returned through shared memory where available.
+
+        Records must be picklable.  Generators within a batch are consumed in the calling
+        process.  The pool is started on first use, and again in forked children.
+
+        Usage:
+
+            serializer = ProcessSerializer(max_workers=4, schemas=[schema])
+            client = Client(serializer=serializer)
+    """
+
+    def __init__(self, max_workers=None, schemas=(), shared_memory=True, mp_context=None):
+        """
+            Kwargs:
+                max_workers: int - Number of worker processes.  Default = number of CPUs.
+                schemas: list - Schemas parsed by each worker as it starts.
+                shared_memory: bool - Return large blobs through shared memory.  Ignored
+                               where multiprocessing.shared_memory is unavailable.
+                mp_context: multiprocessing context used to start workers.
+                            Default = multiprocessing's default.
+        """
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self.use_shared_memory = shared_memory and _shared_memory is not None
+        self.mp_context = mp_context
+        self._schemas = [(cached_fingerprint(schema), schema) for schema in schemas if not is_parsed(schema)]
+        self._pool = None
+        self._lock = threading.Lock()
+        forking.register(self)
+
+    def _after_fork(self):
+        # Worker processes and the pool's management thread belong to the parent.
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        forking.check(self)
+        with self._lock:
+            if self._pool is None:
+                if self.use_shared_memory:
+                    # Started before the workers so that they share it.
+                    resource_tracker.ensure_running()
+                kwargs = {'initializer': _init_worker, 'initargs': (self._schemas,)}
+                if self.mp_context is not None:
+                    kwargs['mp_context'] = self.mp_context
+                self._pool = ProcessPoolExecutor(self.max_workers, **kwargs)
+            return self._pool
+
+    def submit(self, schema_map, batch, ephemeral_storage=False, codec=None, validation=None, **metadata):
+        """
+            Serializes a batch in a worker process.
+
+            Args:
+                schema_map: dict - Avro schema defintion.
+                batch: list - List of concrete avro types or avro type generators.
+
+            Kwargs:
+                ephemeral_storage: bool - Flag to indicate whether the batch
+                                          should be stored long-term.
+                codec: Codec or str - Compression of data blocks.  Default = DEFAULT_CODEC.
+                validation: Validation, str or bool - Validation policy, applied in the calling
+                            process.  Default = None, the process wide policy.
+                **metadata: dict - User defined metadata included in the header.
+
+            Returns:
+                concurrent.futures.Future - Resolved with the serialized bytes, or
+                DatumTypeException if a record does not match the schema.
+        """
+        fp = None if is_parsed(schema_map) else cached_fingerprint(schema_map)
+        # Decided here, where the policy's counts are kept.
+        validate = should_validate(validation, cached_parse_schema(schema_map))
+        pool_future = self._executor().submit(
+            _serialize_in_worker, fp, schema_map, list(_flatten(batch)), ephemeral_storage, codec, validate, metadata,
+            self.use_shared_memory)
+
+        future = Future()
+
+        def done(pool_future):
+            try:
+                result = pool_future.result()
+                if isinstance(result, tuple):
+                    result = _read_shared_memory(*result)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+        pool_future.add_done_callback(done)
+        return future
+
+    def serialize(self, schema_map, batch, ephemeral_storage=False, codec=None, validation=None, **metadata):
+        """
+            Serializes a batch in a worker process, waiting for the result.
+
+            See submit and pycernan.avro.serde.serialize.
+
+            Returns:
+                bytes
+        """
+        return self.submit(schema_map, batch, ephemeral_storage, codec, validation, **metadata).result()
+
+    def close(self, wait=True):
+        """
+            Stops the worker processes.
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
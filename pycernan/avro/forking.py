@@ -0,0 +1,45 @@
+"""
+    Resetting per-process state, such as sockets and threads, after fork.
+
+    Objects holding such state call `register` when created and `check` before
+    using it.  In a forked child, `check` calls the object's `_after_fork` method
+    once.  Where os.register_at_fork is available every registered object is
+    reset immediately after fork, before locks inherited mid-use can be touched.
+"""
+import os
+import weakref
+
+_instances = weakref.WeakSet()
+
+
+def register(instance):
+    """
+        Records the current process as the owner of `instance`'s state.
+    """
+    instance._pid = os.getpid()
+    _instances.add(instance)
+
+
+def check(instance):
+    """
+        Calls `instance._after_fork()` if its state was created in another process.
+
+        Returns:
+            bool - True if the state was reset.
+    """
+    pid = os.getpid()
+    if instance._pid == pid:
+        return False
+
+    instance._pid = pid
+    instance._after_fork()
+    return True
+
+
+def _after_fork_in_child():
+    for instance in list(_instances):
+        check(instance)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
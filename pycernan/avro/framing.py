@@ -0,0 +1,164 @@
+"""
+    Helpers for frames held as a sequence of buffers.
+
+    Frames are built as (header, [kv section,] avro body) rather than one
+    concatenated bytes object so large Avro bodies are never copied before
+    reaching the socket.  An Avro body may also be a FileRegion, streamed from
+    disk without being read into memory.
+"""
+import mmap
+import os
+import socket
+
+_BYTES_LIKE = (bytes, bytearray, memoryview)
+
+# Below this many bytes, copying a frame into one buffer is cheaper than sendmsg.
+SCATTER_THRESHOLD = 64 * 1024
+
+# Bytes written per sendall when sending a FileRegion from an mmap.
+MMAP_CHUNK = 1024 * 1024
+
+# Holds back a header until the body following it is sent, where supported.
+_MSG_MORE = getattr(socket, 'MSG_MORE', 0)
+_HAS_SENDFILE = hasattr(socket.socket, 'sendfile')
+
+
+class FileRegion(object):
+    """
+        A frame buffer holding `count` bytes of an open file, starting at `offset`.
+
+        Sent with socket.sendfile where available, and otherwise from an mmap,
+        so the file is never read into memory.  The file must not change size
+        while a frame referencing it is being sent.
+    """
+
+    def __init__(self, file, offset=0, count=None):
+        """
+            Args:
+                file: file - Opened in binary mode.
+
+            Kwargs:
+                offset: int - First byte of the region.
+                count: int - Length of the region.  Default = None, up to the end of the file.
+        """
+        self.file = file
+        self.offset = offset
+        self.count = os.fstat(file.fileno()).st_size - offset if count is None else count
+
+    def __len__(self):
+        return self.count
+
+    def _check(self, n_bytes):
+        if n_bytes != self.count:
+            raise ValueError("{} changed size while being published, {} of {} bytes sent".format(
+                getattr(self.file, 'name', self.file), n_bytes, self.count))
+
+    def read(self):
+        """
+            Returns the region's contents as bytes.
+        """
+        self.file.seek(self.offset)
+        data = self.file.read(self.count)
+        self._check(len(data))
+        return data
+
+    def send(self, sock):
+        """
+            Writes the region to `sock`.
+
+            Raises:
+                ValueError - The file no longer holds the whole region.
+        """
+        if not self.count:
+            return
+
+        if _HAS_SENDFILE and isinstance(sock, socket.socket):
+            self._check(sock.sendfile(self.file, self.offset, self.count))
+            return
+
+        mapped = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        views = []
+        try:
+            view = memoryview(mapped)
+            views.append(view)
+            end = min(self.offset + self.count, len(view))
+            self._check(max(end - self.offset, 0))
+            for start in range(self.offset, end, MMAP_CHUNK):
+                chunk = view[start:min(start + MMAP_CHUNK, end)]
+                views.append(chunk)
+                sock.sendall(chunk)
+        finally:
+            # The mmap cannot be closed while views of it exist.
+            for view in reversed(views):
+                if hasattr(view, 'release'):
+                    view.release()
+            mapped.close()
+
+
+def payload_len(payload):
+    """
+        Number of bytes in a payload given as bytes or a sequence of buffers.
+    """
+    if isinstance(payload, _BYTES_LIKE):
+        return len(payload)
+    return sum(len(buf) for buf in payload)
+
+
+def join(payload):
+    """
+        Concatenates a payload into a single bytes object.
+    """
+    if isinstance(payload, bytes):
+        return payload
+    if isinstance(payload, _BYTES_LIKE):
+        return bytes(payload)
+    return b''.join(buf.read() if isinstance(buf, FileRegion) else buf for buf in payload)
+
+
+def sendall(sock, payload):
+    """
+        Writes an entire payload, given as bytes or a sequence of buffers, to `sock`.
+
+        Sequences of at least SCATTER_THRESHOLD bytes are written with scatter/gather
+        `sendmsg`, resuming after partial writes.  Smaller payloads, and sockets
+        without `sendmsg`, receive a single concatenated buffer.
+
+        A FileRegion, which may only be the last buffer as frames hold the Avro
+        body there, is streamed after the buffers preceding it.
+    """
+    if isinstance(payload, _BYTES_LIKE):
+        sock.sendall(payload)
+        return
+
+    total = payload_len(payload)
+    if isinstance(payload[-1], FileRegion) and total >= SCATTER_THRESHOLD:
+        head = join(payload[:-1])
+        if _MSG_MORE and isinstance(sock, socket.socket):
+            sock.sendall(head, _MSG_MORE)
+        else:
+            sock.sendall(head)
+        payload[-1].send(sock)
+        return
+
+    if total < SCATTER_THRESHOLD or not hasattr(sock, 'sendmsg'):
+        sock.sendall(join(payload))
+        return
+
+    sent = sock.sendmsg(payload)
+    if sent == total:
+        return
+
+    views = [memoryview(buf) for buf in payload if len(buf)]
+    while True:
+        while sent:
+            head = views[0]
+            if sent >= len(head):
+                sent -= len(head)
+                views.pop(0)
+            else:
+                views[0] = head[sent:]
+                sent = 0
+
+        if not views:
+            return
+        sent = sock.sendmsg(views)
@@ -0,0 +1,222 @@
+"""
+    Deterministic 64 bit hashing of shard_by values.
+
+    Python's built-in hash() of str and bytes is salted per process, so it cannot
+    be used to shard consistently across processes.  Values are instead encoded
+    to bytes and hashed with MD5, which is available, and identical, on every
+    supported interpreter.  MD5 is used purely for distribution, not security.
+"""
+import datetime
+import decimal
+import functools
+import hashlib
+import struct
+import uuid
+
+from numbers import Integral
+
+try:
+    text_type = unicode  # noqa: F821
+except NameError:
+    text_type = str
+
+_U64 = struct.Struct(">Q")
+_LENGTH = struct.Struct(">L")
+
+try:
+    # Marks MD5 as not used for security, so that it remains available on FIPS builds.
+    hashlib.md5(usedforsecurity=False)
+    _md5 = functools.partial(hashlib.md5, usedforsecurity=False)
+except TypeError:
+    _md5 = hashlib.md5
+
+# Type tags keep, for example, 1, '1' and (1,) from colliding.
+# Text and bytes share a tag so that Python 2 str values hash as they do on Python 3.
+_TEXT = b's'
+_INT = b'i'
+_FLOAT = b'f'
+_TUPLE = b't'
+_NONE = b'n'
+_DATETIME = b'd'
+_TIMEDELTA = b'D'
+_DECIMAL = b'm'
+_FROZENSET = b'z'
+_REPR = b'r'
+
+
+def _encode_text(value):
+    return _TEXT + value.encode('utf-8')
+
+
+def _encode_bytes(value):
+    return _TEXT + bytes(value)
+
+
+def _encode_int(value):
+    return _INT + ('%d' % value).encode('ascii')
+
+
+def _encode_float(value):
+    return _FLOAT + repr(value).encode('ascii')
+
+
+def _encode_uuid(value):
+    return _TEXT + str(value).encode('ascii')
+
+
+def _encode_none(value):
+    return _NONE
+
+
+def _encode_datetime(value):
+    # Covers date and time too.  Their ISO formats cannot be mistaken for one another.
+    return _DATETIME + value.isoformat().encode('ascii')
+
+
+def _encode_timedelta(value):
+    return _TIMEDELTA + ('%d,%d,%d' % (value.days, value.seconds, value.microseconds)).encode('ascii')
+
+
+def _encode_decimal(value):
+    # Normalized, so that equal values such as Decimal('1.0') and Decimal('1') hash alike.
+    return _DECIMAL + str(value.normalize() if value.is_finite() else value).encode('ascii')
+
+
+def _encode_items(tag, encoded_items):
+    parts = [tag]
+    for encoded in encoded_items:
+        parts.append(_LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+    return b''.join(parts)
+
+
+def _encode_tuple(value):
+    return _encode_items(_TUPLE, [encode(item) for item in value])
+
+
+def _encode_frozenset(value):
+    # Sorted, since iteration order of a set varies across processes.
+    return _encode_items(_FROZENSET, sorted(encode(item) for item in value))
+
+
+def _encode_repr(value):
+    # Fallback for other hashable values, qualified by type so that equal reprs of different types differ.
+    try:
+        hash(value)
+    except TypeError:
+        raise TypeError("Cannot hash shard_by of unhashable type {}".format(type(value).__name__))
+    value_type = type(value)
+    name = '{}.{}:{!r}'.format(value_type.__module__, getattr(value_type, '__qualname__', value_type.__name__), value)
+    return _REPR + name.encode('utf-8', 'surrogateescape')
+
+
+# Checked in order for subclasses of the supported types.
+_ENCODERS = [
+    (text_type, _encode_text),
+    ((bytes, bytearray), _encode_bytes),
+    (Integral, _encode_int),
+    (float, _encode_float),
+    (uuid.UUID, _encode_uuid),
+    (tuple, _encode_tuple),
+    ((datetime.date, datetime.time), _encode_datetime),
+    (datetime.timedelta, _encode_timedelta),
+    (decimal.Decimal, _encode_decimal),
+    (frozenset, _encode_frozenset),
+]
+
+# Exact type lookups, the common case.
+_ENCODERS_BY_TYPE = {
+    text_type: _encode_text,
+    bytes: _encode_bytes,
+    bytearray: _encode_bytes,
+    int: _encode_int,
+    bool: _encode_int,
+    float: _encode_float,
+    uuid.UUID: _encode_uuid,
+    tuple: _encode_tuple,
+    type(None): _encode_none,
+    datetime.datetime: _encode_datetime,
+    datetime.date: _encode_datetime,
+    datetime.time: _encode_datetime,
+    datetime.timedelta: _encode_timedelta,
+    decimal.Decimal: _encode_decimal,
+    frozenset: _encode_frozenset,
+}
+
+
+def encode(value):
+    """
+        Encodes a shard_by value to the bytes that are hashed.
+
+        Values of other hashable types, such as enums, are encoded by their type and
+        repr().  That is only deterministic if their repr is, which is not the case of
+        the default repr of objects, holding their address.
+
+        Args:
+            value: str, bytes, int, float, uuid.UUID, None, datetime.datetime, date, time,
+                   timedelta, decimal.Decimal, or a tuple or frozenset of these.
+
+        Returns:
+            bytes
+
+        Raises:
+            TypeError - The value, or one of its items, is not hashable.
+    """
+    encoder = _ENCODERS_BY_TYPE.get(type(value))
+    if encoder is None:
+        for types, candidate in _ENCODERS:
+            if isinstance(value, types):
+                encoder = candidate
+                break
+        else:
+            encoder = _encode_repr
+    return encoder(value)
+
+
+def hash_bytes(data):
+    """
+        Returns the unsigned 64 bit hash of already encoded bytes.
+    """
+    return _U64.unpack_from(_md5(data).digest())[0]
+
+
+def hash_u64(value):
+    """
+        Returns an unsigned 64 bit hash of `value`, stable across processes and interpreters.
+
+        Args:
+            value: ShardKey or any value accepted by `encode`.
+    """
+    if isinstance(value, ShardKey):
+        return value.hash
+    return hash_bytes(encode(value))
+
+
+class ShardKey(object):
+    """
+        A shard_by value with its hash computed once, for reuse across many publishes.
+
+        Usage:
+
+            key = ShardKey(user_id)
+            for batch in batches:
+                client.publish(schema, batch, shard_by=key)
+    """
+
+    __slots__ = ('value', 'hash')
+
+    def __init__(self, value):
+        self.value = value
+        self.hash = hash_u64(value)
+
+    def __eq__(self, other):
+        return isinstance(other, ShardKey) and self.hash == other.hash and self.value == other.value
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.hash)
+
+    def __repr__(self):
+        return 'ShardKey({!r})'.format(self.value)
@@ -1,4 +1,27 @@
-from prometheus_client.metrics import Counter, Histogram
+"""
+    Metrics exported by pycernan, and the backend recording them.
+
+    Metrics are declared below as module attributes wrapping prometheus_client
+    metrics.  How updates reach Prometheus is chosen with `use`:
+
+        'prometheus' - Every update goes straight to prometheus_client.  The default.
+        'noop' - Updates are discarded.
+        'aggregating' - Updates accumulate in thread-local buffers, which a background
+                        thread folds into prometheus_client every `interval` seconds.
+                        See AggregatingBackend.
+
+    The default is taken from the PYCERNAN_AVRO_METRICS_BACKEND environment variable.
+"""
+import functools
+import threading
+
+from bisect import bisect_left
+
+from timeit import default_timer
+
+import prometheus_client.metrics
+
+from pycernan.avro import config, forking
 
 PREFIX = "pycernan"
 
@@ -7,6 +30,317 @@ def p(n):
     return PREFIX + "_" + n
 
 
+def _noop(*args, **kwargs):
+    pass
+
+
+class _NoopTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+class _Timer(object):
+    """
+        Context manager observing the seconds spent within it.
+    """
+
+    def __init__(self, observe):
+        self._observe = observe
+
+    def __enter__(self):
+        self._start = default_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._observe(max(default_timer() - self._start, 0))
+
+
+class _ExceptionCounter(object):
+    """
+        Decorator or context manager counting exceptions raised within it.
+    """
+
+    def __init__(self, counter, exception):
+        self._counter = counter
+        self._exception = exception
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and issubclass(exc_type, self._exception):
+            self._counter.inc()
+
+    def __call__(self, fn):
+        @functools.wraps(fn)
+        def wrapped(*args, **kwargs):
+            with self:
+                return fn(*args, **kwargs)
+        return wrapped
+
+
+class _Metric(object):
+    """
+        Wraps a prometheus_client metric.  Its update methods are bound by the backend in use.
+    """
+
+    METHODS = ()
+    PROMETHEUS_CLASS = None
+
+    def __init__(self, name, documentation, labelnames=(), **kwargs):
+        self._init(self.PROMETHEUS_CLASS(name, documentation, labelnames, **kwargs))
+
+    @classmethod
+    def _wrap(cls, metric):
+        instance = cls.__new__(cls)
+        instance._init(metric)
+        return instance
+
+    def _init(self, metric):
+        self._metric = metric
+        self._children = {}
+        self._lock = threading.Lock()
+        _backend.bind(self)
+        _metrics.append(self)
+
+    def labels(self, *labelvalues):
+        """
+            Returns the child metric for the given label values.
+        """
+        child = self._children.get(labelvalues)
+        if child is None:
+            with self._lock:
+                child = self._children.get(labelvalues)
+                if child is None:
+                    child = self._children[labelvalues] = self._wrap(self._metric.labels(*labelvalues))
+        return child
+
+
+class Counter(_Metric):
+    METHODS = ('inc',)
+    PROMETHEUS_CLASS = prometheus_client.metrics.Counter
+
+    def count_exceptions(self, exception=Exception):
+        """
+            Counts exceptions of the given type raised by a decorated function or within a with block.
+        """
+        return _ExceptionCounter(self, exception)
+
+
+class Gauge(_Metric):
+    METHODS = ('inc', 'dec', 'set')
+    PROMETHEUS_CLASS = prometheus_client.metrics.Gauge
+
+
+class Histogram(_Metric):
+    METHODS = ('observe', 'time')
+    PROMETHEUS_CLASS = prometheus_client.metrics.Histogram
+
+
+class PrometheusBackend(object):
+    """
+        Updates prometheus_client metrics directly.
+    """
+
+    def bind(self, metric):
+        for name in metric.METHODS:
+            setattr(metric, name, getattr(metric._metric, name))
+
+    def close(self):
+        pass
+
+
+class NoopBackend(object):
+    """
+        Discards all updates.
+    """
+
+    def bind(self, metric):
+        for name in metric.METHODS:
+            setattr(metric, name, _noop)
+        if isinstance(metric, Histogram):
+            metric.time = lambda: _NOOP_TIMER
+
+    def close(self):
+        pass
+
+
+class _Buffer(object):
+    """
+        Running totals of one thread's updates.
+
+        Only the owning thread writes `totals` and `histograms`, so updates take no
+        lock.  The folding thread reads copies and exports the change since the
+        values it last `folded`.
+    """
+
+    def __init__(self):
+        self.thread = threading.current_thread()
+        self.totals = {}
+        self.histograms = {}
+        self.folded = {}
+
+
+class AggregatingBackend(object):
+    """
+        Accumulates updates per thread, folding them into prometheus_client on a timer.
+
+        Counter increments, gauge increments and decrements and histogram samples are
+        kept in thread-local running totals, so the publish path takes no lock.
+        Gauge `set` calls are applied immediately.  Exported values lag by up to
+        `interval` seconds.
+    """
+
+    def __init__(self, interval=1.0):
+        """
+            Kwargs:
+                interval: float - Seconds between folds into prometheus_client.
+        """
+        if interval <= 0:
+            raise ValueError("interval must be > 0")
+
+        self.interval = interval
+        self._reset()
+        forking.register(self)
+
+    def _reset(self):
+        self._local = threading.local()
+        self._buffers = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='pycernan-metrics')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _after_fork(self):
+        # Updates buffered by the parent are the parent's to export.
+        self._reset()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.flush()
+
+    def _new_buffer(self):
+        buffer = self._local.buffer = _Buffer()
+        with self._lock:
+            self._buffers.append(buffer)
+        return buffer
+
+    def bind(self, metric):
+        if isinstance(metric, Histogram):
+            metric.observe = self._observer(metric)
+            metric.time = lambda: _Timer(metric.observe)
+            return
+
+        metric.inc = self._incrementer(metric, 1)
+        if isinstance(metric, Gauge):
+            metric.dec = self._incrementer(metric, -1)
+            metric.set = metric._metric.set
+
+    def _incrementer(self, metric, sign):
+        def inc(amount=1):
+            try:
+                totals = self._local.buffer.totals
+            except AttributeError:
+                totals = self._new_buffer().totals
+            totals[metric] = totals.get(metric, 0) + sign * amount
+        return inc
+
+    def _observer(self, metric):
+        # Samples are bucketed as they arrive, so folding costs the same however many there are.
+        bounds = metric._metric._upper_bounds
+
+        def observe(amount):
+            try:
+                histograms = self._local.buffer.histograms
+            except AttributeError:
+                histograms = self._new_buffer().histograms
+            histogram = histograms.get(metric)
+            if histogram is None:
+                histogram = histograms[metric] = [0, [0] * len(bounds)]
+            histogram[0] += amount
+            histogram[1][bisect_left(bounds, amount)] += 1
+        return observe
+
+    def flush(self):
+        """
+            Folds every thread's pending updates into prometheus_client.
+        """
+        forking.check(self)
+        with self._lock:
+            for buffer in list(self._buffers):
+                # Checked first, so the totals read below are final for a finished thread.
+                alive = buffer.thread.is_alive()
+                self._fold(buffer)
+                if not alive:
+                    self._buffers.remove(buffer)
+
+    def _fold(self, buffer):
+        folded = buffer.folded
+        for metric, total in buffer.totals.copy().items():
+            delta = total - folded.get(metric, 0)
+            if delta:
+                metric._metric.inc(delta)
+                folded[metric] = total
+
+        for metric, histogram in buffer.histograms.copy().items():
+            total, counts = histogram[0], list(histogram[1])
+            folded_total, folded_counts = folded.get(metric, (0, [0] * len(counts)))
+            # Mirrors prometheus_client's Histogram.observe, one bucket at a time.
+            target = metric._metric
+            target._sum.inc(total - folded_total)
+            for bucket, count, folded_count in zip(target._buckets, counts, folded_counts):
+                if count != folded_count:
+                    bucket.inc(count - folded_count)
+            folded[metric] = (total, counts)
+
+    def close(self):
+        """
+            Stops the background thread after a final fold.
+        """
+        self._stopped.set()
+        self.flush()
+
+
+BACKENDS = {
+    'prometheus': PrometheusBackend,
+    'noop': NoopBackend,
+    'aggregating': AggregatingBackend,
+}
+
+_metrics = []
+_backend = PrometheusBackend()
+
+
+def use(backend):
+    """
+        Switches the backend recording every metric.  The previous backend is closed.
+
+        Args:
+            backend: str or backend instance - One of BACKENDS, or an instance such as AggregatingBackend(interval=5).
+
+        Returns:
+            The backend now in use.
+    """
+    global _backend
+    if not hasattr(backend, 'bind'):
+        if backend not in BACKENDS:
+            raise ValueError("Unknown metrics backend {!r}, expected one of {}".format(backend, sorted(BACKENDS)))
+        backend = BACKENDS[backend]()
+
+    previous, _backend = _backend, backend
+    for metric in list(_metrics):
+        backend.bind(metric)
+    previous.close()
+    return backend
+
+
 # Generates buckets ranging from 64 bytes to 1MB, in powers of 2
 SIZE_BUCKETS = [2 ** i for i in range(6, 21)]
 
@@ -15,16 +349,50 @@ ack_invalid_count = Counter(p('ack_invalid_count'), "Number of invalid acknowled
 ack_latency = Histogram(p('ack_latency'), "Acknowledgement latency in seconds.")
 ack_request_count = Counter(p('ack_request_count'), "Number of acknowledgements requested.")
 
+buffer_depth = Gauge(p('buffer_depth'), "Number of records buffered awaiting publication.")
+buffer_drop_count = Counter(p('buffer_drop_count'), "Number of records dropped because the buffer was full.")
+buffer_flush_count = Counter(p('buffer_flush_count'), "Number of buffered batches flushed, by reason.", ['reason'])
+buffer_flush_failure_count = Counter(p('buffer_flush_failure_count'), "Number of buffered batches that failed to publish.")
+
+bulk_file_count = Counter(p('bulk_file_count'), "Number of files handled by publish_files, by outcome.", ['outcome'])
+
 bytes_sent = Counter(p('bytes_sent'), "Total bytes sent.")
 bytes_received = Counter(p('bytes_recv'), "Total bytes received.")
 
+circuit_state = Gauge(p('circuit_state'), "Circuit breaker state: 0 closed, 1 open, 2 half open.")
+circuit_transition_count = Counter(p('circuit_transition_count'), "Number of circuit breaker transitions, by state entered.", ['state'])
+circuit_rejected_count = Counter(p('circuit_rejected_count'), "Number of publishes rejected by an open circuit breaker.")
+
 conn_create_count = Counter(p('conn_create_count'), "Number of connections established by connection pool.")
 conn_close_count = Counter(p('conn_close_count'), "Number of connections closed by connection pool.")
 conn_failure_count = Counter(p('conn_failure_count'), "Number of failures to yield a connection from the pool.")
+conn_idle_eviction_count = Counter(p('conn_idle_eviction_count'), "Number of pooled connections replaced after idling too long.")
+conn_liveness_failure_count = Counter(p('conn_liveness_failure_count'), "Number of pooled connections found closed by a liveness check.")
 conn_acquire_latency = Histogram(p('conn_acquire_count'), "Connection acquisition latency")
 
+endpoint_ejection_count = Counter(p('endpoint_ejection_count'), "Number of times an endpoint was ejected after connection failures.", ['endpoint'])
+
+in_flight = Gauge(p('in_flight'), "Number of pipelined payloads awaiting acknowledgement.")
+
 event_size_bytes = Histogram(p('event_size_bytes'), "Histogram of event sizes in bytes", buckets=SIZE_BUCKETS)
 
 publish_count = Counter(p('publish_count'), "Number of events published.")
 publish_failure_count = Counter(p('publish_failure_count'), "Number of events that failed to publish successfully.")
 publish_latency = Histogram(p('publish_latency'), "Publish latency in seconds.")
+publish_retry_count = Counter(p('publish_retry_count'), "Number of payloads resent after a failed attempt.")
+publish_give_up_count = Counter(p('publish_give_up_count'), "Number of payloads abandoned after exhausting retries.")
+
+schema_cache_hit_count = Counter(p('schema_cache_hit_count'), "Number of parsed schemas served from the schema cache.")
+schema_cache_miss_count = Counter(p('schema_cache_miss_count'), "Number of schemas parsed due to a schema cache miss.")
+schema_cache_eviction_count = Counter(p('schema_cache_eviction_count'), "Number of parsed schemas evicted from the schema cache.")
+
+spool_append_count = Counter(p('spool_append_count'), "Number of payloads written to the spool.")
+spool_bytes = Gauge(p('spool_bytes'), "Bytes spooled awaiting replay.")
+spool_full_count = Counter(p('spool_full_count'), "Number of payloads rejected because the spool was full.")
+spool_replay_count = Counter(p('spool_replay_count'), "Number of spooled payloads replayed successfully.")
+spool_replay_failure_count = Counter(p('spool_replay_failure_count'), "Number of failed attempts to replay a spooled payload.")
+
+validation_count = Counter(p('validation_count'), "Number of batches serialized, by validation mode and whether they were validated.",
+                           ['mode', 'validated'])
+
+use(config.metrics_backend())
@@ -0,0 +1,299 @@
+"""
+    Pipelined connections carrying many in-flight payloads each.
+"""
+import socket
+import struct
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import Future
+
+from pycernan.avro.exceptions import ConnectionResetException, InvalidAckException
+from pycernan.avro import forking, framing, metrics
+from pycernan.avro.tcp_conn_pool import configure_socket
+
+_ID = struct.Struct(">Q")
+
+# Holds a pool slot while its connection is created, outside of the pool's lock.
+_CONNECTING = object()
+
+
+class _NotSentException(ConnectionResetException):
+    """
+        The connection failed before the payload was written, so it can be sent on another.
+    """
+
+
+class PipelinedConnection(object):
+    """
+        A socket on which payloads are sent without waiting for prior acks.
+
+        A reader thread matches each returned id against the payloads awaiting
+        acknowledgement and resolves their futures.  At most `max_in_flight`
+        acks may be outstanding at once.  Any failure (socket errors, read
+        timeouts while acks are outstanding, or an ack for an unknown id) makes
+        the connection defunct and fails every outstanding future.
+
+        The reader wakes up every socket timeout.  Outstanding acks fail once the
+        oldest has waited `ack_timeout` seconds, the socket timeout by default.
+        Bytes of an ack read before a timeout are kept for the next read.
+    """
+
+    def __init__(self, sock, max_in_flight, ack_timeout=None):
+        if max_in_flight <= 0:
+            raise ValueError("max_in_flight must be > 0")
+
+        self.sock = sock
+        self.max_in_flight = max_in_flight
+        self.ack_timeout = sock.gettimeout() if ack_timeout is None else ack_timeout
+        self.defunct = False
+        self._recv_buf = bytearray()
+
+        self._cond = threading.Condition()
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._num_pending = 0
+
+        self._reader = threading.Thread(target=self._read_acks, name='pycernan-ack-reader')
+        self._reader.daemon = True
+        self._reader.start()
+
+    @property
+    def num_pending(self):
+        return self._num_pending
+
+    def submit(self, payload_id, sync, payload):
+        """
+            Sends a framed payload.
+
+            Returns:
+                concurrent.futures.Future - Resolved once the payload is acknowledged
+                                            (sync) or written to the socket (not sync).
+
+            Raises:
+                ConnectionResetException - The connection is defunct.  A subclass,
+                                           _NotSentException, if none of the payload was written.
+        """
+        future = Future()
+        if sync:
+            with self._cond:
+                while self._num_pending >= self.max_in_flight and not self.defunct:
+                    self._cond.wait()
+                if self.defunct:
+                    raise _NotSentException()
+
+                # Registered before sending since the ack may beat sendall returning.
+                future.sent_at = time.time()
+                self._pending.setdefault(payload_id, deque()).append(future)
+                self._num_pending += 1
+                metrics.ack_request_count.inc()
+                metrics.in_flight.inc()
+
+        try:
+            with self._send_lock:
+                if self.defunct:
+                    # Failed while waiting for the send lock, so nothing was written.
+                    raise _NotSentException()
+                payload_len = framing.payload_len(payload)
+                metrics.publish_count.inc()
+                metrics.bytes_sent.inc(payload_len)
+                metrics.event_size_bytes.observe(payload_len)
+                with metrics.publish_latency.time():
+                    framing.sendall(self.sock, payload)
+        except _NotSentException:
+            raise
+        except Exception as e:
+            self._fail(e)
+            raise
+
+        if not sync:
+            future.set_result(None)
+        return future
+
+    def close(self):
+        self._fail(ConnectionResetException())
+
+    def _recv_exact(self, n_bytes):
+        # Bytes received before a timeout stay buffered, so the next call resumes mid-ack.
+        buf = self._recv_buf
+        while len(buf) < n_bytes:
+            recvd = self.sock.recv(n_bytes - len(buf))
+            if len(recvd) == 0:
+                raise ConnectionResetException()
+            buf.extend(recvd)
+        data = bytes(buf[:n_bytes])
+        del buf[:n_bytes]
+        return data
+
+    def _oldest_pending(self):
+        with self._cond:
+            return min([futures[0].sent_at for futures in self._pending.values()] or [float('inf')])
+
+    def _read_acks(self):
+        while not self.defunct:
+            try:
+                id_bytes = self._recv_exact(_ID.size)
+            except socket.timeout as e:
+                if self._oldest_pending() < time.time() - self.ack_timeout:
+                    self._fail(e)
+                continue
+            except Exception as e:
+                self._fail(e)
+                return
+
+            metrics.bytes_received.inc(len(id_bytes))
+            (recv_id,) = _ID.unpack(id_bytes)
+            with self._cond:
+                futures = self._pending.get(recv_id)
+                future = futures.popleft() if futures else None
+                if futures is not None and not futures:
+                    del self._pending[recv_id]
+                if future is not None:
+                    self._num_pending -= 1
+                    metrics.in_flight.dec()
+                    self._cond.notify()
+
+            if future is None:
+                # Acks can no longer be attributed to payloads reliably.
+                metrics.ack_invalid_count.inc()
+                self._fail(InvalidAckException())
+                return
+
+            metrics.ack_count.inc()
+            metrics.ack_latency.observe(time.time() - future.sent_at)
+            future.set_result(None)
+
+    def _fail(self, exc):
+        with self._cond:
+            was_defunct = self.defunct
+            self.defunct = True
+            pending = [future for futures in self._pending.values() for future in futures]
+            self._pending = {}
+            metrics.in_flight.dec(self._num_pending)
+            self._num_pending = 0
+            self._cond.notify_all()
+
+        if not was_defunct:
+            metrics.conn_failure_count.inc()
+            try:
+                # Shutdown wakes the reader thread if it is blocked in recv.
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+            try:
+                self.sock.close()
+                metrics.conn_close_count.inc()
+            except Exception:
+                pass
+
+        for future in pending:
+            future.set_exception(exc)
+
+
+class PipelinedConnectionPool(object):
+    """
+        Fixed set of `maxsize` pipelined connections.
+
+        Each payload is sent on the connection with the fewest outstanding acks.
+        Defunct connections are regenerated lazily, on the next submit.  In a
+        forked child, inherited connections, whose reader threads did not survive
+        the fork, are dropped without being shut down.
+    """
+
+    def __init__(self, host, port, maxsize, connect_timeout, read_timeout, max_in_flight):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be > 0")
+        if max_in_flight <= 0:
+            raise ValueError("max_in_flight must be > 0")
+
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self.max_in_flight = max_in_flight
+
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        self._reset()
+        forking.register(self)
+
+    def _after_fork(self):
+        # Inherited connections are dropped, not closed, since closing shuts down the parent's sockets.
+        metrics.in_flight.dec(sum(conn.num_pending for conn in self.connections if conn not in (None, _CONNECTING)))
+        self._reset()
+
+    def _reset(self):
+        self._cond = threading.Condition()
+        self.connections = [None] * self.maxsize
+
+    def _create_connection(self):
+        metrics.conn_create_count.inc()
+        sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+        sock.settimeout(self.read_timeout)
+        configure_socket(sock)
+        return PipelinedConnection(sock, self.max_in_flight)
+
+    def _get(self):
+        forking.check(self)
+        with self._cond:
+            while True:
+                connections = self.connections
+                live = [conn for conn in connections if conn not in (None, _CONNECTING) and not conn.defunct]
+                best = min(live, key=lambda conn: conn.num_pending) if live else None
+                if best is not None and not best.num_pending:
+                    return best
+
+                # Every live connection is busy, grow into a free slot if there is one.
+                free = [i for i, conn in enumerate(connections) if conn is None or (conn is not _CONNECTING and conn.defunct)]
+                if free:
+                    slot = free[0]
+                    connections[slot] = _CONNECTING
+                    break
+                if best is not None:
+                    return best
+                # Every slot is being connected by other threads.
+                self._cond.wait()
+
+        # Connecting can take up to connect_timeout, so the slot is reserved and the lock released meanwhile.
+        conn = None
+        try:
+            conn = self._create_connection()
+        finally:
+            with self._cond:
+                closed = self.connections is not connections
+                connections[slot] = None if closed else conn
+                self._cond.notify_all()
+
+        if closed:
+            # The pool was closed while connecting.
+            conn.close()
+            raise ConnectionResetException()
+        return conn
+
+    def submit(self, payload_id, sync, payload):
+        """
+            Sends a framed payload.  See PipelinedConnection.submit.
+
+            Payloads are only failed by connection errors once they were written.  One
+            whose connection fails before it is written, for example while waiting for
+            room among the connection's in-flight payloads, is sent on another connection.
+        """
+        while True:
+            try:
+                return self._get().submit(payload_id, sync, payload)
+            except _NotSentException:
+                continue
+
+    def closeall(self):
+        """
+            Close all connections, failing any payloads awaiting acknowledgement.
+        """
+        forking.check(self)
+        with self._cond:
+            connections, self.connections = self.connections, [None] * self.maxsize
+            self._cond.notify_all()
+
+        for conn in connections:
+            if conn not in (None, _CONNECTING):
+                conn.close()
@@ -0,0 +1,79 @@
+"""
+    Retrying failed sends with exponential backoff.
+"""
+import random
+import socket
+import time
+
+from pycernan.avro import metrics
+from pycernan.avro.exceptions import ConnectionResetException, InvalidAckException
+
+# Failures after which resending the same frame may succeed.
+RETRYABLE_EXCEPTIONS = (socket.error, ConnectionResetException, InvalidAckException)
+
+
+class RetryPolicy(object):
+    """
+        Retries a send with exponential backoff and full jitter.
+
+        The n-th retry sleeps for a random duration between 0 and
+        min(max_backoff, backoff * multiplier ** (n - 1)) seconds.  Retries stop
+        after `max_attempts` attempts in total, or when the next retry would
+        start after `deadline` seconds have elapsed since the first attempt.
+    """
+
+    def __init__(self, max_attempts=3, backoff=0.05, multiplier=2, max_backoff=2.0, deadline=None, jitter=True,
+                 retry_on=RETRYABLE_EXCEPTIONS):
+        """
+            Kwargs:
+                max_attempts: int - Attempts, including the first, before giving up.
+                backoff: float - Seconds before the first retry.
+                multiplier: float - Growth of the backoff with each retry.
+                max_backoff: float - Upper bound on the backoff in seconds.
+                deadline: float - Seconds after the first attempt beyond which no retry starts.
+                          Default = None, bounded by `max_attempts` only.
+                jitter: bool - Randomize each backoff, so clients recovering from
+                        the same outage do not retry in lockstep.
+                retry_on: tuple - Exception types that are retried.
+        """
+        if max_attempts <= 0:
+            raise ValueError("max_attempts must be > 0")
+        if backoff < 0 or multiplier < 1:
+            raise ValueError("backoff must be >= 0 and multiplier >= 1")
+
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.multiplier = multiplier
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.jitter = jitter
+        self.retry_on = retry_on
+
+    def delay(self, retry):
+        """
+            Returns the seconds to sleep before the `retry`-th retry, counting from 1.
+        """
+        delay = min(self.max_backoff, self.backoff * self.multiplier ** (retry - 1))
+        return random.uniform(0, delay) if self.jitter else delay
+
+    def call(self, fn, *args):
+        """
+            Calls fn(*args), retrying failures per the policy.
+
+            Raises:
+                The last failure once the policy gives up.
+        """
+        start = time.time()
+        attempt = 1
+        while True:
+            try:
+                return fn(*args)
+            except self.retry_on:
+                delay = self.delay(attempt)
+                if attempt >= self.max_attempts or (self.deadline is not None and time.time() + delay - start > self.deadline):
+                    metrics.publish_give_up_count.inc()
+                    raise
+
+            metrics.publish_retry_count.inc()
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,132 @@
+"""
+    Bounded cache of parsed Avro schemas.
+"""
+import copy
+import hashlib
+import json
+import threading
+
+from collections import OrderedDict
+
+from fastavro import parse_schema
+
+from pycernan.avro import config
+from pycernan.avro import metrics
+
+
+def fingerprint(schema_map):
+    """
+        Computes a stable fingerprint for a schema definition.
+
+        Note - Parsing Canonical Form is deliberately not used here.  It strips
+        attributes such as `logicalType`, `default` and `doc` which alter how
+        records are encoded and what is written to the container header, so two
+        schemas sharing a canonical form cannot share a parsed schema.
+
+        Args:
+            schema_map: dict - Avro schema definition.
+
+        Returns:
+            bytes - MD5 digest of the schema's sorted, compact JSON encoding.
+    """
+    canonical = json.dumps(schema_map, sort_keys=True, separators=(',', ':'))
+    return hashlib.md5(canonical.encode('utf-8')).digest()
+
+
+def is_parsed(schema_map):
+    return isinstance(schema_map, dict) and '__fastavro_parsed' in schema_map
+
+
+class SchemaCache(object):
+    """
+        Thread safe LRU cache mapping schema fingerprints to parsed schemas.
+
+        Fingerprinting costs more than parsing small schemas, so the fingerprint of each
+        schema is also remembered by the id of its dict, along with a deep copy of its
+        contents.  It is reused only while the dict still equals the copy, so a schema
+        mutated in place, or a new dict that recycled the id, is fingerprinted again.
+    """
+
+    def __init__(self, maxsize=None):
+        maxsize = config.schema_cache_size() if maxsize is None else maxsize
+        if maxsize <= 0:
+            raise ValueError("maxsize must be > 0")
+
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._parsed = OrderedDict()
+        # id(schema_map) -> (deep copy of schema_map, fingerprint).
+        self._fingerprints = OrderedDict()
+
+    def __len__(self):
+        return len(self._parsed)
+
+    def parse(self, schema_map):
+        """
+            Returns the parsed form of `schema_map`, parsing it at most once
+            while it remains cached.
+
+            Args:
+                schema_map: dict or parsed schema - Avro schema definition.
+
+            Returns:
+                Parsed schema suitable for fastavro readers and writers.
+        """
+        if is_parsed(schema_map):
+            return schema_map
+
+        fp = self._fingerprint(schema_map)
+        with self._lock:
+            parsed = self._parsed.pop(fp, None)
+            if parsed is not None:
+                self._parsed[fp] = parsed
+        if parsed is not None:
+            metrics.schema_cache_hit_count.inc()
+            return parsed
+
+        metrics.schema_cache_miss_count.inc()
+        parsed = parse_schema(schema_map)
+        with self._lock:
+            self._parsed[fp] = parsed
+            while len(self._parsed) > self.maxsize:
+                self._parsed.popitem(last=False)
+                metrics.schema_cache_eviction_count.inc()
+        return parsed
+
+    def _fingerprint(self, schema_map):
+        key = id(schema_map)
+        with self._lock:
+            entry = self._fingerprints.get(key)
+        if entry is not None and entry[0] == schema_map:
+            return entry[1]
+
+        fp = fingerprint(schema_map)
+        with self._lock:
+            self._fingerprints.pop(key, None)
+            self._fingerprints[key] = (copy.deepcopy(schema_map), fp)
+            while len(self._fingerprints) > self.maxsize:
+                self._fingerprints.popitem(last=False)
+        return fp
+
+    def clear(self):
+        with self._lock:
+            self._parsed.clear()
+            self._fingerprints.clear()
+
+
+_default_cache = SchemaCache()
+
+
+def parse(schema_map):
+    """
+        Parses `schema_map` through the process wide schema cache.
+    """
+    return _default_cache.parse(schema_map)
+
+
+def cached_fingerprint(schema_map):
+    """
+        Fingerprints `schema_map`, reusing the process wide schema cache's fingerprint
+        while the schema is unchanged.
+    """
+    return _default_cache._fingerprint(schema_map)
@@ -1,37 +1,234 @@
 import json
+import os
 import sys
+import threading
 import types
 
-from fastavro import reader, writer, parse_schema
-from fastavro.validation import ValidationError
+from collections import namedtuple
+
+from fastavro import block_reader, reader, writer, parse_schema, schemaless_writer  # noqa
+from fastavro.validation import ValidationError, validate
+from fastavro.write import Writer
 from io import BytesIO, IOBase
 
 from pycernan.avro.exceptions import DatumTypeException
+from pycernan.avro.schema_cache import parse as cached_parse_schema
+from pycernan.avro.validation import should_validate
+
+
+# Target size, in uncompressed bytes, of each data block in a container.
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+# Raised by fastavro for records that do not match their schema, validated or not.
+_DATUM_ERRORS = (ValueError, TypeError, ValidationError, OverflowError, AttributeError)
+
+# Minimal stand-in for fastavro.read.Block accepted by Writer.write_block.
+_EncodedBlock = namedtuple('_EncodedBlock', ['num_records', 'bytes_'])
+
+CODEC_NULL = 'null'
+CODEC_DEFLATE = 'deflate'
+CODEC_SNAPPY = 'snappy'
+CODEC_ZSTANDARD = 'zstandard'
+
+# Codecs understood by Cernan's Avro source.  Snappy and zstandard need optional libraries.
+CODECS = (CODEC_NULL, CODEC_DEFLATE, CODEC_SNAPPY, CODEC_ZSTANDARD)
+DEFAULT_CODEC = CODEC_DEFLATE
+
+# Inclusive range of compression levels, by codec.  Zstandard's negative levels trade ratio for speed.
+CODEC_LEVELS = {
+    CODEC_DEFLATE: (-1, 9),
+    CODEC_ZSTANDARD: (-(1 << 17), 22),
+}
+
+_available_codecs = None
+
+
+def available_codecs():
+    """
+        Returns the codecs whose compression library is installed, as a tuple.
+    """
+    global _available_codecs
+    if _available_codecs is None:
+        probe = parse_schema({'type': 'record', 'name': 'Probe', 'fields': []})
+        available = []
+        for name in CODECS:
+            try:
+                writer(BytesIO(), probe, [{}], codec=name)
+            except ValueError:
+                continue
+            available.append(name)
+        _available_codecs = tuple(available)
+    return _available_codecs
 
 
-def serialize(schema_map, batch, ephemeral_storage=False, **metadata):
+class Codec(object):
     """
-        Serialize a batch of values, matching the given schema, as an
+        Compression applied to the data blocks of Avro containers.
+
+        Adaptive compression is enabled with `min_bytes`: containers smaller than
+        `min_bytes` before compression are written uncompressed, since compressing
+        small payloads costs more CPU than the bytes it saves.
+    """
+
+    __slots__ = ('name', 'level', 'min_bytes')
+
+    def __init__(self, name=DEFAULT_CODEC, level=None, min_bytes=0):
+        """
+            Kwargs:
+                name: str - One of 'null', 'deflate', 'snappy' or 'zstandard'.
+                level: int - Compression level for deflate (-1 - 9) and zstandard (-131072 - 22).
+                       Default = None, the library's default.
+                min_bytes: int - Uncompressed size below which a container is left uncompressed.
+
+            Raises:
+                ValueError - Unknown codec, uninstalled compression library or invalid level.
+        """
+        if name not in CODECS:
+            raise ValueError("codec must be one of {}".format(", ".join(CODECS)))
+        if name not in available_codecs():
+            raise ValueError("codec '{}' requires a compression library that is not installed".format(name))
+        if level is not None:
+            if name not in CODEC_LEVELS:
+                raise ValueError("level only applies to deflate and zstandard")
+            low, high = CODEC_LEVELS[name]
+            if not isinstance(level, int) or not low <= level <= high:
+                raise ValueError("{} level must be an int from {} to {}".format(name, low, high))
+        if min_bytes < 0:
+            raise ValueError("min_bytes must be >= 0")
+
+        self.name = name
+        self.level = level
+        self.min_bytes = min_bytes
+
+    def name_for(self, n_bytes):
+        """
+            Codec name to write `n_bytes` of encoded records with.
+        """
+        return CODEC_NULL if n_bytes < self.min_bytes else self.name
+
+    def _key(self):
+        return self.name, self.level, self.min_bytes
+
+    def __eq__(self, other):
+        return isinstance(other, Codec) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __getstate__(self):
+        return self._key()
+
+    def __setstate__(self, state):
+        self.name, self.level, self.min_bytes = state
+
+    def __repr__(self):
+        return "Codec({!r}, level={!r}, min_bytes={!r})".format(*self._key())
+
+
+_codecs = {}
+
+
+def as_codec(codec):
+    """
+        Returns `codec` as a Codec.
+
+        Args:
+            codec: Codec, str or None - A codec name stands for that codec at its default
+                   level.  None stands for DEFAULT_CODEC.
+    """
+    if isinstance(codec, Codec):
+        return codec
+
+    name = DEFAULT_CODEC if codec is None else codec
+    cached = _codecs.get(name)
+    if cached is None:
+        cached = _codecs[name] = Codec(name)
+    return cached
+
+
+def _compress_bound(codec_name, n_bytes):
+    # Worst case compressed block sizes, as computed by each library's compressBound.
+    if codec_name == CODEC_DEFLATE:
+        return n_bytes + (n_bytes >> 12) + (n_bytes >> 14) + (n_bytes >> 25) + 13
+    if codec_name == CODEC_SNAPPY:
+        # Avro appends a 4 byte CRC32 to snappy blocks.
+        return 32 + n_bytes + n_bytes // 6 + 4
+    if codec_name == CODEC_ZSTANDARD:
+        return n_bytes + (n_bytes >> 8) + (((128 << 10) - n_bytes) >> 11 if n_bytes < (128 << 10) else 0)
+    return n_bytes
+
+
+def _flatten(batch):
+    for record_or_generator in batch:
+        if isinstance(record_or_generator, types.GeneratorType):
+            # Fast avro doesn't handle iterators within iterators gracefully..
+            for record in record_or_generator:
+                yield record
+        else:
+            yield record_or_generator
+
+
+def serialize(schema_map, batch, ephemeral_storage=False, block_size=DEFAULT_BLOCK_SIZE, codec=None, validation=None,
+              **metadata):
+    """
+        Serialize a batch of values, matching the given schema, as a single
         Avro object container file.
 
         Note - This function reserves the `postmates.` metadata keyspace for
         for internal use.
 
         Args:
-            schema_map: dict or pycernan.avro.serde.parse - Avro schema defintion.
+            schema_map: dict or pycernan.avro.serde.parse_schema - Avro schema defintion.
+                        Parsed schemas are cached, see pycernan.avro.schema_cache.
             batch: list - List of concrete avro types or avro type generators.
 
         Kwargs:
             ephemeral_storage: bool - Flag to indicate whether the batch
                                       should be stored long-term.
+            block_size: int - Uncompressed bytes buffered before a data block is
+                              emitted.  Default = DEFAULT_BLOCK_SIZE.
+            codec: Codec or str - Compression of data blocks.  Default = DEFAULT_CODEC.
+            validation: pycernan.avro.validation.Validation, str or bool - Decides whether records
+                        are validated before they are encoded.  Default = None, the process wide
+                        policy.  See pycernan.avro.validation.
             **metadata: dict - User defined metadata included in the header.
 
         Returns:
             bytes
+
+        Raises:
+            DatumTypeException - A record does not match the schema.
     """
-    parsed_schema = parse_schema(schema_map)
+    parsed_schema = cached_parse_schema(schema_map)
+    codec = as_codec(codec)
+    validate = should_validate(validation, parsed_schema)
     avro_buf = BytesIO()
+    metadata = _container_metadata(ephemeral_storage, metadata)
+
+    # Adaptive codecs encode uncompressed first, compressing the blocks only if there are enough bytes.
+    name = CODEC_NULL if codec.min_bytes else codec.name
+    try:
+        writer(avro_buf, parsed_schema, _flatten(batch), codec=name, sync_interval=block_size, metadata=metadata,
+               validator=validate, codec_compression_level=codec.level)
+    except _DATUM_ERRORS as e:
+        raise DatumTypeException(e)
+
+    if codec.name_for(avro_buf.tell()) == name:
+        return avro_buf.getvalue()
+
+    avro_buf.seek(0)
+    compressed = BytesIO()
+    container = Writer(compressed, parsed_schema, codec=codec.name, compression_level=codec.level, metadata=metadata)
+    for block in block_reader(avro_buf):
+        container.write_block(block)
+    container.flush()
+    return compressed.getvalue()
+
 
+def _container_metadata(ephemeral_storage, metadata):
     if ephemeral_storage:
         metadata['postmates.storage.ephemeral'] = '1'
 
@@ -39,19 +236,204 @@ def serialize(schema_map, batch, ephemeral_storage=False, **metadata):
         if not isinstance(v, str):
             metadata[k] = str(v)
 
-    for record_or_generator in batch:
-        write_data = [record_or_generator]
-        if isinstance(record_or_generator, types.GeneratorType):
-            # Fast avro doesn't handle iterators within iterators gracefully..
-            write_data = record_or_generator
-        try:
-            writer(avro_buf, parsed_schema, write_data, codec='deflate', metadata=metadata, validator=True)
-        except (ValueError, TypeError, ValidationError) as e:
-            raise DatumTypeException(e)
+    return metadata
+
+
+def encode_record(schema_map, record, buf, validate_record=True):
+    """
+        Validates and appends the schemaless (block level) encoding of a record to `buf`.
+
+        Args:
+            schema_map: dict or pycernan.avro.serde.parse_schema - Avro schema defintion.
+            record: dict - Avro record.
+            buf: BytesIO - Buffer the encoded record is written to.
+
+        Kwargs:
+            validate_record: bool - Validate the record before encoding it.  Default = True.
+
+        Returns:
+            int - Number of bytes written.
+
+        Raises:
+            DatumTypeException - The record does not match the schema.
+    """
+    parsed_schema = cached_parse_schema(schema_map)
+    start = buf.tell()
+    try:
+        if validate_record:
+            validate(record, parsed_schema, raise_errors=True)
+        schemaless_writer(buf, parsed_schema, record)
+    except _DATUM_ERRORS as e:
+        # Discard any partially encoded record.
+        buf.seek(start)
+        buf.truncate()
+        raise DatumTypeException(e)
+    return buf.tell() - start
+
+
+def serialize_block(schema_map, block, num_records, ephemeral_storage=False, codec=None, **metadata):
+    """
+        Wraps records previously encoded by `encode_record` in an Avro object container file.
 
+        Args:
+            schema_map: dict or pycernan.avro.serde.parse_schema - Avro schema defintion.
+            block: BytesIO - Concatenated record encodings.
+            num_records: int - Number of records encoded in `block`.
+
+        Kwargs:
+            ephemeral_storage: bool - Flag to indicate whether the batch
+                                      should be stored long-term.
+            codec: Codec or str - Compression of the data block.  Default = DEFAULT_CODEC.
+            **metadata: dict - User defined metadata included in the header.
+
+        Returns:
+            bytes
+    """
+    parsed_schema = cached_parse_schema(schema_map)
+    codec = as_codec(codec)
+    avro_buf = BytesIO()
+    metadata = _container_metadata(ephemeral_storage, metadata)
+
+    name = codec.name_for(block.seek(0, 2))
+    container = Writer(avro_buf, parsed_schema, codec=name, compression_level=codec.level, metadata=metadata)
+    container.write_block(_EncodedBlock(num_records, block))
+    container.flush()
     return avro_buf.getvalue()
 
 
+class Encoder(object):
+    """
+        Encodes batches of one schema as Avro object container files, with a header computed once.
+
+        The header of a container (magic, schema, metadata and sync marker) is the same for
+        every batch of a schema, codec and metadata, and for small batches it is often larger
+        than the records themselves.  An Encoder writes it once per codec and prefixes it to
+        the data blocks of each batch, so containers only cost their records to encode.
+        Containers of an Encoder share its sync marker and are otherwise what `serialize`
+        would produce.
+
+        Thread safe.
+    """
+
+    def __init__(self, schema_map, codec=None, ephemeral_storage=False, block_size=DEFAULT_BLOCK_SIZE, validation=None,
+                 **metadata):
+        """
+            Args:
+                schema_map: dict or pycernan.avro.serde.parse_schema - Avro schema defintion.
+
+            Kwargs:
+                codec: Codec or str - Compression of data blocks.  Default = DEFAULT_CODEC.
+                ephemeral_storage: bool - Flag to indicate whether batches
+                                          should be stored long-term.
+                block_size: int - Uncompressed bytes buffered before a data block is
+                                  emitted.  Default = DEFAULT_BLOCK_SIZE.
+                validation: pycernan.avro.validation.Validation, str or bool - Decides whether the
+                            records of each batch are validated.  Default = None, the process wide policy.
+                **metadata: dict - User defined metadata included in the header.
+        """
+        self.parsed_schema = cached_parse_schema(schema_map)
+        self.codec = as_codec(codec)
+        self.block_size = block_size
+        self.validation = validation
+        self.metadata = _container_metadata(ephemeral_storage, metadata)
+        self.sync_marker = os.urandom(16)
+        self._lock = threading.Lock()
+        # Header, writer and its output buffer, by codec name.
+        self._writers = {}
+
+    def _writer(self, name):
+        entry = self._writers.get(name)
+        if entry is None:
+            out = BytesIO()
+            container = Writer(out, self.parsed_schema, codec=name, sync_interval=self.block_size,
+                               compression_level=self.codec.level, metadata=dict(self.metadata), sync_marker=self.sync_marker)
+            # The writer emits the header on creation, later writes are data blocks.
+            entry = self._writers[name] = (out.getvalue(), container, out)
+            out.seek(0)
+            out.truncate()
+        return entry
+
+    def header(self, codec_name=None):
+        """
+            Container header for `codec_name`.  Default = the encoder's codec.
+
+            Returns:
+                bytes
+        """
+        with self._lock:
+            return self._writer(codec_name or self.codec.name)[0]
+
+    def encode(self, batch):
+        """
+            Encodes a batch of records as an Avro object container file.
+
+            Args:
+                batch: list - List of concrete avro types or avro type generators.
+
+            Returns:
+                bytes
+
+            Raises:
+                DatumTypeException - A record does not match the schema.
+        """
+        parsed_schema = self.parsed_schema
+        validating = should_validate(self.validation, parsed_schema)
+        # Adaptive codecs encode uncompressed first, compressing the blocks only if there are enough bytes.
+        name = CODEC_NULL if self.codec.min_bytes else self.codec.name
+        with self._lock:
+            header, container, out = self._writer(name)
+            try:
+                out.write(header)
+                for record in _flatten(batch):
+                    if validating:
+                        validate(record, parsed_schema, raise_errors=True)
+                    container.write(record)
+                container.flush()
+                avro_bytes = out.getvalue()
+            except BaseException as e:
+                # The writer holds the records of the failed batch buffered, so is replaced.
+                del self._writers[name]
+                if isinstance(e, _DATUM_ERRORS):
+                    raise DatumTypeException(e)
+                raise
+            finally:
+                out.seek(0)
+                out.truncate()
+
+        if self.codec.name_for(len(avro_bytes)) == name:
+            return avro_bytes
+        return self._container(block_reader(BytesIO(avro_bytes)), self.codec.name)
+
+    def encode_block(self, block, num_records):
+        """
+            Wraps records previously encoded by `encode_record` in an Avro object container file.
+
+            Args:
+                block: BytesIO - Concatenated record encodings.
+                num_records: int - Number of records encoded in `block`.
+
+            Returns:
+                bytes
+        """
+        return self._container([_EncodedBlock(num_records, block)], self.codec.name_for(block.seek(0, 2)))
+
+    def _container(self, blocks, name):
+        with self._lock:
+            header, container, out = self._writer(name)
+            try:
+                out.write(header)
+                for block in blocks:
+                    container.write_block(block)
+                return out.getvalue()
+            finally:
+                out.seek(0)
+                out.truncate()
+
+    def __repr__(self):
+        name = self.parsed_schema.get('name') if isinstance(self.parsed_schema, dict) else self.parsed_schema
+        return "Encoder({!r}, codec={!r})".format(name, self.codec)
+
+
 def deserialize(avro_bytes, decode_schema=False, reader_schema=None):
     """
         Deserialize encoded avro bytes.
@@ -63,6 +445,7 @@ def deserialize(avro_bytes, decode_schema=False, reader_schema=None):
             decode_schema: Bool - Load metadata['avro.schema'] as Python dictionary?.  Default = False.
 
             reader_schema: Dict - Schema to use when deserializing. If None, use writer_schema.  Default = None.
+                           Parsed reader schemas are cached, see pycernan.avro.schema_cache.
 
         Returns:
             (metadata, values) where:
@@ -85,6 +468,9 @@ def deserialize(avro_bytes, decode_schema=False, reader_schema=None):
     else:
         raise ValueError("avro_bytes must be a bytes object or file-like io object")
 
+    if reader_schema is not None:
+        reader_schema = cached_parse_schema(reader_schema)
+
     read = reader(buffer, reader_schema=reader_schema)
     values = _avro_generator(read)
     metadata = read.metadata
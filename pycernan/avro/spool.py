@@ -0,0 +1,330 @@
+"""
+    Disk-backed spool of framed payloads awaiting publication.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+
+from pycernan.avro.exceptions import SpoolFullException
+from pycernan.avro import metrics
+
+_LENGTH = struct.Struct(">L")
+# Offset, from the start of a frame, of the control, id and shard fields shared by V1 and V2 headers.
+_CONTROL_ID_SHARD = struct.Struct(">LQQ")
+_CONTROL_ID_SHARD_OFFSET = 8
+
+SEGMENT_SUFFIX = '.seg'
+CURSOR_FILE = 'cursor'
+
+FSYNC_ALWAYS = 'always'
+FSYNC_INTERVAL = 'interval'
+FSYNC_NEVER = 'never'
+
+
+def frame_id(frame):
+    """
+        Returns (payload_id, sync, shard) for a length prefixed V1 / V2 frame.
+    """
+    control, payload_id, shard = _CONTROL_ID_SHARD.unpack_from(frame, _CONTROL_ID_SHARD_OFFSET)
+    return payload_id, control & 1, shard
+
+
+def _segment_name(seq):
+    return '{:020d}{}'.format(seq, SEGMENT_SUFFIX)
+
+
+def _valid_length(buf, start=0):
+    """
+        Length of the prefix of `buf`, from `start`, made up of complete frames.
+    """
+    offset = start
+    while offset + _LENGTH.size <= len(buf):
+        (length,) = _LENGTH.unpack_from(buf, offset)
+        end = offset + _LENGTH.size + length
+        if length == 0 or end > len(buf):
+            break
+        offset = end
+    return offset
+
+
+class Spool(object):
+    """
+        Append-only log of length prefixed V1 / V2 frames split across segment files.
+
+        Frames are stored exactly as sent on the wire, so replaying a frame is a raw
+        resend.  Segments are read through mmap.  A cursor file records how far
+        replay has progressed; segments behind it are deleted.  The cursor is written
+        every `cursor_frames` committed frames or `cursor_interval` seconds, whichever
+        comes first, and whenever a segment is fully replayed, the spool drains or it
+        is closed.  Delivery is at-least-once: up to `cursor_frames` frames replayed
+        before a crash, after the last cursor write, are replayed again on restart.
+
+        On open, a frame torn by a crash at the end of the newest segment is truncated.
+    """
+
+    def __init__(self, directory, max_bytes=1024 ** 3, segment_bytes=64 * 1024 ** 2,
+                 fsync=FSYNC_INTERVAL, fsync_interval=1.0, cursor_frames=100, cursor_interval=1.0):
+        """
+            Args:
+                directory: str - Directory holding segment files.  Created if missing.
+
+            Kwargs:
+                max_bytes: int - Appends that would grow the spool beyond this raise SpoolFullException.
+                segment_bytes: int - Size at which a new segment file is started.
+                fsync: str - 'always' fsyncs every append, 'interval' at most once per
+                       `fsync_interval` seconds, 'never' leaves flushing to the OS.
+                fsync_interval: float - Seconds between fsyncs under the 'interval' policy.
+                cursor_frames: int - Committed frames after which the cursor is written.
+                cursor_interval: float - Seconds after which the cursor is written, on the next commit.
+        """
+        if fsync not in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER):
+            raise ValueError("fsync must be one of 'always', 'interval', 'never'")
+        if max_bytes <= 0 or segment_bytes <= 0 or cursor_frames <= 0:
+            raise ValueError("max_bytes, segment_bytes and cursor_frames must be > 0")
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.cursor_frames = cursor_frames
+        self.cursor_interval = cursor_interval
+
+        self._lock = threading.Lock()
+        self._last_fsync = time.time()
+        # Frames committed since the cursor was last written.
+        self._uncommitted = 0
+        self._last_cursor = time.time()
+        self._writer = None
+        self._map = None
+        self._map_seq = None
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._recover()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _recover(self):
+        self._segments = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+
+        if self._segments:
+            newest = self._path(_segment_name(self._segments[-1]))
+            with open(newest, 'rb') as f:
+                contents = f.read()
+            valid = _valid_length(contents)
+            if valid != len(contents):
+                with open(newest, 'r+b') as f:
+                    f.truncate(valid)
+
+        self._read_seq, self._read_offset = self._load_cursor()
+        for seq in list(self._segments):
+            if seq < self._read_seq:
+                self._remove_segment(seq)
+        if self._segments and self._read_seq not in self._segments:
+            self._read_seq, self._read_offset = self._segments[0], 0
+
+        self.size_bytes = sum(os.path.getsize(self._path(_segment_name(seq))) for seq in self._segments)
+        self.size_bytes -= self._read_offset if self._segments else 0
+        metrics.spool_bytes.set(self.size_bytes)
+
+    def _load_cursor(self):
+        try:
+            with open(self._path(CURSOR_FILE)) as f:
+                seq, offset = f.read().split()
+            return int(seq), int(offset)
+        except (IOError, OSError, ValueError):
+            return (self._segments[0] if self._segments else 0), 0
+
+    def _store_cursor(self):
+        tmp = self._path(CURSOR_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            f.write('{} {}'.format(self._read_seq, self._read_offset))
+            if self.fsync == FSYNC_ALWAYS:
+                f.flush()
+                os.fsync(f.fileno())
+        os.rename(tmp, self._path(CURSOR_FILE))
+        self._uncommitted = 0
+        self._last_cursor = time.time()
+
+    def _remove_segment(self, seq):
+        self._segments.remove(seq)
+        if self._map_seq == seq:
+            self._unmap()
+        try:
+            os.remove(self._path(_segment_name(seq)))
+        except OSError:
+            pass
+
+    def empty(self):
+        return self.size_bytes == 0
+
+    def append(self, frame):
+        """
+            Appends a length prefixed frame.
+
+            Raises:
+                SpoolFullException - The spool would exceed `max_bytes`.
+        """
+        with self._lock:
+            if self.size_bytes + len(frame) > self.max_bytes:
+                metrics.spool_full_count.inc()
+                raise SpoolFullException()
+
+            if self._writer is None or self._writer.tell() >= self.segment_bytes:
+                self._roll()
+
+            self._writer.write(frame)
+            self._writer.flush()
+            self._sync()
+            self.size_bytes += len(frame)
+            metrics.spool_append_count.inc()
+            metrics.spool_bytes.set(self.size_bytes)
+
+    def _roll(self):
+        if self._writer is not None:
+            self._writer.close()
+        seq = self._segments[-1] + 1 if self._segments else self._read_seq
+        self._segments.append(seq)
+        self._writer = open(self._path(_segment_name(seq)), 'ab')
+
+    def _sync(self):
+        now = time.time()
+        if self.fsync == FSYNC_ALWAYS or (self.fsync == FSYNC_INTERVAL and now - self._last_fsync >= self.fsync_interval):
+            os.fsync(self._writer.fileno())
+            self._last_fsync = now
+
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+        self._map = None
+        self._map_seq = None
+
+    def _mapped(self, seq, needed):
+        # Maps segment `seq`, remapping if it has grown since it was last mapped.
+        if self._map_seq != seq or len(self._map) < needed:
+            path = self._path(_segment_name(seq))
+            size = os.path.getsize(path)
+            if size < needed or size == 0:
+                return None
+            self._unmap()
+            with open(path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            self._map_seq = seq
+        return self._map
+
+    def peek(self):
+        """
+            Returns the oldest frame not yet committed, or None when the spool is drained.
+
+            Returns:
+                ((seq, offset, length), frame) - Position to pass to `commit` and the frame bytes.
+        """
+        with self._lock:
+            while self._segments:
+                seq, offset = self._read_seq, self._read_offset
+                mapped = self._mapped(seq, offset + _LENGTH.size)
+                if mapped is not None:
+                    (length,) = _LENGTH.unpack_from(mapped, offset)
+                    end = offset + _LENGTH.size + length
+                    mapped = self._mapped(seq, end)
+                    if mapped is not None:
+                        return (seq, offset, end - offset), mapped[offset:end]
+
+                if seq == self._segments[-1]:
+                    if self._uncommitted:
+                        # Drained, so there may not be another commit to write the cursor.
+                        self._store_cursor()
+                    return None
+
+                # Older segments are immutable, so this one is fully replayed.
+                self._remove_segment(seq)
+                self._read_seq, self._read_offset = self._segments[0], 0
+                self._store_cursor()
+            return None
+
+    def commit(self, position):
+        """
+            Marks the frame at `position`, as returned by `peek`, as published.
+        """
+        seq, offset, length = position
+        with self._lock:
+            if (seq, offset) != (self._read_seq, self._read_offset):
+                return
+            self._read_offset += length
+            self.size_bytes -= length
+            metrics.spool_replay_count.inc()
+            metrics.spool_bytes.set(self.size_bytes)
+            self._uncommitted += 1
+            if self._uncommitted >= self.cursor_frames or time.time() - self._last_cursor >= self.cursor_interval:
+                self._store_cursor()
+
+    def close(self):
+        with self._lock:
+            if self._uncommitted:
+                self._store_cursor()
+            self._unmap()
+            if self._writer is not None:
+                self._writer.flush()
+                if self.fsync != FSYNC_NEVER:
+                    os.fsync(self._writer.fileno())
+                self._writer.close()
+                self._writer = None
+
+
+class SpoolReplayer(object):
+    """
+        Background thread resending spooled frames, oldest first, through a client.
+
+        A frame is committed once it has been written and, if it requested one,
+        acknowledged.  On failure the replayer backs off for `retry_interval`.
+    """
+
+    def __init__(self, client, spool, poll_interval=0.1, retry_interval=1.0):
+        self.client = client
+        self.spool = spool
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='pycernan-spool-replayer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._thread.join(timeout)
+
+    def replay_once(self):
+        """
+            Resends the oldest spooled frame.
+
+            Returns:
+                bool - False if the spool is empty.
+        """
+        entry = self.spool.peek()
+        if entry is None:
+            return False
+
+        position, frame = entry
+        payload_id, sync, shard = frame_id(frame)
+        result = self.client._transmit(payload_id, sync, frame, shard if self.client.routed else None)
+        if result is not None:
+            # Pipelined clients return a future resolved by the ack.
+            result.result()
+        self.spool.commit(position)
+        return True
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                if not self.replay_once():
+                    self._stopped.wait(self.poll_interval)
+            except Exception:
+                metrics.spool_replay_failure_count.inc()
+                self._stopped.wait(self.retry_interval)
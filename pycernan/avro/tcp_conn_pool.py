@@ -1,13 +1,60 @@
 import contextlib
+import os
+import select
 import socket
+import time
 from queue import Queue, Empty
 
 from pycernan.avro.exceptions import EmptyPoolException
-from pycernan.avro import metrics
+from pycernan.avro import forking, metrics
 
 _DefunctConnection = object()
 
 
+def configure_socket(sock, keepalive=True, nodelay=True, sndbuf=None):
+    """
+        Applies TCP options to a newly established connection.
+
+        Args:
+            sock: socket.socket - Connection to configure.
+
+        Kwargs:
+            keepalive: bool - Enable SO_KEEPALIVE, so the OS detects dead peers on idle connections.
+            nodelay: bool - Enable TCP_NODELAY, so small frames are not held back by Nagle's algorithm.
+            sndbuf: int - SO_SNDBUF in bytes.  Default = None, the OS default.
+    """
+    if keepalive:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if nodelay:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if sndbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+
+
+def is_alive(sock):
+    """
+        Cheap, non-blocking check that an idle connection has not been closed by its peer.
+
+        An idle connection to Cernan should have nothing to read.  A readable
+        connection has either reached EOF or holds bytes, such as a stale ack,
+        that would be mistaken for the next payload's ack, so both count as dead.
+
+        Returns:
+            bool
+    """
+    try:
+        if hasattr(select, 'poll'):
+            poller = select.poll()
+            poller.register(sock, select.POLLIN)
+            readable = poller.poll(0)
+        else:
+            readable, _, _ = select.select([sock], [], [], 0)
+    except (ValueError, TypeError, select.error):
+        # Closed sockets.
+        return False
+    return not readable
+
+
 class TCPConnectionPool(object):
     """
     Fork friendly TCP connection pool.
@@ -18,9 +65,32 @@ class TCPConnectionPool(object):
     handle responsibly.  One day, with sufficient time and motivation, this class could be made
     more intelligent to handle connection related exceptions distinct from application layer
     concerns.
+
+    Pooled connections idle for longer than `max_idle`, or found closed by a
+    liveness check, are closed and replaced when next checked out.
+
+    Connections are owned by the process that created them.  In a forked child
+    inherited connections are discarded, without being shut down, and the child
+    lazily establishes its own, so processes never interleave frames on a socket.
     """
 
-    def __init__(self, host, port, maxsize, connect_timeout, read_timeout):
+    def __init__(self, host, port, maxsize, connect_timeout, read_timeout, prewarm=False, max_idle=None,
+                 check_liveness=True, keepalive=True, nodelay=True, sndbuf=None):
+        """
+            Args:
+                host: str - Cernan host.
+                port: int - Port of Cernan's Avro source.
+                maxsize: int - Maximum number of pooled connections.
+                connect_timeout: float - Seconds to wait when establishing connections.
+                read_timeout: float - Seconds to wait on socket operations.
+
+            Kwargs:
+                prewarm: bool - Establish `maxsize` connections up front.  Failures are tolerated.
+                max_idle: float - Seconds after which an unused connection is replaced.
+                          Default = None, never.
+                check_liveness: bool - Peek at pooled connections for EOF before handing them out.
+                keepalive, nodelay, sndbuf - TCP options.  See configure_socket.
+        """
         if maxsize <= 0:
             raise ValueError("maxsize must be > 0")
 
@@ -30,23 +100,89 @@ class TCPConnectionPool(object):
 
         self.connect_timeout = connect_timeout
         self.read_timeout = read_timeout
+        self.max_idle = max_idle
+        self.check_liveness = check_liveness
+        self.socket_options = {'keepalive': keepalive, 'nodelay': nodelay, 'sndbuf': sndbuf}
+
+        self._reset()
+        forking.register(self)
+
+        if prewarm:
+            self.prewarm()
+
+    def _reset(self):
+        self._last_used = {}
+        # A new queue, since the inherited one's locks may have been held at fork.
         self.pool = Queue()
-        for _ in range(maxsize):
-            self._put(_DefunctConnection)
+        for _ in range(self.maxsize):
+            self.pool.put(_DefunctConnection)
+
+    def _after_fork(self):
+        # Inherited sockets are dropped, not closed, leaving the parent's connections intact.
+        self._reset()
+
+    def prewarm(self):
+        """
+            Establishes connections in place of any defunct pooled ones.
+
+            Returns:
+                int - Number of connections established.
+        """
+        created = 0
+        for _ in range(self.maxsize):
+            try:
+                connection = self.pool.get_nowait()
+            except Empty:
+                break
+
+            if connection is _DefunctConnection:
+                try:
+                    connection = self._create_connection()
+                    created += 1
+                except Exception:
+                    metrics.conn_failure_count.inc()
+            self._put(connection)
+        return created
 
     def _create_connection(self):
         metrics.conn_create_count.inc()
         sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
         sock.settimeout(self.read_timeout)
+        configure_socket(sock, **self.socket_options)
         return sock
 
+    def _close(self, connection):
+        self._last_used.pop(connection, None)
+        try:
+            connection.close()
+            metrics.conn_close_count.inc()
+        except Exception:
+            pass
+
+    def _is_stale(self, connection):
+        last_used = self._last_used.get(connection)
+        if self.max_idle is not None and last_used is not None and time.time() - last_used > self.max_idle:
+            metrics.conn_idle_eviction_count.inc()
+            return True
+
+        if self.check_liveness and not is_alive(connection):
+            metrics.conn_liveness_failure_count.inc()
+            return True
+
+        return False
+
     def _get(self, _block=True):
+        forking.check(self)
         try:
             connection = self.pool.get(_block)
         except Empty:
             # Expected to happen only when users override _block=False
             raise EmptyPoolException()
 
+        if connection is not _DefunctConnection and self._is_stale(connection):
+            self._close(connection)
+            connection = _DefunctConnection
+
         # When a connection is defunct, we attempt to
         # regenerate it.  Note - it is important that we always return
         # something back to the queue here so that we don't erode our capacity.
@@ -63,17 +199,21 @@ class TCPConnectionPool(object):
 
     def _put(self, item):
         # Why this function?  It makes mocking in unit tests easier.
+        if item is not _DefunctConnection:
+            self._last_used[item] = time.time()
         self.pool.put(item)
 
     def closeall(self):
         """
             Close established connections currently not in-use.
         """
+        forking.check(self)
         try:
             while True:
                 conn = self.pool.get_nowait()
                 if conn is _DefunctConnection:
                     continue
+                self._last_used.pop(conn, None)
                 conn.close()
         except Exception:
             pass
@@ -84,7 +224,9 @@ class TCPConnectionPool(object):
             Context manager for pooled connections.
         """
         garbage = None
-        conn = self._get(_block)
+        pid = os.getpid()
+        with metrics.conn_acquire_latency.time():
+            conn = self._get(_block)
         try:
             yield conn
         except Exception:
@@ -97,10 +239,8 @@ class TCPConnectionPool(object):
             metrics.conn_failure_count.inc()
             raise
         finally:
-            if garbage:
-                try:
-                    garbage.close()
-                    metrics.conn_close_count.inc()
-                except Exception:
-                    pass
-            self._put(conn)
+            # A connection checked out before fork belongs to the parent, leave it be.
+            if pid == os.getpid():
+                if garbage:
+                    self._close(garbage)
+                self._put(conn)
@@ -0,0 +1,363 @@
+"""
+    Stand-in for Cernan's Avro source, for tests, benchmarks and load testing.
+
+    Run standalone with `python -m pycernan.avro.testing --port 2002`.
+"""
+import argparse
+import asyncio
+import random
+import socket
+import struct
+import threading
+import time
+
+from pycernan.avro.serde import deserialize
+
+_LENGTH = struct.Struct(">L")
+_HEADER = struct.Struct(">LLQQ")
+_ACK = struct.Struct(">Q")
+_LINGER_RESET = struct.pack("ii", 1, 0)
+
+
+class Frame(object):
+    """
+        A decoded V1 / V2 payload.
+
+        `records` holds the decoded Avro records when the server decodes payloads, None otherwise.
+    """
+
+    def __init__(self, version, control, payload_id, shard_by, metadata, avro_blob):
+        self.version = version
+        self.control = control
+        self.payload_id = payload_id
+        self.shard_by = shard_by
+        self.metadata = metadata
+        self.avro_blob = avro_blob
+        self.records = None
+
+    @property
+    def sync(self):
+        return bool(self.control & 1)
+
+
+def parse_frame(payload):
+    """
+        Decodes a payload, excluding its 4 byte length prefix.
+
+        Metadata is decoded as UTF-8.  The protocol enforces no encoding, so bytes that
+        are not UTF-8 are kept as surrogate escapes, recoverable with
+        `value.encode('utf-8', 'surrogateescape')`.
+
+        Args:
+            payload: bytes - Frame body as produced by v1.frame / v2.frame.
+
+        Returns:
+            Frame
+
+        Raises:
+            ValueError - The payload is truncated or of an unsupported version.
+    """
+    try:
+        version, control, payload_id, shard_by = _HEADER.unpack_from(payload)
+        offset = _HEADER.size
+        metadata = {}
+        if version == 2:
+            num_pairs = payload[offset]
+            offset += 1
+            for _ in range(num_pairs):
+                key_len = payload[offset]
+                key = bytes(payload[offset + 1:offset + 1 + key_len])
+                offset += 1 + key_len
+                (val_len,) = struct.unpack_from(">H", payload, offset)
+                val = bytes(payload[offset + 2:offset + 2 + val_len])
+                offset += 2 + val_len
+                metadata[key.decode("utf-8", "surrogateescape")] = val.decode("utf-8", "surrogateescape")
+            if offset > len(payload):
+                raise IndexError("metadata runs past the end of the frame")
+        elif version != 1:
+            raise ValueError("Unsupported protocol version {}".format(version))
+    except (struct.error, IndexError) as e:
+        raise ValueError("Malformed frame: {}".format(e))
+
+    return Frame(version, control, payload_id, shard_by, metadata, bytes(payload[offset:]))
+
+
+def _write_unless_closing(writer, data):
+    if not writer.is_closing():
+        writer.write(data)
+
+
+class FakeCernanServer(object):
+    """
+        Accepts V1 and V2 frames over TCP and acknowledges them.
+
+        The server runs its own asyncio event loop in a background thread so it
+        can be used by both synchronous and asyncio clients.
+
+        Faults are injected per frame, at random, to exercise client error handling:
+
+            drop_rate - The frame is accepted but never acknowledged.
+            reset_rate - The connection is reset instead of acknowledging the frame.
+            wrong_ack_rate - The frame is acknowledged with a different id.
+
+        Frames that cannot be parsed are counted in `malformed_count` and close their connection.
+
+        Usage:
+
+            with FakeCernanServer(decode=True) as server:
+                client = Client(host=server.host, port=server.port)
+                ...
+                assert server.frame_count == 1
+                assert server.event_count == len(records)
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, ack_delay=0, record_frames=False, decode=False, drop_rate=0,
+                 reset_rate=0, wrong_ack_rate=0, seed=None):
+        """
+            Kwargs:
+                host: str - Interface to listen on.
+                port: int - Port to listen on.  Default = 0, any free port.
+                ack_delay: float or callable - Seconds between receiving a frame and acknowledging it,
+                           or a callable returning them per frame.  Acks on a connection are
+                           always sent in the order frames were received, as Cernan does.
+                record_frames: bool - Keep every decoded Frame in `frames`.
+                decode: bool - Decode Avro payloads with pycernan.avro.serde.deserialize, counting
+                        records in `event_count`.  Payloads that fail to decode are counted in
+                        `decode_error_count` and still acknowledged.
+                drop_rate: float - Probability that a frame is never acknowledged.
+                reset_rate: float - Probability that the connection is reset on receiving a frame.
+                wrong_ack_rate: float - Probability that a frame is acknowledged with the wrong id.
+                seed: int - Seeds fault injection, for reproducible runs.
+        """
+        self.host = host
+        self.port = port
+        self.ack_delay = ack_delay
+        self.record_frames = record_frames
+        self.decode = decode
+        self.drop_rate = drop_rate
+        self.reset_rate = reset_rate
+        self.wrong_ack_rate = wrong_ack_rate
+
+        self.frames = []
+        self.frame_count = 0
+        self.event_count = 0
+        self.bytes_received = 0
+        self.connection_count = 0
+        self.decode_error_count = 0
+        self.malformed_count = 0
+        self.dropped_count = 0
+        self.reset_count = 0
+        self.wrong_ack_count = 0
+
+        self._random = random.Random(seed)
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._writers = set()
+        self._started = threading.Event()
+        self._start_error = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def address(self):
+        return self.host, self.port
+
+    @property
+    def events(self):
+        """
+            Records decoded from recorded frames, in the order they were received.
+        """
+        with self._lock:
+            return [record for frame in self.frames for record in (frame.records or [])]
+
+    def stats(self):
+        """
+            Returns a snapshot of the server's counters as a dict.
+        """
+        with self._lock:
+            return {
+                'connections': self.connection_count,
+                'frames': self.frame_count,
+                'events': self.event_count,
+                'bytes': self.bytes_received,
+                'decode_errors': self.decode_error_count,
+                'malformed': self.malformed_count,
+                'dropped': self.dropped_count,
+                'resets': self.reset_count,
+                'wrong_acks': self.wrong_ack_count,
+            }
+
+    def start(self):
+        """
+            Starts listening, returning once the server accepts connections.
+
+            Raises:
+                OSError - The server could not listen, e.g. the port is in use.
+        """
+        self._started.clear()
+        self._start_error = None
+        self._thread = threading.Thread(target=self._run, name='fake-cernan')
+        self._thread.daemon = True
+        self._thread.start()
+        self._started.wait()
+        if self._start_error is not None:
+            self._thread.join()
+            raise self._start_error
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            self._server = loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        except BaseException as e:
+            # Raised by start() in the caller's thread.
+            self._start_error = e
+            loop.close()
+            self._started.set()
+            return
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._loop = loop
+        self._started.set()
+        try:
+            loop.run_forever()
+        finally:
+            self._server.close()
+            # Closing client connections lets each handler observe EOF and exit.
+            for writer in list(self._writers):
+                writer.close()
+            handlers = asyncio.all_tasks(loop)
+            loop.run_until_complete(asyncio.gather(*handlers, return_exceptions=True))
+            loop.run_until_complete(self._server.wait_closed())
+            loop.close()
+
+    def _decode(self, frame):
+        try:
+            _, records = deserialize(frame.avro_blob)
+            return list(records)
+        except Exception:
+            return None
+
+    def _fault(self, rate):
+        return rate and self._random.random() < rate
+
+    def _delay(self):
+        return self.ack_delay() if callable(self.ack_delay) else self.ack_delay
+
+    async def _handle(self, reader, writer):
+        with self._lock:
+            self.connection_count += 1
+        self._writers.add(writer)
+        loop = asyncio.get_running_loop()
+        # Time the latest delayed ack on this connection is due, keeping acks in order.
+        last_due = 0
+        try:
+            while True:
+                length_bytes = await reader.readexactly(_LENGTH.size)
+                (length,) = _LENGTH.unpack(length_bytes)
+                body = await reader.readexactly(length)
+
+                try:
+                    frame = parse_frame(body)
+                except ValueError:
+                    with self._lock:
+                        self.malformed_count += 1
+                    return
+                records = self._decode(frame) if self.decode else None
+                with self._lock:
+                    self.frame_count += 1
+                    self.bytes_received += _LENGTH.size + length
+                    if self.decode:
+                        if records is None:
+                            self.decode_error_count += 1
+                        else:
+                            frame.records = records
+                            self.event_count += len(records)
+                    if self.record_frames:
+                        self.frames.append(frame)
+
+                if self._fault(self.reset_rate):
+                    with self._lock:
+                        self.reset_count += 1
+                    sock = writer.get_extra_info('socket')
+                    if sock is not None:
+                        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, _LINGER_RESET)
+                    writer.transport.abort()
+                    return
+
+                if not frame.sync:
+                    continue
+
+                if self._fault(self.drop_rate):
+                    with self._lock:
+                        self.dropped_count += 1
+                    continue
+
+                ack_id = frame.payload_id
+                if self._fault(self.wrong_ack_rate):
+                    with self._lock:
+                        self.wrong_ack_count += 1
+                    ack_id = (ack_id + 1) % 2 ** 64
+                ack = _ACK.pack(ack_id)
+
+                delay = self._delay()
+                if delay or last_due > loop.time():
+                    # Delay acks without delaying reads, emulating round trip time.
+                    last_due = max(last_due, loop.time() + delay)
+                    loop.call_at(last_due, _write_unless_closing, writer, ack)
+                else:
+                    writer.write(ack)
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a fake Cernan Avro source until interrupted.")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=2002)
+    parser.add_argument("--ack-delay", type=float, default=0)
+    parser.add_argument("--decode", action='store_true', help="Decode payloads, counting events.")
+    parser.add_argument("--drop-rate", type=float, default=0)
+    parser.add_argument("--reset-rate", type=float, default=0)
+    parser.add_argument("--wrong-ack-rate", type=float, default=0)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--interval", type=float, default=5, help="Seconds between stats lines.")
+    args = parser.parse_args()
+
+    server = FakeCernanServer(args.host, args.port, ack_delay=args.ack_delay, decode=args.decode,
+                              drop_rate=args.drop_rate, reset_rate=args.reset_rate,
+                              wrong_ack_rate=args.wrong_ack_rate, seed=args.seed)
+    with server:
+        print("Listening on {}:{}".format(server.host, server.port), flush=True)
+        last = server.stats()
+        try:
+            while True:
+                time.sleep(args.interval)
+                stats = server.stats()
+                print("{:.0f} frames/s {:.0f} events/s  {}".format(
+                    (stats['frames'] - last['frames']) / args.interval,
+                    (stats['events'] - last['events']) / args.interval,
+                    " ".join("{}={}".format(k, v) for k, v in sorted(stats.items()))), flush=True)
+                last = stats
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -5,12 +5,36 @@ import struct
 
 from pycernan.avro.base_client import BaseClient, _hash_u64, _rand_u64
 
+VERSION = 1
+
+# Length, version, control, id and shard_by.
+_HEADER = struct.Struct(">LLLQQ")
+HEADER_LEN = _HEADER.size - 4
+
+
+def frame(avro_blob, sync=True, payload_id=None, shard_by=None):
+    """
+        Builds a length prefixed V1 payload.  See Client.publish_blob for the layout.
+
+        Returns:
+            (payload_id, sync, payload) - Arguments for BaseClient._send, where payload
+                                          is a (header, avro_blob) buffer sequence.
+    """
+    sync = 1 if sync else 0
+    payload_id = int(payload_id) if payload_id else _rand_u64()
+    shard_by = _hash_u64(shard_by) if shard_by else _rand_u64()
+    payload_len = HEADER_LEN + len(avro_blob)
+    header = _HEADER.pack(payload_len, VERSION, sync, payload_id, shard_by)
+    return payload_id, sync, (header, avro_blob)
+
+
 class Client(BaseClient):
     """
        V1 of the Avro source protocol.
     """
 
-    VERSION = 1
+    VERSION = VERSION
+    frame = staticmethod(frame)
 
     def publish_blob(self, avro_blob, sync=True, payload_id=None, shard_by=None):
         """
@@ -39,13 +63,8 @@ class Client(BaseClient):
                 id : int - Optional identifier for the payload.
                 shard_by : hashable value - Used to allocate the payload into a downstream bucket
                            (order is only preserved between entries allocated to the same bucket).
+
+            Returns:
+                concurrent.futures.Future in pipelined mode, None otherwise.
         """
-        version = self.VERSION
-        sync = 1 if sync else 0
-        payload_id = int(payload_id) if payload_id else _rand_u64()
-        shard_by = _hash_u64(shard_by) if shard_by else _rand_u64()
-        header = struct.pack(">LLQQ", version, sync, payload_id, shard_by)
-        payload_len = len(header) + len(avro_blob)
-        payload = struct.pack(">L", payload_len) + header + avro_blob
-
-        self._send(payload_id, sync, payload)
+        return self._send(*frame(avro_blob, sync, payload_id, shard_by), shard_by=shard_by)
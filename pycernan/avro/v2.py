@@ -2,16 +2,151 @@
     V2 Client for Cernan's Avro source.
 """
 import struct
+import threading
 
 from pycernan.avro.base_client import BaseClient, _hash_u64, _rand_u64
 
+VERSION = 2
+
+# Length, version, control, id and shard_by.
+_HEADER = struct.Struct(">LLLQQ")
+HEADER_LEN = _HEADER.size - 4
+
+_UINT8 = struct.Struct(">B")
+_UINT16 = struct.Struct(">H")
+
+MAX_PAIRS = 255
+MAX_KEY_BYTES = 255
+MAX_VALUE_BYTES = 65535
+
+# Number of distinct metadata dicts whose encoding is cached.
+KV_CACHE_SIZE = 256
+
+_EMPTY_KV = _UINT8.pack(0)
+_kv_cache = {}
+_kv_cache_lock = threading.Lock()
+
+
+def _to_bytes(value, kind):
+    if isinstance(value, bytes):
+        return value
+    try:
+        return value.encode("utf-8")
+    except AttributeError:
+        raise TypeError("Metadata {}s must be str or bytes, got {!r}".format(kind, value))
+
+
+def _encode_metadata(metadata):
+    if len(metadata) > MAX_PAIRS:
+        raise ValueError("Metadata holds {} pairs, at most {} are allowed".format(len(metadata), MAX_PAIRS))
+
+    parts = [_UINT8.pack(len(metadata))]
+    for key, val in metadata.items():
+        key_bytes = _to_bytes(key, 'key')
+        val_bytes = _to_bytes(val, 'value')
+        if len(key_bytes) > MAX_KEY_BYTES:
+            raise ValueError("Metadata key {!r} is {} bytes encoded, at most {} are allowed".format(key, len(key_bytes), MAX_KEY_BYTES))
+        if len(val_bytes) > MAX_VALUE_BYTES:
+            raise ValueError("Metadata value for {!r} is {} bytes encoded, at most {} are allowed".format(
+                key, len(val_bytes), MAX_VALUE_BYTES))
+        parts.extend((_UINT8.pack(len(key_bytes)), key_bytes, _UINT16.pack(len(val_bytes)), val_bytes))
+    return b''.join(parts)
+
+
+def encode_metadata(metadata):
+    """
+        Encodes the KV section of a V2 payload.
+
+        Encodings are cached, keyed on the metadata's contents, so publishing
+        the same metadata repeatedly encodes it once.
+
+        Args:
+            metadata: dict or PreparedMetadata - str or bytes keys and values.  May be None.
+
+        Returns:
+            bytes
+
+        Raises:
+            ValueError - More than MAX_PAIRS pairs, or a key or value longer than
+                         MAX_KEY_BYTES / MAX_VALUE_BYTES once encoded as UTF-8.
+            TypeError - A key or value is not str or bytes.
+    """
+    if not metadata:
+        return _EMPTY_KV
+    if isinstance(metadata, PreparedMetadata):
+        return metadata.encoded
+
+    try:
+        key = tuple(metadata.items())
+        kv_encoded = _kv_cache.get(key)
+    except TypeError:
+        # Unhashable values are rejected while encoding.
+        return _encode_metadata(metadata)
+
+    if kv_encoded is None:
+        kv_encoded = _encode_metadata(metadata)
+        with _kv_cache_lock:
+            if len(_kv_cache) >= KV_CACHE_SIZE:
+                _kv_cache.clear()
+            _kv_cache[key] = kv_encoded
+    return kv_encoded
+
+
+class PreparedMetadata(object):
+    """
+        Metadata encoded once, for reuse across any number of publishes.
+
+        Usage:
+
+            metadata = PreparedMetadata({'source': 'checkout'})
+            for blob in blobs:
+                client.publish_blob(blob, metadata=metadata)
+    """
+
+    __slots__ = ('metadata', 'encoded')
+
+    def __init__(self, metadata):
+        """
+            Args:
+                metadata: dict - str or bytes keys and values.
+
+            Raises:
+                ValueError, TypeError - See encode_metadata.
+        """
+        self.metadata = dict(metadata)
+        self.encoded = _encode_metadata(self.metadata)
+
+    def __len__(self):
+        return len(self.metadata)
+
+    def __repr__(self):
+        return "PreparedMetadata({!r})".format(self.metadata)
+
+
+def frame(avro_blob, sync=True, payload_id=None, shard_by=None, metadata=None):
+    """
+        Builds a length prefixed V2 payload.  See Client.publish_blob for the layout.
+
+        Returns:
+            (payload_id, sync, payload) - Arguments for BaseClient._send, where payload
+                                          is a (header, kv_encoded, avro_blob) buffer sequence.
+    """
+    sync = 1 if sync else 0
+    payload_id = int(payload_id) if payload_id else _rand_u64()
+    shard_by = _hash_u64(shard_by) if shard_by else _rand_u64()
+    kv_encoded = encode_metadata(metadata)
+    payload_len = HEADER_LEN + len(kv_encoded) + len(avro_blob)
+    header = _HEADER.pack(payload_len, VERSION, sync, payload_id, shard_by)
+    return payload_id, sync, (header, kv_encoded, avro_blob)
+
 
 class Client(BaseClient):
     """
        V2 of the Avro source protocol.
     """
 
-    VERSION = 2
+    VERSION = VERSION
+    frame = staticmethod(frame)
 
     def publish_blob(self, avro_blob, sync=True, payload_id=None, shard_by=None, metadata=None):
         """
@@ -65,18 +200,12 @@ class Client(BaseClient):
                 id : int - Optional identifier for the payload.
                 shard_by : hashable value - Used to allocate the payload into a downstream bucket
                            (order is only preserved between entries allocated to the same bucket).
+                metadata : dict or PreparedMetadata - Key value pairs sent ahead of the Avro payload.
+
+            Returns:
+                concurrent.futures.Future in pipelined mode, None otherwise.
+
+            Raises:
+                ValueError, TypeError - Invalid metadata.  See encode_metadata.
         """
-        version = self.VERSION
-        sync = 1 if sync else 0
-        payload_id = int(payload_id) if payload_id else _rand_u64()
-        shard_by = _hash_u64(shard_by) if shard_by else _rand_u64()
-        header = struct.pack(">LLQQ", version, sync, payload_id, shard_by)
-        metadata = metadata if metadata else {}
-        kv_encoded = struct.pack(">B", len(metadata))
-        for key, val in metadata.items():
-            kv_encoded += struct.pack(">B", len(key)) + key.encode("utf-8") + \
-                          struct.pack(">H", len(val)) + val.encode("utf-8")
-        payload_len = len(header) + len(kv_encoded) + len(avro_blob)
-        payload = struct.pack(">L", payload_len) + header + kv_encoded + avro_blob
-
-        self._send(payload_id, sync, payload)
+        return self._send(*frame(avro_blob, sync, payload_id, shard_by, metadata), shard_by=shard_by)
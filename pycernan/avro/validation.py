@@ -0,0 +1,142 @@
+"""
+    Policies deciding which batches are validated against their schema before encoding.
+
+    Validation walks every record a second time before it is encoded.  Producers whose
+    records are known to be well formed can validate a sample of their batches, or only
+    the first batches of each schema, rather than every batch.
+"""
+import threading
+
+from pycernan.avro import config, metrics
+
+VALIDATE_ALWAYS = 'always'
+VALIDATE_NEVER = 'never'
+VALIDATE_SAMPLED = 'sampled'
+VALIDATE_FIRST_N = 'first_n'
+
+MODES = (VALIDATE_ALWAYS, VALIDATE_NEVER, VALIDATE_SAMPLED, VALIDATE_FIRST_N)
+
+
+class Validation(object):
+    """
+        Thread safe validation policy.
+
+        Modes:
+
+            always - Every batch is validated.
+            never - No batch is validated.
+            sampled - One in every `sample_rate` batches is validated, starting with the first.
+            first_n - The first `first_n` batches of each schema are validated.
+
+        Records of batches that are not validated are still encoded strictly by type,
+        and records fastavro cannot encode raise DatumTypeException, but values such as
+        out of range integers or missing fields of nullable unions are not detected.
+    """
+
+    def __init__(self, mode=VALIDATE_ALWAYS, sample_rate=100, first_n=100):
+        """
+            Kwargs:
+                mode: str - One of 'always', 'never', 'sampled' or 'first_n'.
+                sample_rate: int - Batches per validated batch in 'sampled' mode.
+                first_n: int - Batches validated per schema in 'first_n' mode.
+        """
+        if mode not in MODES:
+            raise ValueError("mode must be one of {}".format(", ".join(MODES)))
+        if sample_rate < 1 or first_n < 0:
+            raise ValueError("sample_rate must be >= 1 and first_n >= 0")
+
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.first_n = first_n
+        self._lock = threading.Lock()
+        self._batches = 0
+        # Batches validated, by schema identity.  Schemas are referenced so their ids are not recycled.
+        self._per_schema = {}
+
+        self._validated = metrics.validation_count.labels(mode, 'true')
+        self._skipped = metrics.validation_count.labels(mode, 'false')
+
+    def _decide(self, schema):
+        if self.mode == VALIDATE_ALWAYS:
+            return True
+        if self.mode == VALIDATE_NEVER:
+            return False
+        if self.mode == VALIDATE_SAMPLED:
+            with self._lock:
+                validate = self._batches % self.sample_rate == 0
+                self._batches += 1
+            return validate
+
+        with self._lock:
+            entry = self._per_schema.get(id(schema))
+            if entry is None or entry[0] is not schema:
+                if len(self._per_schema) >= config.schema_cache_size():
+                    # Forgetting schemas only leads to them being validated again.
+                    self._per_schema.clear()
+                entry = (schema, 0)
+            if entry[1] >= self.first_n:
+                return False
+            self._per_schema[id(schema)] = (schema, entry[1] + 1)
+            return True
+
+    def should_validate(self, schema):
+        """
+            Decides whether the next batch of `schema` is validated, counting the decision.
+
+            Args:
+                schema: dict - The schema, parsed or not.  Schemas are told apart by identity.
+
+            Returns:
+                bool
+        """
+        validate = self._decide(schema)
+        (self._validated if validate else self._skipped).inc()
+        return validate
+
+    def __repr__(self):
+        return "Validation({!r}, sample_rate={!r}, first_n={!r})".format(self.mode, self.sample_rate, self.first_n)
+
+
+_named = {}
+_default = None
+_lock = threading.Lock()
+
+
+def default():
+    """
+        Process wide policy, configured by PYCERNAN_AVRO_VALIDATION.
+    """
+    global _default
+    if _default is None:
+        _default = as_validation(config.validation_mode())
+    return _default
+
+
+def as_validation(validation):
+    """
+        Returns `validation` as a Validation.
+
+        Args:
+            validation: Validation, str, bool or None - A mode name stands for a process wide
+                        policy in that mode, with default parameters.  True and False stand for
+                        'always' and 'never'.  None stands for the default policy.
+    """
+    if isinstance(validation, Validation):
+        return validation
+    if validation is None:
+        return default()
+    if validation is True or validation is False:
+        validation = VALIDATE_ALWAYS if validation else VALIDATE_NEVER
+
+    named = _named.get(validation)
+    if named is None:
+        with _lock:
+            named = _named.setdefault(validation, Validation(validation))
+    return named
+
+
+def should_validate(validation, schema):
+    """
+        Shorthand for as_validation(validation).should_validate(schema).
+    """
+    return as_validation(validation).should_validate(schema)
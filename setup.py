@@ -2,7 +2,7 @@ from setuptools import setup, find_packages
 
 from pycernan import __version__
 
-install_requires = ['fastavro', 'future', 'prometheus_client']
+install_requires = ['fastavro', 'future', 'prometheus_client', 'futures; python_version < "3"']
 
 setup(
     name="pycernan",
@@ -13,7 +13,7 @@ setup(
     license="MIT",
     keywords="client cernan",
     url="https://github.com/postmates/pycernan",
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     tests_require=[
         'pytest',
         'pytest-cov',
@@ -0,0 +1,6 @@
+import sys
+
+# asyncio based modules use Python 3 only syntax.
+collect_ignore = []
+if sys.version_info < (3, 7):
+    collect_ignore.extend(['test_aio.py', 'test_forking.py', 'test_pipeline.py', 'test_testing.py'])
@@ -1,3 +1,14 @@
 import glob
 
 test_data = glob.glob("./tests/data/*.avro")
+
+USER_SCHEMA = {
+    "namespace": "example.avro",
+    "type": "record",
+    "name": "User",
+    "fields": [
+        {"name": "name", "type": "string"},
+        {"name": "favorite_number",  "type": ["int", "null"]},
+        {"name": "favorite_color", "type": ["string", "null"]}
+    ]
+}
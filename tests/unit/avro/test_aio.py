@@ -0,0 +1,157 @@
+import asyncio
+import struct
+
+import mock
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+
+import settings
+from settings import USER_SCHEMA
+
+from pycernan.avro.aio import v1, v2
+from pycernan.avro.aio.tcp_conn_pool import TCPConnectionPool, _DefunctConnection
+from pycernan.avro.exceptions import ConnectionResetException, EmptyBatchException, EmptyPoolException, InvalidAckException
+from pycernan.avro.serde import deserialize
+from pycernan.avro.testing import FakeCernanServer
+
+
+USER = {'name': 'Foo Bar Matic', 'favorite_number': 24, 'favorite_color': 'Nonyabusiness'}
+
+
+class ForcedException(Exception):
+    pass
+
+
+@pytest.fixture
+def server():
+    with FakeCernanServer(record_frames=True) as server:
+        yield server
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_pool_value_errors():
+    with pytest.raises(ValueError):
+        TCPConnectionPool('foobar', 80, 0, 1, 1)
+
+
+def test_pool_queue_is_created_in_the_running_loop(server):
+    # Built outside of any loop, as clients constructed at import time are.
+    pool = TCPConnectionPool(server.host, server.port, 1, 1, 1)
+    assert pool._pool is None
+    pool.closeall()
+    assert pool._pool is None
+
+    async def scenario():
+        async with pool.connection():
+            pass
+        pool.closeall()
+
+    run(scenario())
+    assert pool.pool.qsize() == 0
+
+
+def test_pool_reuses_and_regenerates_connections(server):
+    async def scenario():
+        pool = TCPConnectionPool(server.host, server.port, 1, 1, 1)
+        async with pool.connection() as first:
+            with pytest.raises(EmptyPoolException):
+                async with pool.connection(_block=False):
+                    assert False  # Should not be reached
+
+        async with pool.connection() as second:
+            assert second is first
+
+        with pytest.raises(ForcedException):
+            async with pool.connection():
+                raise ForcedException()
+        assert pool.pool.qsize() == 1
+        assert pool.pool.get_nowait() is _DefunctConnection
+        pool._put(_DefunctConnection)
+
+        async with pool.connection() as third:
+            assert third is not first
+        pool.closeall()
+        assert pool.pool.qsize() == 0
+
+    run(scenario())
+
+
+def test_pool_create_connection_failures_keep_capacity():
+    async def scenario():
+        pool = TCPConnectionPool('foobar', 80, 1, 1, 1)
+        with mock.patch.object(pool, '_create_connection', side_effect=ForcedException()):
+            for _ in range(3):
+                with pytest.raises(ForcedException):
+                    async with pool.connection():
+                        assert False  # Should not be reached
+                assert pool.pool.qsize() == 1
+
+    run(scenario())
+
+
+@pytest.mark.parametrize('client_cls', [v1.Client, v2.Client])
+@pytest.mark.parametrize('offload', [True, False])
+def test_publish(server, client_cls, offload):
+    async def scenario():
+        with ThreadPoolExecutor(1) as executor:
+            client = client_cls(host=server.host, port=server.port, offload_serialization=offload, executor=executor)
+            await client.publish(USER_SCHEMA, [USER], payload_id=1234, shard_by=7)
+            with pytest.raises(EmptyBatchException):
+                await client.publish(USER_SCHEMA, [])
+            client.close()
+
+    run(scenario())
+    (frame,) = server.frames
+    assert frame.version == client_cls.VERSION
+    assert frame.sync
+    assert frame.payload_id == 1234
+    assert list(deserialize(frame.avro_blob)[1]) == [USER]
+
+
+@pytest.mark.parametrize("avro_file", settings.test_data)
+def test_publish_file(server, avro_file):
+    async def scenario():
+        client = v2.Client(host=server.host, port=server.port, maxsize=1)
+        await client.publish_file(avro_file, sync=False, metadata={'key': 'value'})
+        await client.publish_file(avro_file)
+        client.close()
+
+    run(scenario())
+    with open(avro_file, 'rb') as file:
+        contents = file.read()
+    assert [frame.avro_blob for frame in server.frames] == [contents, contents]
+    assert server.frames[0].metadata == {'key': 'value'}
+
+
+def test_concurrent_publishes_share_the_pool(server):
+    async def scenario():
+        client = v1.Client(host=server.host, port=server.port, maxsize=4)
+        await asyncio.gather(*[client.publish_blob(b'blob') for _ in range(200)])
+        client.close()
+
+    run(scenario())
+    assert server.frame_count == 200
+    assert server.connection_count <= 4
+
+
+def test_wrong_ack_raises_InvalidAckException_and_discards_connection():
+    async def scenario():
+        client = v1.Client(host='foobar', port=80, maxsize=1)
+        conn = mock.MagicMock()
+        conn.writer.drain = mock.AsyncMock()
+        conn.reader.readexactly = mock.AsyncMock(return_value=struct.pack('>Q', 1))
+        client.pool._create_connection = mock.AsyncMock(return_value=conn)
+
+        with pytest.raises(InvalidAckException):
+            await client.publish_blob(b'blob', payload_id=2)
+        assert conn.close.call_count == 1
+
+        conn.reader.readexactly.side_effect = asyncio.IncompleteReadError(b'', 8)
+        with pytest.raises(ConnectionResetException):
+            await client.publish_blob(b'blob', payload_id=2)
+
+    run(scenario())
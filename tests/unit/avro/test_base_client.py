@@ -4,6 +4,9 @@ import struct
 import mock
 import pytest
 
+import settings
+
+from pycernan.avro import framing, v1, v2
 from pycernan.avro.base_client import BaseClient
 from pycernan.avro.exceptions import InvalidAckException, ConnectionResetException
 
@@ -70,3 +73,29 @@ def test_recv_exact_with_zero_length_will_raise_ConnectionResetException(dummy_c
     mock_sock.recv.side_effect = [bytearray(0)]
     with pytest.raises(ConnectionResetException):
         dummy_client._recv_exact(mock_sock, 5)
+
+
+@pytest.mark.parametrize('client_class', [v1.Client, v2.Client])
+@pytest.mark.parametrize('avro_file', settings.test_data)
+def test_publish_file_streams_the_file(client_class, avro_file):
+    client = client_class()
+    sent = []
+    sock = mock.MagicMock()
+    sock.sendall.side_effect = lambda data, *flags: sent.append(bytes(data))
+    with mock.patch.object(client.pool, 'connection') as m_connection, \
+            mock.patch.object(client, '_wait_for_ack') as m_ack, \
+            mock.patch.object(framing, 'SCATTER_THRESHOLD', 0), \
+            mock.patch.object(framing.FileRegion, 'send', autospec=True,
+                              side_effect=lambda region, sock: sent.append(bytes(region.file.read()))) as m_send:
+        m_connection.return_value.__enter__.return_value = sock
+        client.publish_file(avro_file, payload_id=42, shard_by='user-1234')
+
+    with open(avro_file, 'rb') as file:
+        contents = file.read()
+        file.seek(0)
+        expected = framing.join(client_class.frame(framing.FileRegion(file), payload_id=42, shard_by='user-1234')[2])
+    assert m_send.call_count == 1
+    assert b''.join(sent) == expected
+    assert expected.endswith(contents)
+    assert struct.unpack('>L', expected[:4])[0] == len(expected) - 4
+    assert m_ack.call_args_list == [mock.call(sock, 42)]
@@ -0,0 +1,152 @@
+import mock
+import pytest
+
+from settings import USER_SCHEMA
+
+from pycernan.avro import batch
+from pycernan.avro.batch import BatchBuilder
+from pycernan.avro.exceptions import DatumTypeException
+from pycernan.avro.serde import Codec, available_codecs, deserialize
+
+
+def users(n, color='Greenish Gold'):
+    return [{'name': 'User {}'.format(i), 'favorite_number': i, 'favorite_color': color} for i in range(n)]
+
+
+def build_all(builder, records):
+    blobs = []
+    for record in records:
+        if builder.append(record):
+            assert builder.size == len(builder.build())
+            blobs.append(builder.build())
+            builder.reset()
+            assert not builder.append(record)
+    if builder.num_records:
+        blobs.append(builder.build())
+    return blobs
+
+
+def codec_of(avro_blob):
+    return deserialize(avro_blob)[0]['avro.codec']
+
+
+@pytest.mark.parametrize('codec', list(available_codecs()) + [Codec('deflate', level=9), Codec('deflate', min_bytes=2048)])
+def test_batches_are_cut_at_max_bytes(codec):
+    records = users(2000)
+    blobs = build_all(BatchBuilder(USER_SCHEMA, codec, 4096), records)
+
+    assert len(blobs) > 1
+    assert [r for blob in blobs for r in deserialize(blob)[1]] == records
+    assert max(len(blob) for blob in blobs) <= 4096
+
+
+@pytest.mark.parametrize('codec', ['null', 'deflate'])
+def test_batches_are_filled(codec):
+    blobs = build_all(BatchBuilder(USER_SCHEMA, codec, 4096), users(5000))
+    # Sizes are exact, so full batches are only short of the limit by less than a record.
+    assert min(len(blob) for blob in blobs[:-1]) > 4096 - 4096 // batch.FILL_DIVISOR - 64
+
+
+def test_sizes():
+    builder = BatchBuilder(USER_SCHEMA, 'deflate', 1024 * 1024, ephemeral_storage=True, foo='bar')
+    assert builder.num_records == len(builder) == builder.encoded_bytes == 0
+    assert builder.size == len(builder.build())
+
+    for record in users(100):
+        assert not builder.append(record)
+    assert len(builder) == 100
+    assert builder.compressed_bytes < builder.encoded_bytes
+    assert builder.size == len(builder.build())
+
+    meta, records = deserialize(builder.build())
+    assert meta['avro.codec'] == 'deflate'
+    assert meta['foo'] == 'bar'
+    assert meta['postmates.storage.ephemeral'] == '1'
+    assert list(records) == users(100)
+
+    # Building leaves the builder as is.
+    assert not builder.append(users(101)[-1])
+    assert list(deserialize(builder.build())[1]) == users(101)
+
+    builder.reset()
+    assert builder.num_records == builder.encoded_bytes == 0
+    assert list(deserialize(builder.build())[1]) == []
+
+
+def test_null_sizes_are_exact():
+    builder = BatchBuilder(USER_SCHEMA, 'null', 1024 * 1024)
+    for record in users(100):
+        builder.append(record)
+    assert builder.compressed_bytes == builder.encoded_bytes
+    assert builder.size == len(builder.build())
+
+
+def test_adaptive_codec():
+    builder = BatchBuilder(USER_SCHEMA, Codec('deflate', min_bytes=1024), 1024 * 1024)
+    builder.append(users(1)[0])
+    assert codec_of(builder.build()) == 'null'
+    assert builder.compressed_bytes == builder.encoded_bytes
+
+    for record in users(100)[1:]:
+        builder.append(record)
+    assert codec_of(builder.build()) == 'deflate'
+    assert builder.size == len(builder.build())
+    assert list(deserialize(builder.build())[1]) == users(100)
+
+
+def test_max_records():
+    builder = BatchBuilder(USER_SCHEMA, 'null', 1024 * 1024, max_records=2)
+    assert [builder.append(record) for record in users(3)] == [False, False, True]
+    assert len(builder) == 2
+
+
+@pytest.mark.parametrize('max_encoded_bytes', [None, 10000])
+def test_encoded_bytes_are_bounded(max_encoded_bytes):
+    # Identical records compress so well that only the encoded size bounds the batch.
+    records = users(5000, color='x' * 100)
+    builder = BatchBuilder(USER_SCHEMA, 'deflate', 4096, max_encoded_bytes=max_encoded_bytes)
+    limit = builder.max_encoded_bytes
+    assert limit == max_encoded_bytes or limit == batch.ENCODED_BYTES_RATIO * 4096
+
+    encoded, blobs = [], []
+    for record in records:
+        if builder.append(record):
+            encoded.append(builder.encoded_bytes)
+            blobs.append(builder.build())
+            builder.reset()
+            builder.append(record)
+    blobs.append(builder.build())
+
+    assert len(blobs) > 1
+    assert max(encoded) <= limit
+    assert min(encoded) > limit - 200
+    assert max(len(blob) for blob in blobs) <= 4096
+    assert [r for blob in blobs for r in deserialize(blob)[1]] == records
+
+    with pytest.raises(ValueError):
+        BatchBuilder(USER_SCHEMA, 'deflate', 4096, max_encoded_bytes=0)
+
+
+def test_oversized_and_invalid_records():
+    builder = BatchBuilder(USER_SCHEMA, 'deflate', 64)
+    with pytest.raises(ValueError):
+        builder.append(users(1)[0])
+    assert len(builder) == 0
+
+    builder = BatchBuilder(USER_SCHEMA, 'deflate', 1024)
+    for validation in ['always', 'never']:
+        builder.validation = validation
+        builder.reset()
+        with pytest.raises(DatumTypeException):
+            builder.append({'name': 1})
+    assert len(builder) == builder.encoded_bytes == 0
+
+
+def test_validation_is_decided_per_batch():
+    builder = BatchBuilder(USER_SCHEMA, 'null', 1024 * 1024, validation='always')
+    with mock.patch.object(batch, 'should_validate', return_value=False) as m_should_validate:
+        for record in users(3):
+            builder.append(record)
+        builder.reset()
+        builder.append(users(1)[0])
+    assert len(m_should_validate.call_args_list) == 2
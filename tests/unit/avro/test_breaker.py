@@ -0,0 +1,139 @@
+import socket
+
+import mock
+import pytest
+
+from concurrent.futures import Future
+from prometheus_client import REGISTRY
+
+from pycernan.avro.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from pycernan.avro.exceptions import CircuitOpenException, ConnectionResetException
+from pycernan.avro.retry import RetryPolicy
+from pycernan.avro.spool import Spool
+from pycernan.avro.v1 import Client
+
+
+def sample(name, labels=None):
+    return REGISTRY.get_sample_value('pycernan_{}_total'.format(name), labels) or 0
+
+
+def fail(breaker, times=1, exc=socket.error):
+    for _ in range(times):
+        with pytest.raises(exc):
+            breaker.call(mock.MagicMock(side_effect=exc()))
+
+
+@pytest.fixture
+def m_time():
+    with mock.patch('pycernan.avro.breaker.time.time', return_value=100) as m_time:
+        yield m_time
+
+
+def test_value_errors():
+    with pytest.raises(ValueError):
+        CircuitBreaker(failure_threshold=0)
+
+    with pytest.raises(ValueError):
+        CircuitBreaker(failure_rate=1.5)
+
+
+def test_opens_after_consecutive_failures(m_time):
+    breaker = CircuitBreaker(failure_threshold=3)
+    opened = sample('circuit_transition_count', {'state': 'open'})
+
+    fail(breaker, 2)
+    breaker.call(mock.MagicMock())
+    fail(breaker, 2)
+    assert breaker.state == CLOSED
+
+    fail(breaker)
+    assert breaker.state == OPEN
+    assert sample('circuit_transition_count', {'state': 'open'}) - opened == 1
+    assert REGISTRY.get_sample_value('pycernan_circuit_state') == 1
+
+
+def test_opens_at_failure_rate(m_time):
+    breaker = CircuitBreaker(failure_threshold=10, failure_rate=0.5, window=4, min_calls=4)
+    ok = mock.MagicMock()
+
+    breaker.call(ok)
+    fail(breaker)
+    breaker.call(ok)
+    assert breaker.state == CLOSED
+
+    fail(breaker)
+    assert breaker.state == OPEN
+
+
+def test_open_breaker_fails_fast(m_time):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    fail(breaker)
+    rejected = sample('circuit_rejected_count')
+
+    fn = mock.MagicMock()
+    with pytest.raises(CircuitOpenException):
+        breaker.call(fn)
+    assert fn.call_count == 0
+    assert sample('circuit_rejected_count') - rejected == 1
+
+
+def test_half_open_probe_closes_or_reopens(m_time):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    fail(breaker)
+
+    m_time.return_value = 110
+    fail(breaker)
+    assert breaker.state == OPEN
+
+    m_time.return_value = 120
+    breaker.call(mock.MagicMock())
+    assert breaker.state == CLOSED
+
+
+def test_half_open_limits_concurrent_probes(m_time):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    fail(breaker)
+
+    m_time.return_value = 110
+    probe = Future()
+    breaker.call(mock.MagicMock(return_value=probe))
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenException):
+        breaker.allow()
+
+    probe.set_result(None)
+    assert breaker.state == CLOSED
+
+
+def test_other_exceptions_are_not_failures(m_time):
+    breaker = CircuitBreaker(failure_threshold=1)
+    fail(breaker, 3, exc=ValueError)
+    assert breaker.state == CLOSED
+
+
+def test_client_stops_retrying_once_open(m_time):
+    breaker = CircuitBreaker(failure_threshold=2)
+    client = Client(host='foobar', port=80, retry=RetryPolicy(max_attempts=5), breaker=breaker)
+    with mock.patch('pycernan.avro.retry.time.sleep'), \
+            mock.patch.object(client.pool, '_create_connection', side_effect=ConnectionResetException()) as m_create:
+        with pytest.raises(CircuitOpenException):
+            client.publish_blob(b'blob')
+
+    assert m_create.call_count == 2
+    client.close()
+
+
+def test_client_spools_rejected_payloads(m_time, tmpdir):
+    spool = Spool(str(tmpdir))
+    breaker = CircuitBreaker(failure_threshold=1)
+    fail(breaker)
+
+    client = Client(host='foobar', port=80, spool=spool, breaker=breaker)
+    client.replayer.stop()
+    with mock.patch.object(client.pool, '_create_connection') as m_create:
+        client.publish_blob(b'blob')
+
+    assert m_create.call_count == 0
+    assert not spool.empty()
+    client.close()
+    spool.close()
@@ -0,0 +1,179 @@
+import threading
+
+import mock
+import pytest
+
+from prometheus_client import REGISTRY
+
+from settings import USER_SCHEMA
+
+from pycernan.avro.buffered import BufferedClient
+from pycernan.avro.exceptions import BufferFullException, ClientClosedException, DatumTypeException, EmptyBatchException
+from pycernan.avro.serde import deserialize
+
+
+def user(i):
+    return {'name': 'User {}'.format(i), 'favorite_number': i, 'favorite_color': None}
+
+
+def flushes(reason):
+    return REGISTRY.get_sample_value('pycernan_buffer_flush_count_total', {'reason': reason}) or 0
+
+
+def published_records(m_client):
+    records = []
+    for call in m_client.publish_blob.call_args_list:
+        _, values = deserialize(call[0][0])
+        records.extend(values)
+    return records
+
+
+@pytest.fixture
+def m_client():
+    return mock.MagicMock()
+
+
+def test_value_errors(m_client):
+    with pytest.raises(ValueError):
+        BufferedClient(m_client, full_policy='explode')
+
+    with pytest.raises(ValueError):
+        BufferedClient(m_client, max_records=0)
+
+
+def test_close_flushes_buffered_records(m_client):
+    client = BufferedClient(m_client, linger_ms=60 * 1000)
+    closes = flushes('close')
+    client.publish(USER_SCHEMA, [user(i) for i in range(10)], shard_by='abc')
+    assert client.close(timeout=5)
+
+    assert published_records(m_client) == [user(i) for i in range(10)]
+    assert m_client.publish_blob.call_args_list[0][1] == {'shard_by': 'abc'}
+    assert flushes('close') - closes == 1
+    assert m_client.close.call_count == 1
+
+    with pytest.raises(ClientClosedException):
+        client.publish(USER_SCHEMA, [user(0)])
+
+
+def test_flush_publishes_each_key_separately(m_client):
+    client = BufferedClient(m_client, linger_ms=60 * 1000)
+    client.publish(USER_SCHEMA, [user(0)], shard_by='a')
+    client.publish(USER_SCHEMA, [user(1)], shard_by='b')
+    client.publish(USER_SCHEMA, [user(2)], shard_by='a', ephemeral_storage=True)
+    assert client.flush(timeout=5)
+
+    assert m_client.publish_blob.call_count == 3
+    metas = [deserialize(call[0][0])[0] for call in m_client.publish_blob.call_args_list]
+    assert sorted(meta.get('postmates.storage.ephemeral', '') for meta in metas) == ['', '', '1']
+    client.close()
+
+
+def test_linger_expiry_triggers_a_flush(m_client):
+    published = threading.Event()
+    m_client.publish_blob.side_effect = lambda *args, **kwargs: published.set()
+    client = BufferedClient(m_client, linger_ms=10)
+    lingers = flushes('linger')
+
+    client.publish(USER_SCHEMA, [user(0), (user(i) for i in range(1, 3))])
+    assert published.wait(5)
+    assert published_records(m_client) == [user(i) for i in range(3)]
+    assert flushes('linger') - lingers == 1
+    client.close()
+
+
+@pytest.mark.parametrize('limits, reason', [
+    ({'max_records': 5}, 'max_records'),
+    ({'max_bytes': 1}, 'max_bytes'),
+])
+def test_size_limits_trigger_flushes(m_client, limits, reason):
+    client = BufferedClient(m_client, linger_ms=60 * 1000, **limits)
+    before = flushes(reason)
+    client.publish(USER_SCHEMA, [user(i) for i in range(10)])
+    assert client.flush(timeout=5)
+
+    assert published_records(m_client) == [user(i) for i in range(10)]
+    assert flushes(reason) - before >= 2
+    client.close()
+
+
+def test_drop_policy_discards_records_when_full(m_client):
+    unblock = threading.Event()
+    m_client.publish_blob.side_effect = lambda *args, **kwargs: unblock.wait(5)
+    client = BufferedClient(m_client, linger_ms=60 * 1000, max_buffered_records=2, full_policy='drop')
+    drops = REGISTRY.get_sample_value('pycernan_buffer_drop_count_total')
+
+    client.publish(USER_SCHEMA, [user(i) for i in range(5)])
+    assert REGISTRY.get_sample_value('pycernan_buffer_drop_count_total') - drops == 3
+
+    unblock.set()
+    client.close(timeout=5)
+    assert published_records(m_client) == [user(0), user(1)]
+
+
+def test_block_policy_times_out(m_client):
+    client = BufferedClient(m_client, linger_ms=60 * 1000, max_buffered_records=1, full_timeout=0.01)
+    client.publish(USER_SCHEMA, [user(0)])
+    with pytest.raises(BufferFullException):
+        client.publish(USER_SCHEMA, [user(1)])
+    client.close(timeout=5)
+    assert published_records(m_client) == [user(0)]
+
+
+def test_invalid_records_raise_on_the_caller(m_client):
+    client = BufferedClient(m_client, linger_ms=60 * 1000)
+    with pytest.raises(DatumTypeException):
+        client.publish(USER_SCHEMA, [user(0), {}])
+
+    with pytest.raises(EmptyBatchException):
+        client.publish(USER_SCHEMA, [])
+
+    with pytest.raises(ValueError) as e:
+        client.publish(USER_SCHEMA, [user(0)], shard_by=['a', 'b'])
+    assert "'shard_by'" in str(e.value)
+
+    client.close(timeout=5)
+    # Batches are buffered all or nothing.
+    assert published_records(m_client) == []
+
+
+def test_publish_failures_do_not_stop_workers(m_client):
+    m_client.publish_blob.side_effect = [Exception("Oops"), None]
+    client = BufferedClient(m_client, linger_ms=60 * 1000)
+    failures = REGISTRY.get_sample_value('pycernan_buffer_flush_failure_count_total')
+
+    client.publish(USER_SCHEMA, [user(0)])
+    assert client.flush(timeout=5)
+    client.publish(USER_SCHEMA, [user(1)])
+    assert client.flush(timeout=5)
+
+    assert REGISTRY.get_sample_value('pycernan_buffer_flush_failure_count_total') - failures == 1
+    assert m_client.publish_blob.call_count == 2
+    client.close()
+
+
+def test_codecs(m_client):
+    client = BufferedClient(m_client, linger_ms=60 * 1000, codec='null')
+    client.publish(USER_SCHEMA, [user(0)])
+    client.publish(USER_SCHEMA, [user(1)], codec='deflate')
+    client.flush()
+
+    codecs = sorted(deserialize(call[0][0])[0]['avro.codec'] for call in m_client.publish_blob.call_args_list)
+    assert codecs == ['deflate', 'null']
+    assert sorted(published_records(m_client), key=lambda r: r['favorite_number']) == [user(0), user(1)]
+    client.close()
+
+
+def test_encoders_are_reused(m_client):
+    client = BufferedClient(m_client, linger_ms=60 * 1000)
+    for i in range(3):
+        client.publish(USER_SCHEMA, [user(i)])
+        client.flush()
+
+    blobs = [call[0][0] for call in m_client.publish_blob.call_args_list]
+    assert len(blobs) == 3
+    assert len(client._encoders) == 1
+    header = list(client._encoders.values())[0].header()
+    assert all(blob.startswith(header) for blob in blobs)
+    assert published_records(m_client) == [user(0), user(1), user(2)]
+    client.close()
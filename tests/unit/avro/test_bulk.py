@@ -0,0 +1,131 @@
+import os
+import threading
+
+import mock
+import pytest
+
+from pycernan.avro import bulk
+from pycernan.avro.bulk import Manifest, find_files, publish_files
+from pycernan.avro.dummy import DummyClient
+
+
+class RecordingClient(DummyClient):
+    """
+        Records each file published, failing on those named in `fail`.
+    """
+
+    def __init__(self, fail=()):
+        super(RecordingClient, self).__init__()
+        self.fail = set(fail)
+        self.published = []
+        self._lock = threading.Lock()
+
+    def publish_file(self, file_path, **kwargs):
+        if os.path.basename(file_path) in self.fail:
+            raise IOError("failed to publish {}".format(file_path))
+        with self._lock:
+            self.published.append((os.path.basename(file_path), kwargs.get('shard_by')))
+
+
+@pytest.fixture
+def avro_dir(tmpdir):
+    for name in ['a/1.avro', 'a/2.avro', 'a/3.avro', 'b/1.avro', 'b/2.avro', 'b/notes.txt']:
+        tmpdir.join(name).write_binary(b'avro' * 10, ensure=True)
+    return tmpdir
+
+
+def test_find_files(avro_dir):
+    paths = find_files([str(avro_dir), str(avro_dir.join('b/notes.txt'))])
+    assert [os.path.relpath(path, str(avro_dir)) for path in paths] == \
+        ['a/1.avro', 'a/2.avro', 'a/3.avro', 'b/1.avro', 'b/2.avro', 'b/notes.txt']
+
+
+def test_publish_files_preserves_order_within_shards(avro_dir):
+    client = RecordingClient()
+    paths = find_files([str(avro_dir)])
+    seen = []
+
+    result = publish_files(client, paths, concurrency=2, shard_by=bulk._directory, progress=lambda p: seen.append(p.done),
+                           sync=True)
+
+    assert (result.published, result.skipped, result.failed) == (5, 0, 0)
+    assert result.published_bytes == result.total_bytes == 200
+    assert sorted(seen) == [1, 2, 3, 4, 5]
+    for directory in ['a', 'b']:
+        shard = str(avro_dir.join(directory))
+        published = [name for name, shard_by in client.published if shard_by == shard]
+        assert published == sorted(published)
+    assert len(client.published) == 5
+
+
+def test_publish_files_without_shard_by(avro_dir):
+    client = RecordingClient()
+    client.publish_file = mock.MagicMock()
+    paths = find_files([str(avro_dir)])
+
+    client.publish_files(paths, concurrency=3, sync=False)
+    assert sorted(call[0][0] for call in client.publish_file.call_args_list) == paths
+    assert all(call[1] == {'sync': False} for call in client.publish_file.call_args_list)
+
+
+def test_failures_stop_their_shard_only(avro_dir):
+    client = RecordingClient(fail=['2.avro'])
+    paths = find_files([str(avro_dir.join('a'))]) + [str(avro_dir.join('missing.avro'))]
+
+    result = publish_files(client, paths, shard_by=bulk._directory)
+
+    assert client.published == [('1.avro', str(avro_dir.join('a')))]
+    assert sorted(result.failures) == sorted(paths[1:])
+    assert result.failures[paths[1]] is result.failures[paths[2]]
+    assert isinstance(result.failures[paths[3]], OSError)
+
+
+def test_manifest_resumes_a_run(avro_dir):
+    manifest_path = str(avro_dir.join('run.manifest'))
+    paths = find_files([str(avro_dir)])
+
+    client = RecordingClient(fail=['3.avro'])
+    result = publish_files(client, paths, manifest=manifest_path)
+    assert (result.published, result.failed) == (4, 1)
+
+    # A torn final line, as left by a crash, is ignored.
+    with open(manifest_path, 'a') as file:
+        file.write('{"path": ')
+    avro_dir.join('b/2.avro').write_binary(b'rewritten')
+
+    client = RecordingClient()
+    manifest = Manifest(manifest_path)
+    result = publish_files(client, paths, manifest=manifest)
+    assert sorted(name for name, _ in client.published) == ['2.avro', '3.avro']
+    assert (result.published, result.skipped, result.failed) == (2, 3, 0)
+    assert len(manifest) == 5
+    assert all(path in manifest for path in paths)
+    manifest.close()
+    assert len(Manifest(manifest_path)) == 5
+
+
+def test_manifest_skips_lines_that_are_not_entries(tmpdir):
+    manifest_path = str(tmpdir.join('run.manifest'))
+    with open(manifest_path, 'w') as file:
+        file.write('{"size": 1, "mtime": 2}\n[1, 2]\n42\n{"path": "/a.avro", "size": 1}\n')
+        file.write('{"path": "/b.avro", "size": 1, "mtime": 2}\n')
+
+    manifest = Manifest(manifest_path)
+    assert len(manifest) == 1
+    manifest.close()
+
+
+def test_publish_files_waits_for_pipelined_acks(avro_dir):
+    client = RecordingClient()
+    client.pipelined = True
+    future = mock.MagicMock()
+    future.result.side_effect = IOError()
+    client.publish_file = mock.MagicMock(return_value=future)
+
+    result = publish_files(client, [str(avro_dir.join('a/1.avro'))])
+    assert result.failed == 1
+
+
+def test_concurrency():
+    with pytest.raises(ValueError):
+        publish_files(RecordingClient(), [], concurrency=0)
@@ -1,25 +1,27 @@
+import os
+import socket
+import time
+
 import mock
 import pytest
 
 import settings
+from settings import USER_SCHEMA
 
+from prometheus_client import REGISTRY
 from queue import Queue, Empty
 
 from pycernan.avro import BaseDummyClient, DummyClient
+from pycernan.avro.batch import BatchBuilder
 from pycernan.avro.tcp_conn_pool import TCPConnectionPool, _DefunctConnection, EmptyPoolException
 from pycernan.avro.exceptions import SchemaParseException, DatumTypeException, EmptyBatchException
+from pycernan.avro.serde import Codec, deserialize, parse_schema
 
 
-USER_SCHEMA = {
-    "namespace": "example.avro",
-    "type": "record",
-    "name": "User",
-    "fields": [
-        {"name": "name", "type": "string"},
-        {"name": "favorite_number",  "type": ["int", "null"]},
-        {"name": "favorite_color", "type": ["string", "null"]}
-    ]
-}
+DEFAULT_SOCKOPTS = [
+    ('setsockopt', mock.call(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)),
+    ('setsockopt', mock.call(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)),
+]
 
 
 class FakeSocket(object):
@@ -27,6 +29,18 @@ class FakeSocket(object):
         self.set_failures = set_failures
         self.close_failures = close_failures
         self.call_args_list = []
+        # Liveness checks poll the read end of an idle pipe, which never becomes readable.
+        self._read_fd, self._write_fd = os.pipe()
+
+    def __del__(self):
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+    def fileno(self):
+        return self._read_fd
+
+    def setsockopt(self, *args):
+        self.call_args_list.append(('setsockopt', mock.call(*args)))
 
     def settimeout(self, *args, **kwargs):
         self.call_args_list.append(('settimeout', mock.call(*args, **kwargs)))
@@ -78,7 +92,7 @@ class TestTCPConnectionPool():
 
         with pool.connection() as sock:
             assert sock == mock_sock
-            assert mock_sock.call_args_list == [('settimeout', mock.call(recv_timeout))]
+            assert mock_sock.call_args_list == [('settimeout', mock.call(recv_timeout))] + DEFAULT_SOCKOPTS
             assert connect_mock.call_args_list == [mock.call((host, port), timeout=connect_timeout)]
 
         # After using a connection, it should be checked-in/cached for others to use
@@ -193,6 +207,59 @@ class TestTCPConnectionPool():
         pool.closeall()
         assert expected_sock.call_args_list[-1] == ('close', mock.call())
 
+    @mock.patch('pycernan.avro.tcp_conn_pool.socket.create_connection', autospec=True)
+    def test_sndbuf_and_disabled_options(self, create_mock):
+        expected_sock = FakeSocket()
+        create_mock.return_value = expected_sock
+        pool = TCPConnectionPool('foobar', 80, 1, 1, 1, keepalive=False, nodelay=False, sndbuf=4096)
+        with pool.connection():
+            pass
+        assert expected_sock.call_args_list[1:] == [('setsockopt', mock.call(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096))]
+
+    @mock.patch('pycernan.avro.tcp_conn_pool.socket.create_connection', autospec=True)
+    def test_prewarm_tolerates_failures(self, create_mock):
+        socks = [FakeSocket(), FakeSocket()]
+        create_mock.side_effect = [socks[0], ForcedException(), socks[1]]
+        creates = REGISTRY.get_sample_value('pycernan_conn_create_count_total')
+
+        pool = TCPConnectionPool('foobar', 80, 3, 1, 1, prewarm=True)
+        assert REGISTRY.get_sample_value('pycernan_conn_create_count_total') - creates == 3
+        assert sorted([pool.pool.get_nowait() for _ in range(3)], key=id) == sorted(socks + [_DefunctConnection], key=id)
+
+    @mock.patch('pycernan.avro.tcp_conn_pool.socket.create_connection', autospec=True)
+    def test_idle_connections_are_replaced(self, create_mock):
+        stale, fresh = FakeSocket(), FakeSocket()
+        create_mock.side_effect = [stale, fresh]
+        pool = TCPConnectionPool('foobar', 80, 1, 1, 1, max_idle=60)
+        evictions = REGISTRY.get_sample_value('pycernan_conn_idle_eviction_count_total')
+
+        with pool.connection():
+            pass
+        with pool.connection() as sock:
+            assert sock is stale
+
+        with mock.patch('pycernan.avro.tcp_conn_pool.time.time', return_value=time.time() + 61):
+            with pool.connection() as sock:
+                assert sock is fresh
+        assert stale.call_args_list[-1] == ('close', mock.call())
+        assert REGISTRY.get_sample_value('pycernan_conn_idle_eviction_count_total') - evictions == 1
+
+    def test_connections_closed_by_the_peer_are_replaced(self):
+        client_sock, server_sock = socket.socketpair()
+        fresh = FakeSocket()
+        failures = REGISTRY.get_sample_value('pycernan_conn_liveness_failure_count_total')
+        pool = TCPConnectionPool('foobar', 80, 1, 1, 1)
+        with mock.patch.object(pool, '_create_connection', side_effect=[client_sock, fresh]):
+            with pool.connection():
+                pass
+            with pool.connection() as sock:
+                assert sock is client_sock
+
+            server_sock.close()
+            with pool.connection() as sock:
+                assert sock is fresh
+        assert REGISTRY.get_sample_value('pycernan_conn_liveness_failure_count_total') - failures == 1
+
 
 @pytest.mark.parametrize("avro_file", settings.test_data)
 def test_publish_file(avro_file):
@@ -260,7 +327,7 @@ def test_creating_a_client_connects_a_socket(m_connect):
         publish_timeout=publish_timeout)
 
     with client.pool.connection():
-        assert expected_sock.call_args_list == [('settimeout', mock.call(publish_timeout))]
+        assert expected_sock.call_args_list == [('settimeout', mock.call(publish_timeout))] + DEFAULT_SOCKOPTS
         assert m_connect.call_args_list == [mock.call(('some fake host', 31337), timeout=connect_timeout)]
 
 
@@ -302,3 +369,105 @@ def test_closing_the_client_with_no_socket_does_not_crash(m_connect):
         publish_timeout=999)
 
     client.close()
+
+
+def users(n):
+    for i in range(n):
+        yield {'name': 'User {}'.format(i), 'favorite_number': i, 'favorite_color': 'Greenish Gold'}
+
+
+def test_publish_iter_splits_stream_into_bounded_payloads():
+    c = DummyClient()
+    consumed = []
+
+    def stream():
+        for user in users(1000):
+            consumed.append(user)
+            yield user
+
+    blobs = []
+
+    def publish_blob(blob, **kwargs):
+        records = list(deserialize(blob)[1])
+        published = sum(len(r) for r, _ in blobs) + len(records)
+        # At most one record beyond this payload has been pulled from the stream.
+        assert len(consumed) <= published + 1
+        blobs.append((records, kwargs))
+
+    with mock.patch.object(c, 'publish_blob', side_effect=publish_blob, autospec=True) as m_publish_blob:
+        assert c.publish_iter(USER_SCHEMA, stream(), max_frame_bytes=1024, sync=False) == len(blobs)
+
+    assert len(blobs) > 1
+    assert [record for records, _ in blobs for record in records] == list(users(1000))
+    for call in m_publish_blob.call_args_list:
+        assert len(call[0][0]) <= 1024
+
+    shard_bys = set(kwargs['shard_by'] for _, kwargs in blobs)
+    assert len(shard_bys) == 1
+    assert all(kwargs['sync'] is False for _, kwargs in blobs)
+
+
+def test_publish_iter_max_records_and_shard_by():
+    c = DummyClient()
+    with mock.patch.object(c, 'publish_blob', autospec=True) as m_publish_blob:
+        assert c.publish_iter(USER_SCHEMA, [users(5), {'name': 'Last', 'favorite_number': None, 'favorite_color': None}],
+                              max_records=2, shard_by='user-stream') == 3
+
+    counts = [len(list(deserialize(call[0][0])[1])) for call in m_publish_blob.call_args_list]
+    assert counts == [2, 2, 2]
+    assert [call[1] for call in m_publish_blob.call_args_list] == [{'shard_by': 'user-stream'}] * 3
+
+
+def test_publish_codecs():
+    c = DummyClient(codec='null', schema_codecs={'example.avro.User': Codec('deflate', level=1)})
+    assert c.codec_for({'name': 'Other'}) == Codec('null')
+    assert c.codec_for(USER_SCHEMA) == Codec('deflate', level=1)
+    assert c.codec_for(parse_schema(USER_SCHEMA)) == Codec('deflate', level=1)
+    assert c.codec_for(USER_SCHEMA, 'null') == Codec('null')
+
+    with mock.patch.object(c, 'publish_blob', autospec=True) as m_publish_blob:
+        c.publish(USER_SCHEMA, list(users(10)), codec='null')
+        c.publish(USER_SCHEMA, list(users(10)))
+        c.publish_iter(USER_SCHEMA, users(10), max_records=5)
+
+    codecs = [deserialize(call[0][0])[0]['avro.codec'] for call in m_publish_blob.call_args_list]
+    assert codecs == ['null', 'deflate', 'deflate', 'deflate']
+
+    assert DummyClient().codec_for(USER_SCHEMA) is None
+
+
+def test_publish_iter_bounds_payloads_per_codec():
+    c = DummyClient(codec='null')
+    with mock.patch.object(c, 'publish_blob', autospec=True) as m_publish_blob:
+        c.publish_iter(USER_SCHEMA, users(1000), max_frame_bytes=4096)
+
+    sizes = [len(call[0][0]) for call in m_publish_blob.call_args_list]
+    assert max(sizes) <= 4096
+    # Without a compression bound to reserve, uncompressed payloads fill most of the frame.
+    assert min(sizes[:-1]) > 4000
+
+
+def test_publish_iter_bounds_encoded_bytes():
+    c = DummyClient()
+    record = {'name': 'User', 'favorite_number': 1, 'favorite_color': 'x' * 100}
+    with mock.patch.object(c, 'publish_blob', autospec=True) as m_publish_blob:
+        c.publish_iter(USER_SCHEMA, (record for _ in range(5000)), max_frame_bytes=4096, max_encoded_bytes=16 * 1024)
+
+    # The records compress far below max_frame_bytes, so only max_encoded_bytes cuts the payloads.
+    builder = BatchBuilder(USER_SCHEMA, 'null')
+    builder.append(record)
+    counts = [len(list(deserialize(call[0][0])[1])) for call in m_publish_blob.call_args_list]
+    assert sum(counts) == 5000
+    assert max(counts) == 16 * 1024 // builder.encoded_bytes
+    assert all(len(call[0][0]) < 4096 for call in m_publish_blob.call_args_list)
+
+
+def test_publish_iter_empty_and_oversized_records():
+    c = DummyClient()
+    with mock.patch.object(c, 'publish_blob', autospec=True) as m_publish_blob:
+        assert c.publish_iter(USER_SCHEMA, iter([])) == 0
+        with pytest.raises(ValueError):
+            c.publish_iter(USER_SCHEMA, users(1), max_frame_bytes=64)
+        with pytest.raises(DatumTypeException):
+            c.publish_iter(USER_SCHEMA, [{}])
+    assert m_publish_blob.call_args_list == []
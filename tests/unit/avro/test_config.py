@@ -24,3 +24,15 @@ def test_port_override():
     expected_port = 4567
     os.environ['PYCERNAN_AVRO_PORT'] = str(expected_port)
     assert pycernan.avro.config.port() == expected_port
+
+
+def test_schema_cache_size_default():
+    assert pycernan.avro.config.schema_cache_size() == 128
+
+
+def test_metrics_backend_default():
+    assert pycernan.avro.config.metrics_backend() == 'prometheus'
+
+
+def test_validation_mode_default():
+    assert pycernan.avro.config.validation_mode() == 'always'
@@ -0,0 +1,124 @@
+import socket
+
+import mock
+import pytest
+
+from prometheus_client import REGISTRY
+
+from pycernan.avro.base_client import _hash_u64
+from pycernan.avro.endpoints import EndpointPool
+from pycernan.avro.exceptions import ConnectionResetException, InvalidAckException
+from pycernan.avro.v1 import Client
+
+
+ENDPOINTS = [('cernan-a', 2002), ('cernan-b', 2002), ('cernan-c', 2002)]
+
+
+@pytest.fixture
+def pool():
+    return EndpointPool(ENDPOINTS, 1, 1, 1, max_failures=2, eject_seconds=30)
+
+
+def fail(pool, endpoint, times):
+    with mock.patch.object(endpoint.pool, '_create_connection'):
+        for _ in range(times):
+            with pytest.raises(socket.error):
+                with pool.connection(_hash_u64('key')):
+                    raise socket.error()
+
+
+def test_value_errors():
+    with pytest.raises(ValueError):
+        EndpointPool([], 1, 1, 1)
+
+    with pytest.raises(ValueError):
+        EndpointPool(ENDPOINTS, 1, 1, 1, replicas=0)
+
+    with pytest.raises(ValueError):
+        Client(endpoints=ENDPOINTS, max_in_flight=10)
+
+
+def test_shards_stick_to_an_endpoint(pool):
+    owners = [pool.route(_hash_u64('key {}'.format(i))) for i in range(300)]
+    assert owners == [pool.route(_hash_u64('key {}'.format(i))) for i in range(300)]
+    assert set(owners) == set(pool.endpoints)
+
+
+def test_unsharded_payloads_go_to_the_least_loaded_endpoint(pool):
+    pool.endpoints[0].active = 2
+    pool.endpoints[1].active = 0
+    pool.endpoints[2].active = 1
+    assert pool.route() is pool.endpoints[1]
+
+
+def test_failing_endpoints_are_ejected_and_readmitted(pool):
+    owner = pool.route(_hash_u64('key'))
+    others = [endpoint for endpoint in pool.endpoints if endpoint is not owner]
+    ejections = REGISTRY.get_sample_value('pycernan_endpoint_ejection_count_total', {'endpoint': owner.address}) or 0
+
+    fail(pool, owner, 2)
+    assert REGISTRY.get_sample_value('pycernan_endpoint_ejection_count_total', {'endpoint': owner.address}) - ejections == 1
+
+    # Only shards owned by the ejected endpoint move.
+    assert pool.route(_hash_u64('key')) in others
+    for _ in range(10):
+        assert pool.route() in others
+
+    with mock.patch('pycernan.avro.endpoints.time.time', return_value=owner.ejected_until):
+        assert pool.route(_hash_u64('key')) is owner
+
+        # A single failure after re-admission ejects it again.
+        fail(pool, owner, 1)
+        assert pool.route(_hash_u64('key')) in others
+
+
+def test_successes_reset_failures(pool):
+    owner = pool.route(_hash_u64('key'))
+    fail(pool, owner, 1)
+    with mock.patch.object(owner.pool, '_create_connection'):
+        with pool.connection(_hash_u64('key')):
+            assert owner.active == 1
+    assert owner.active == 0
+    fail(pool, owner, 1)
+    assert pool.route(_hash_u64('key')) is owner
+
+
+def test_application_errors_do_not_count_as_failures(pool):
+    owner = pool.route(_hash_u64('key'))
+    with mock.patch.object(owner.pool, '_create_connection'):
+        for exc in [InvalidAckException(), ValueError(), InvalidAckException()]:
+            with pytest.raises(type(exc)):
+                with pool.connection(_hash_u64('key')):
+                    raise exc
+    assert owner.failures == 0
+
+    with mock.patch.object(owner.pool, '_create_connection'):
+        for _ in range(2):
+            with pytest.raises(ConnectionResetException):
+                with pool.connection(_hash_u64('key')):
+                    raise ConnectionResetException()
+    assert pool.route(_hash_u64('key')) is not owner
+
+
+def test_all_endpoints_ejected_falls_back_to_all(pool):
+    for endpoint in pool.endpoints:
+        endpoint.ejected_until = float('inf')
+    assert pool.route() in pool.endpoints
+    assert pool.route(_hash_u64('key')) in pool.endpoints
+
+
+def test_client_routes_by_shard_by():
+    client = Client(endpoints=ENDPOINTS, maxsize=1)
+    socks = {}
+    for endpoint in client.pool.endpoints:
+        socks[endpoint.host] = mock.MagicMock()
+        endpoint.pool._create_connection = mock.MagicMock(return_value=socks[endpoint.host])
+
+    with mock.patch.object(client, '_wait_for_ack'):
+        for _ in range(3):
+            client.publish_blob(b'blob', shard_by='key')
+
+    owner = client.pool.route(_hash_u64('key'))
+    assert socks[owner.host].sendall.call_count == 3
+    assert sum(sock.sendall.call_count for sock in socks.values()) == 3
+    client.close()
@@ -0,0 +1,83 @@
+import os
+
+import mock
+import pytest
+
+from settings import USER_SCHEMA
+
+from pycernan.avro import executor
+from pycernan.avro.dummy import DummyClient
+from pycernan.avro.exceptions import DatumTypeException
+from pycernan.avro.executor import ProcessSerializer
+from pycernan.avro.serde import deserialize, parse_schema
+
+
+def users(n):
+    return [{'name': 'user-{}'.format(i), 'favorite_number': i, 'favorite_color': None} for i in range(n)]
+
+
+def shared_memory_segments():
+    return set(os.listdir('/dev/shm')) if os.path.isdir('/dev/shm') else set()
+
+
+@pytest.fixture
+def serializer():
+    with ProcessSerializer(max_workers=2, schemas=[USER_SCHEMA]) as serializer:
+        yield serializer
+
+
+def test_serialize_in_workers(serializer):
+    batch = users(100)
+    metadata, records = deserialize(serializer.serialize(USER_SCHEMA, batch, ephemeral_storage=True, source='test'))
+    assert list(records) == batch
+    assert metadata['postmates.storage.ephemeral'] == '1'
+    assert metadata['source'] == 'test'
+
+    # Parsed schemas and generators are accepted too.
+    blob = serializer.submit(parse_schema(USER_SCHEMA), [(user for user in batch)]).result()
+    assert list(deserialize(blob)[1]) == batch
+
+
+@mock.patch.object(executor, 'SHARED_MEMORY_THRESHOLD', 0)
+def test_large_blobs_are_returned_through_shared_memory():
+    before = shared_memory_segments()
+    batch = users(1000)
+    with ProcessSerializer(max_workers=1) as serializer:
+        assert serializer.use_shared_memory == (executor._shared_memory is not None)
+        with mock.patch.object(executor, '_read_shared_memory', wraps=executor._read_shared_memory) as read:
+            futures = [serializer.submit(USER_SCHEMA, batch) for _ in range(4)]
+            for future in futures:
+                assert list(deserialize(future.result())[1]) == batch
+            assert len(read.call_args_list) == (4 if serializer.use_shared_memory else 0)
+
+    # Segments are unlinked once read.
+    assert shared_memory_segments() == before
+
+
+def test_invalid_records_raise(serializer):
+    with pytest.raises(DatumTypeException):
+        serializer.serialize(USER_SCHEMA, [{'name': 1}])
+
+    # The pool survives a failed batch.
+    assert list(deserialize(serializer.serialize(USER_SCHEMA, users(1)))[1]) == users(1)
+
+
+def test_pool_is_restarted_after_fork(serializer):
+    serializer.serialize(USER_SCHEMA, users(1))
+    pool = serializer._pool
+    serializer._after_fork()
+    assert serializer._pool is None
+
+    serializer.serialize(USER_SCHEMA, users(1))
+    assert serializer._pool is not pool
+    pool.shutdown()
+
+
+def test_client_publishes_through_serializer():
+    serializer = mock.MagicMock()
+    c = DummyClient(serializer=serializer)
+    with mock.patch.object(c, 'publish_blob', autospec=True) as m_publish_blob:
+        c.publish(USER_SCHEMA, users(2), sync=False)
+
+    assert serializer.serialize.call_args_list == [mock.call(USER_SCHEMA, users(2), False)]
+    assert m_publish_blob.call_args_list == [mock.call(serializer.serialize.return_value, sync=False)]
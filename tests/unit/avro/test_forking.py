@@ -0,0 +1,107 @@
+import os
+
+import mock
+import pytest
+
+from settings import USER_SCHEMA
+
+from pycernan.avro import forking
+from pycernan.avro.buffered import BufferedClient
+from pycernan.avro.serde import deserialize
+from pycernan.avro.tcp_conn_pool import TCPConnectionPool, _DefunctConnection
+from pycernan.avro.testing import FakeCernanServer
+from pycernan.avro.v1 import Client
+
+
+def user(name):
+    return {'name': name, 'favorite_number': None, 'favorite_color': None}
+
+
+def simulate_fork(instance):
+    instance._pid = -1
+    assert forking.check(instance)
+
+
+def test_check_resets_once_per_process():
+    instance = mock.MagicMock()
+    forking.register(instance)
+    assert not forking.check(instance)
+
+    simulate_fork(instance)
+    assert not forking.check(instance)
+    assert instance._after_fork.call_count == 1
+
+
+def test_pool_drops_inherited_connections_without_closing_them():
+    inherited = mock.MagicMock()
+    pool = TCPConnectionPool('foobar', 80, 2, 1, 1)
+    with mock.patch.object(pool, '_create_connection', return_value=inherited):
+        with pool.connection():
+            pass
+
+    simulate_fork(pool)
+    assert [pool.pool.get_nowait() for _ in range(2)] == [_DefunctConnection] * 2
+    pool.closeall()
+    assert inherited.close.call_count == 0
+
+
+def in_child(fn):
+    """
+        Runs fn in a forked child, returning True if it returned truthy.
+    """
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            status = 0 if fn() else 1
+        finally:
+            os._exit(status)
+    return os.waitpid(pid, 0)[1] == 0
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="Requires os.fork")
+def test_buffered_client_discards_parent_records_after_fork():
+    m_client = mock.MagicMock()
+    client = BufferedClient(m_client, linger_ms=60 * 1000)
+    client.publish(USER_SCHEMA, [user('parent')])
+
+    def child():
+        client.publish(USER_SCHEMA, [user('child')])
+        return client.close(timeout=5) and [list(deserialize(call[0][0])[1]) for call in m_client.publish_blob.call_args_list] == \
+            [[user('child')]]
+
+    assert in_child(child)
+    assert client.close(timeout=5)
+    assert [list(deserialize(call[0][0])[1]) for call in m_client.publish_blob.call_args_list] == [[user('parent')]]
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="Requires os.fork")
+def test_forked_children_do_not_share_connections():
+    num_children, publishes = 4, 50
+    with FakeCernanServer(record_frames=True) as server:
+        client = Client(host=server.host, port=server.port, maxsize=1)
+        # Establishes a pooled connection before forking, as a pre-fork server's master would.
+        client.publish_blob(b'parent', payload_id=1)
+
+        pids = []
+        for child in range(num_children):
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    for i in range(publishes):
+                        client.publish_blob(b'child', payload_id=(child + 1) * 1000 + i)
+                    status = 0
+                finally:
+                    os._exit(status)
+            pids.append(pid)
+
+        # Children run concurrently, so shared sockets would interleave their frames.
+        statuses = [os.waitpid(pid, 0)[1] for pid in pids]
+        client.publish_blob(b'parent', payload_id=2)
+        client.close()
+
+    assert statuses == [0] * num_children
+    assert server.frame_count == 2 + num_children * publishes
+    assert sorted(frame.payload_id for frame in server.frames if frame.avro_blob == b'child') == \
+        sorted((child + 1) * 1000 + i for child in range(num_children) for i in range(publishes))
@@ -0,0 +1,157 @@
+import socket
+import threading
+
+import mock
+import pytest
+
+from pycernan.avro import framing
+
+
+class TrickleSocket(object):
+    """
+        Accepts at most `max_write` bytes per sendmsg call.
+    """
+
+    def __init__(self, max_write):
+        self.max_write = max_write
+        self.received = b''
+        self.calls = 0
+
+    def sendmsg(self, buffers):
+        self.calls += 1
+        data = b''.join(bytes(buf) for buf in buffers)[:self.max_write]
+        self.received += data
+        return len(data)
+
+
+class NoSendmsgSocket(object):
+    def __init__(self):
+        self.sendall = mock.MagicMock()
+
+
+class RecordingSocket(object):
+    """
+        Keeps a copy of each buffer passed to sendall.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    def sendall(self, data):
+        self.sent.append(bytes(data))
+
+
+@pytest.mark.parametrize('payload, expected_len', [
+    (b'abc', 3),
+    (bytearray(b'abcd'), 4),
+    ((b'ab', b'', b'cde'), 5),
+])
+def test_payload_len(payload, expected_len):
+    assert framing.payload_len(payload) == expected_len
+
+
+@pytest.mark.parametrize('max_write', [1, 2, 3, 7, 100])
+@mock.patch.object(framing, 'SCATTER_THRESHOLD', 0)
+def test_sendall_resumes_after_partial_writes(max_write):
+    sock = TrickleSocket(max_write)
+    framing.sendall(sock, (b'head', b'', b'kv', b'avro body'))
+    assert sock.received == b'headkvavro body'
+    assert sock.calls == -(-len(sock.received) // max_write)
+
+
+def test_sendall_joins_small_payloads():
+    sock = mock.MagicMock()
+    framing.sendall(sock, (b'head', b'body'))
+    assert sock.sendall.call_args_list == [mock.call(b'headbody')]
+    assert sock.sendmsg.call_args_list == []
+
+
+@mock.patch.object(framing, 'SCATTER_THRESHOLD', 0)
+def test_sendall_without_sendmsg_sends_one_buffer():
+    sock = NoSendmsgSocket()
+    framing.sendall(sock, (b'head', memoryview(b'body')))
+    assert sock.sendall.call_args_list == [mock.call(b'headbody')]
+
+
+def test_sendall_passes_bytes_through():
+    sock = NoSendmsgSocket()
+    framing.sendall(sock, b'payload')
+    assert sock.sendall.call_args_list == [mock.call(b'payload')]
+
+
+def test_sendall_over_a_real_socket():
+    left, right = socket.socketpair()
+    body = b'x' * (1024 * 1024)
+    received = bytearray()
+
+    def drain():
+        while len(received) < len(body) + 4:
+            received.extend(right.recv(65536))
+
+    reader = threading.Thread(target=drain)
+    reader.start()
+    framing.sendall(left, (b'head', body))
+    reader.join(5)
+    left.close()
+    right.close()
+    assert bytes(received) == b'head' + body
+
+
+@pytest.fixture
+def region_file(tmpdir):
+    path = tmpdir.join('body.avro')
+    path.write_binary(b'0123456789' * 20000)
+    with open(str(path), 'rb') as file:
+        yield file
+
+
+def test_file_region(region_file):
+    region = framing.FileRegion(region_file, offset=5)
+    assert len(region) == framing.payload_len((b'head', region)) - 4 == 199995
+    assert region.read()[:5] == b'56789'
+    assert framing.join((b'head', region)) == b'head' + region.read()
+
+
+def test_small_file_regions_are_joined(region_file):
+    sock = NoSendmsgSocket()
+    framing.sendall(sock, (b'head', framing.FileRegion(region_file, offset=10, count=5)))
+    assert sock.sendall.call_args_list == [mock.call(b'head01234')]
+
+
+def test_file_region_sent_from_mmap_without_sendfile(region_file):
+    sock = RecordingSocket()
+    with mock.patch.object(framing, 'MMAP_CHUNK', 65536):
+        framing.sendall(sock, (b'head', b'kv', framing.FileRegion(region_file)))
+
+    sent = sock.sent
+    assert sent[0] == b'headkv'
+    assert [len(chunk) for chunk in sent[1:]] == [65536, 65536, 65536, 3392]
+    assert b''.join(sent[1:]) == b'0123456789' * 20000
+
+
+def test_file_region_sent_with_sendfile(region_file):
+    left, right = socket.socketpair()
+    received = bytearray()
+
+    def drain():
+        while len(received) < 200004:
+            received.extend(right.recv(65536))
+
+    reader = threading.Thread(target=drain)
+    reader.start()
+    framing.sendall(left, (b'head', framing.FileRegion(region_file)))
+    reader.join(5)
+    left.close()
+    right.close()
+    assert bytes(received) == b'head' + b'0123456789' * 20000
+
+
+def test_file_region_changed_size(region_file):
+    region = framing.FileRegion(region_file, count=300000)
+    with pytest.raises(ValueError):
+        region.read()
+
+    sock = RecordingSocket()
+    with pytest.raises(ValueError):
+        framing.sendall(sock, (b'head', region))
+    assert sock.sent == [b'head']
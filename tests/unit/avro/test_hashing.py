@@ -0,0 +1,89 @@
+import datetime
+import decimal
+import enum
+import os
+import subprocess
+import sys
+import uuid
+
+import pytest
+
+from pycernan.avro.hashing import ShardKey, encode, hash_u64
+from pycernan.avro.v1 import frame
+
+
+@pytest.mark.parametrize('value', [
+    'user-1234', u'été', b'bytes', 0, 2 ** 70, -1, 1.5, uuid.UUID(int=7), ('a', 1, (b'b', 2.0)), ('user', None),
+])
+def test_hashes_are_unsigned_64_bit(value):
+    assert 0 <= hash_u64(value) < 2 ** 64
+    assert hash_u64(value) == hash_u64(value)
+
+
+def test_encodings():
+    assert encode('abc') == encode(b'abc') == encode(bytearray(b'abc'))
+    assert encode(True) == encode(1)
+    assert len(set([encode(1), encode('1'), encode(1.0), encode((1,)), encode(('1',))])) == 5
+    # Tuple items are length prefixed, so their boundaries are unambiguous.
+    assert encode(('ab', 'c')) != encode(('a', 'bc'))
+    assert len(set([encode(None), encode(''), encode(0), encode(()), encode(('user', None)), encode(('user', ''))])) == 6
+
+
+def test_stdlib_types():
+    moment = datetime.datetime(2020, 1, 2, 3, 4, 5, 6)
+    assert encode(moment) != encode(moment.date()) != encode(moment.time())
+    assert encode(moment.replace(tzinfo=datetime.timezone.utc)) != encode(moment)
+    assert encode(datetime.timedelta(days=1)) == encode(datetime.timedelta(hours=24))
+    assert encode(decimal.Decimal('1.0')) == encode(decimal.Decimal('1')) != encode(decimal.Decimal('1.5'))
+    assert encode(decimal.Decimal('NaN')) != encode(decimal.Decimal('Infinity'))
+    assert encode(frozenset(['a', 'b', 1])) == encode(frozenset([1, 'b', 'a'])) != encode(('a', 'b', 1))
+    assert len(set([encode(moment.date()), encode(str(moment.date())), encode(decimal.Decimal(1)), encode(1)])) == 4
+
+
+class Color(enum.Enum):
+    RED = 1
+
+
+def test_other_hashables_are_encoded_by_repr():
+    assert encode(Color.RED) == encode(Color(1))
+    assert encode(Color.RED) != encode(repr(Color.RED))
+    assert encode(1 + 2j) != encode(1 - 2j)
+
+
+def test_hashes_of_stdlib_types_are_stable_across_processes():
+    script = ("import datetime, decimal; from pycernan.avro.hashing import hash_u64; "
+              "print(hash_u64((frozenset(['a', 'b', 'c']), datetime.date(2020, 1, 2), decimal.Decimal('1.50'))))")
+    outputs = set()
+    for seed in ('1', '2'):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        outputs.add(subprocess.check_output([sys.executable, '-c', script], env=env).strip())
+    assert len(outputs) == 1
+
+
+def test_unhashable_values_raise():
+    with pytest.raises(TypeError):
+        hash_u64(['a'])
+
+    with pytest.raises(TypeError):
+        hash_u64(('a', ['b']))
+
+
+def test_hashes_are_stable_across_processes():
+    script = "from pycernan.avro.hashing import hash_u64; print(hash_u64(('user', 'abc', 42)))"
+    outputs = set()
+    for seed in ('1', '2'):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        outputs.add(subprocess.check_output([sys.executable, '-c', script], env=env).strip())
+    assert outputs == set([str(hash_u64(('user', 'abc', 42))).encode('ascii')])
+
+
+def test_shard_keys():
+    key = ShardKey('user-1234')
+    assert key.hash == hash_u64('user-1234') == hash_u64(key)
+    assert key == ShardKey('user-1234')
+    assert key != ShardKey('user-5678')
+    assert len(set([key, ShardKey('user-1234')])) == 1
+
+    _, _, (header, _) = frame(b'blob', shard_by=key)
+    _, _, (expected, _) = frame(b'blob', payload_id=1, shard_by='user-1234')
+    assert header[-8:] == expected[-8:]
@@ -0,0 +1,127 @@
+import threading
+
+import mock
+import pytest
+
+from prometheus_client import REGISTRY
+
+from pycernan.avro import metrics
+from pycernan.avro.metrics import AggregatingBackend, NoopBackend, PrometheusBackend
+
+
+def sample(name, labels=None):
+    return REGISTRY.get_sample_value('pycernan_{}'.format(name), labels) or 0
+
+
+@pytest.fixture(autouse=True)
+def restore_backend():
+    yield
+    metrics.use('prometheus')
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        metrics.use('statsd')
+
+    with pytest.raises(ValueError):
+        AggregatingBackend(interval=0)
+
+
+def test_prometheus_backend_updates_immediately():
+    assert isinstance(metrics.use('prometheus'), PrometheusBackend)
+    before = sample('ack_count_total')
+    metrics.ack_count.inc()
+    assert sample('ack_count_total') - before == 1
+
+
+def test_noop_backend_discards_updates():
+    assert isinstance(metrics.use('noop'), NoopBackend)
+    before = (sample('ack_count_total'), sample('ack_latency_count'), sample('in_flight'))
+
+    metrics.ack_count.inc()
+    metrics.in_flight.inc()
+    with metrics.ack_latency.time():
+        pass
+    metrics.endpoint_ejection_count.labels('foo:1').inc()
+
+    assert (sample('ack_count_total'), sample('ack_latency_count'), sample('in_flight')) == before
+    assert sample('endpoint_ejection_count_total', {'endpoint': 'foo:1'}) == 0
+
+
+def test_count_exceptions_follows_the_backend():
+    @metrics.publish_failure_count.count_exceptions()
+    def fail():
+        raise ValueError()
+
+    before = sample('publish_failure_count_total')
+    metrics.use('noop')
+    with pytest.raises(ValueError):
+        fail()
+    assert sample('publish_failure_count_total') == before
+
+    metrics.use('prometheus')
+    with pytest.raises(ValueError):
+        fail()
+    with pytest.raises(KeyError):
+        with metrics.publish_failure_count.count_exceptions(KeyError):
+            raise KeyError()
+    assert sample('publish_failure_count_total') - before == 2
+
+
+def test_aggregating_backend_folds_updates_from_each_thread():
+    backend = metrics.use(AggregatingBackend(interval=60))
+    before = (sample('ack_count_total'), sample('ack_latency_count'), sample('in_flight'))
+
+    def work():
+        for _ in range(100):
+            metrics.ack_count.inc()
+            metrics.in_flight.inc(2)
+            metrics.in_flight.dec()
+            with metrics.ack_latency.time():
+                pass
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert (sample('ack_count_total'), sample('ack_latency_count'), sample('in_flight')) == before
+
+    backend.flush()
+    assert sample('ack_count_total') - before[0] == 400
+    assert sample('ack_latency_count') - before[1] == 400
+    assert sample('in_flight') - before[2] == 400
+    # Buffers of finished threads are released once drained.
+    assert backend._buffers == []
+
+    metrics.in_flight.dec(400)
+    backend.flush()
+
+
+def test_aggregating_backend_flushes_on_a_timer():
+    flushed = threading.Event()
+    with mock.patch.object(AggregatingBackend, 'flush', side_effect=lambda: flushed.set()):
+        backend = metrics.use(AggregatingBackend(interval=0.01))
+        assert flushed.wait(5)
+        backend._stopped.set()
+
+
+def test_switching_backends_flushes_pending_updates():
+    before = sample('ack_count_total')
+    metrics.use(AggregatingBackend(interval=60))
+    metrics.ack_count.inc()
+    metrics.use('prometheus')
+    assert sample('ack_count_total') - before == 1
+
+
+def test_labelled_children_follow_the_backend():
+    child = metrics.buffer_flush_count.labels('test')
+    backend = metrics.use(AggregatingBackend(interval=60))
+    assert metrics.buffer_flush_count.labels('test') is child
+
+    before = sample('buffer_flush_count_total', {'reason': 'test'})
+    child.inc()
+    assert sample('buffer_flush_count_total', {'reason': 'test'}) == before
+    backend.flush()
+    assert sample('buffer_flush_count_total', {'reason': 'test'}) - before == 1
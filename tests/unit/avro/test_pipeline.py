@@ -0,0 +1,223 @@
+import socket
+import struct
+import threading
+import time
+
+import mock
+import pytest
+
+from pycernan.avro.exceptions import ConnectionResetException, InvalidAckException
+from pycernan.avro.pipeline import PipelinedConnection, PipelinedConnectionPool, _NotSentException
+from pycernan.avro.testing import FakeCernanServer
+from pycernan.avro.v1 import Client
+
+
+def ack(payload_id):
+    return struct.pack('>Q', payload_id)
+
+
+@pytest.fixture
+def socks():
+    client_sock, server_sock = socket.socketpair()
+    client_sock.settimeout(5)
+    server_sock.settimeout(5)
+    yield client_sock, server_sock
+    server_sock.close()
+
+
+def test_value_errors(socks):
+    with pytest.raises(ValueError):
+        PipelinedConnection(socks[0], 0)
+
+    with pytest.raises(ValueError):
+        PipelinedConnectionPool('foobar', 80, 1, 1, 1, 0)
+
+    with pytest.raises(ValueError):
+        PipelinedConnectionPool('foobar', 80, 0, 1, 1, 1)
+
+
+def test_out_of_order_acks_resolve_matching_futures(socks):
+    client_sock, server_sock = socks
+    conn = PipelinedConnection(client_sock, max_in_flight=3)
+
+    futures = [conn.submit(payload_id, 1, b'payload') for payload_id in (1, 2, 3)]
+    assert conn.num_pending == 3
+    assert server_sock.recv(1024) == b'payload' * 3
+
+    server_sock.sendall(ack(3))
+    futures[2].result(5)
+    assert not futures[0].done()
+
+    server_sock.sendall(ack(1) + ack(2))
+    futures[0].result(5)
+    futures[1].result(5)
+    assert conn.num_pending == 0
+    conn.close()
+
+
+def test_async_payloads_resolve_once_sent(socks):
+    client_sock, server_sock = socks
+    conn = PipelinedConnection(client_sock, max_in_flight=1)
+    future = conn.submit(1, 0, b'payload')
+    assert future.result(0) is None
+    assert conn.num_pending == 0
+    conn.close()
+
+
+def test_unknown_ack_fails_outstanding_futures(socks):
+    client_sock, server_sock = socks
+    conn = PipelinedConnection(client_sock, max_in_flight=2)
+    futures = [conn.submit(payload_id, 1, b'payload') for payload_id in (1, 2)]
+
+    server_sock.sendall(ack(1) + ack(42))
+    futures[0].result(5)
+    with pytest.raises(InvalidAckException):
+        futures[1].result(5)
+    assert conn.defunct
+
+    with pytest.raises(ConnectionResetException):
+        conn.submit(3, 1, b'payload')
+
+
+def test_connection_reset_fails_outstanding_futures(socks):
+    client_sock, server_sock = socks
+    conn = PipelinedConnection(client_sock, max_in_flight=2)
+    future = conn.submit(1, 1, b'payload')
+    assert server_sock.recv(1024) == b'payload'
+    server_sock.close()
+
+    with pytest.raises(ConnectionResetException):
+        future.result(5)
+    assert conn.defunct
+
+
+def test_read_timeouts_fail_outstanding_futures(socks):
+    client_sock, server_sock = socks
+    client_sock.settimeout(0.05)
+    conn = PipelinedConnection(client_sock, max_in_flight=2)
+    future = conn.submit(1, 1, b'payload')
+
+    with pytest.raises(socket.timeout):
+        future.result(5)
+    assert conn.defunct
+
+
+def test_acks_split_across_read_timeouts(socks):
+    client_sock, server_sock = socks
+    client_sock.settimeout(0.05)
+    conn = PipelinedConnection(client_sock, max_in_flight=2, ack_timeout=5)
+    futures = [conn.submit(payload_id, 1, b'payload') for payload_id in (1, 2)]
+
+    server_sock.sendall(ack(1)[:3])
+    time.sleep(0.2)
+    server_sock.sendall(ack(1)[3:] + ack(2))
+    for future in futures:
+        assert future.result(5) is None
+    assert not conn.defunct
+    conn.close()
+
+
+def test_payloads_not_yet_sent_move_to_another_connection(socks):
+    client_sock, server_sock = socks
+    other_client_sock, other_server_sock = socket.socketpair()
+    other_server_sock.settimeout(5)
+    conns = [PipelinedConnection(client_sock, 1), PipelinedConnection(other_client_sock, 1)]
+    pool = PipelinedConnectionPool('foobar', 80, 1, 1, 1, 1)
+
+    with mock.patch.object(pool, '_create_connection', side_effect=conns):
+        first = pool.submit(1, 1, b'first')
+        assert server_sock.recv(1024) == b'first'
+        second = []
+        thread = threading.Thread(target=lambda: second.append(pool.submit(2, 1, b'second')))
+        thread.start()
+        # Waits for room on the first connection, which the wrong ack then kills.
+        time.sleep(0.05)
+        server_sock.sendall(ack(42))
+
+        with pytest.raises(InvalidAckException):
+            first.result(5)
+        assert other_server_sock.recv(1024) == b'second'
+        other_server_sock.sendall(ack(2))
+        thread.join(5)
+
+    assert second[0].result(5) is None
+    pool.closeall()
+    other_server_sock.close()
+
+
+def test_defunct_connections_refuse_unsent_payloads(socks):
+    conn = PipelinedConnection(socks[0], max_in_flight=1)
+    conn.close()
+    for sync in (1, 0):
+        with pytest.raises(_NotSentException):
+            conn.submit(1, sync, b'payload')
+
+
+def test_pool_grows_only_when_connections_are_busy():
+    pool = PipelinedConnectionPool('foobar', 80, 2, 1, 1, 4)
+    conns = [mock.MagicMock(num_pending=1, defunct=False), mock.MagicMock(num_pending=0, defunct=False)]
+    with mock.patch.object(pool, '_create_connection', side_effect=conns) as m_create:
+        pool.submit(1, 1, b'payload')
+        pool.submit(2, 1, b'payload')
+        pool.submit(3, 1, b'payload')
+
+    assert m_create.call_count == 2
+    assert conns[0].submit.call_args_list == [mock.call(1, 1, b'payload')]
+    assert conns[1].submit.call_args_list == [mock.call(2, 1, b'payload'), mock.call(3, 1, b'payload')]
+
+    # Defunct connections are replaced.
+    conns[1].defunct = True
+    replacement = mock.MagicMock(num_pending=0, defunct=False)
+    with mock.patch.object(pool, '_create_connection', return_value=replacement):
+        pool.submit(4, 1, b'payload')
+    assert replacement.submit.call_args_list == [mock.call(4, 1, b'payload')]
+
+    pool.closeall()
+    assert replacement.close.call_count == 1
+
+
+def test_pool_connects_outside_of_its_lock():
+    pool = PipelinedConnectionPool('foobar', 80, 2, 1, 1, 4)
+    busy = mock.MagicMock(num_pending=1, defunct=False)
+    connecting, unblock = threading.Event(), threading.Event()
+
+    def slow_connect():
+        connecting.set()
+        assert unblock.wait(5)
+        raise socket.error("Connection refused")
+
+    with mock.patch.object(pool, '_create_connection', return_value=busy):
+        pool.submit(1, 1, b'payload')
+
+    with mock.patch.object(pool, '_create_connection', side_effect=slow_connect):
+        errors = []
+
+        def submit():
+            try:
+                pool.submit(2, 1, b'payload')
+            except socket.error as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=submit)
+        thread.start()
+        assert connecting.wait(5)
+        # Submits are not held up by the connection being created.
+        pool.submit(3, 1, b'payload')
+        unblock.set()
+        thread.join(5)
+
+    assert len(errors) == 1
+    assert busy.submit.call_args_list == [mock.call(1, 1, b'payload'), mock.call(3, 1, b'payload')]
+    # A failed connection frees its slot.
+    assert pool.connections == [busy, None]
+    pool.closeall()
+
+
+def test_pipelined_client_against_fake_server():
+    with FakeCernanServer(ack_delay=0.01) as server:
+        client = Client(host=server.host, port=server.port, maxsize=1, max_in_flight=50)
+        futures = [client.publish_blob(b'blob', payload_id=i + 1) for i in range(100)]
+        for future in futures:
+            assert future.result(5) is None
+        client.close()
+        assert server.frame_count == 100
@@ -0,0 +1,85 @@
+import socket
+
+import mock
+import pytest
+
+from prometheus_client import REGISTRY
+
+from pycernan.avro.exceptions import ConnectionResetException, InvalidAckException
+from pycernan.avro.retry import RetryPolicy
+from pycernan.avro.v1 import Client
+
+
+def sample(name):
+    return REGISTRY.get_sample_value('pycernan_{}_total'.format(name)) or 0
+
+
+@pytest.fixture
+def m_sleep():
+    with mock.patch('pycernan.avro.retry.time.sleep') as m_sleep:
+        yield m_sleep
+
+
+def test_value_errors():
+    with pytest.raises(ValueError):
+        RetryPolicy(max_attempts=0)
+
+    with pytest.raises(ValueError):
+        RetryPolicy(multiplier=0.5)
+
+
+def test_backoff_grows_exponentially_up_to_max():
+    policy = RetryPolicy(backoff=0.1, multiplier=2, max_backoff=0.5, jitter=False)
+    assert [policy.delay(retry) for retry in range(1, 6)] == [0.1, 0.2, 0.4, 0.5, 0.5]
+
+    jittered = RetryPolicy(backoff=0.1, multiplier=2, max_backoff=0.5)
+    assert all(0 <= jittered.delay(3) <= 0.4 for _ in range(100))
+
+
+def test_retries_until_success(m_sleep):
+    fn = mock.MagicMock(side_effect=[ConnectionResetException(), InvalidAckException(), 'ok'])
+    retries = sample('publish_retry_count')
+
+    assert RetryPolicy(max_attempts=3, jitter=False).call(fn, 1, 2) == 'ok'
+    assert fn.call_args_list == [mock.call(1, 2)] * 3
+    assert m_sleep.call_args_list == [mock.call(0.05), mock.call(0.1)]
+    assert sample('publish_retry_count') - retries == 2
+
+
+def test_gives_up_after_max_attempts(m_sleep):
+    fn = mock.MagicMock(side_effect=socket.timeout())
+    give_ups = sample('publish_give_up_count')
+
+    with pytest.raises(socket.timeout):
+        RetryPolicy(max_attempts=2).call(fn)
+    assert fn.call_count == 2
+    assert sample('publish_give_up_count') - give_ups == 1
+
+
+def test_gives_up_at_the_deadline(m_sleep):
+    fn = mock.MagicMock(side_effect=socket.error())
+    with mock.patch('pycernan.avro.retry.time.time', side_effect=[0, 0.1, 0.4]):
+        with pytest.raises(socket.error):
+            RetryPolicy(max_attempts=10, backoff=0.2, jitter=False, deadline=0.5).call(fn)
+    assert fn.call_count == 2
+
+
+def test_other_exceptions_are_not_retried(m_sleep):
+    fn = mock.MagicMock(side_effect=ValueError())
+    with pytest.raises(ValueError):
+        RetryPolicy().call(fn)
+    assert fn.call_count == 1
+
+
+def test_client_resends_the_same_frame(m_sleep):
+    client = Client(host='foobar', port=80, retry=RetryPolicy(max_attempts=3))
+    socks = [mock.MagicMock(), mock.MagicMock()]
+    with mock.patch.object(client.pool, '_create_connection', side_effect=socks), \
+            mock.patch.object(client, '_wait_for_ack', side_effect=[InvalidAckException(), None]) as m_ack:
+        client.publish_blob(b'blob', payload_id=42)
+
+    # The failed connection is replaced, the frame and id are not.
+    assert socks[0].close.call_count == 1
+    assert socks[0].sendall.call_args_list == socks[1].sendall.call_args_list
+    assert [call[0][1] for call in m_ack.call_args_list] == [42, 42]
+    client.close()
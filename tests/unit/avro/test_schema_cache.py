@@ -0,0 +1,110 @@
+import copy
+
+import mock
+import pytest
+
+from prometheus_client import REGISTRY
+
+from settings import USER_SCHEMA
+
+from pycernan.avro.exceptions import SchemaParseException
+from pycernan.avro.schema_cache import SchemaCache, fingerprint, is_parsed
+
+
+def sample(name):
+    return REGISTRY.get_sample_value('pycernan_{}_total'.format(name)) or 0
+
+
+def test_cache_value_errors():
+    with pytest.raises(ValueError):
+        SchemaCache(maxsize=0)
+
+
+def test_fingerprint_is_independent_of_key_order():
+    reordered = dict(reversed(list(USER_SCHEMA.items())))
+    assert fingerprint(reordered) == fingerprint(USER_SCHEMA)
+
+
+def test_fingerprint_distinguishes_logical_types():
+    plain = {"type": "record", "name": "T", "fields": [{"name": "ts", "type": "long"}]}
+    logical = {"type": "record", "name": "T", "fields": [{"name": "ts", "type": {"type": "long", "logicalType": "timestamp-micros"}}]}
+    assert fingerprint(plain) != fingerprint(logical)
+
+
+def test_parse_hits_and_misses():
+    cache = SchemaCache(maxsize=4)
+    hits, misses = sample('schema_cache_hit_count'), sample('schema_cache_miss_count')
+
+    parsed = cache.parse(USER_SCHEMA)
+    assert is_parsed(parsed)
+    assert cache.parse(USER_SCHEMA) is parsed
+
+    # Equal schemas built independently share the cached entry.
+    assert cache.parse(copy.deepcopy(USER_SCHEMA)) is parsed
+    assert len(cache) == 1
+
+    assert sample('schema_cache_miss_count') - misses == 1
+    assert sample('schema_cache_hit_count') - hits == 2
+
+
+def test_schemas_mutated_in_place_are_parsed_again():
+    cache = SchemaCache(maxsize=4)
+    schema = copy.deepcopy(USER_SCHEMA)
+    parsed = cache.parse(schema)
+
+    schema['fields'].append({"name": "favorite_food", "type": ["null", "string"], "default": None})
+    reparsed = cache.parse(schema)
+    assert reparsed is not parsed
+    assert [f['name'] for f in reparsed['fields']][-1] == 'favorite_food'
+
+
+def test_unchanged_schemas_are_fingerprinted_once():
+    cache = SchemaCache(maxsize=4)
+    schema = copy.deepcopy(USER_SCHEMA)
+    with mock.patch('pycernan.avro.schema_cache.fingerprint', autospec=True, side_effect=fingerprint) as m_fingerprint:
+        parsed = cache.parse(schema)
+        assert cache.parse(schema) is parsed
+        assert m_fingerprint.call_count == 1
+
+        # A nested mutation no longer matches the snapshot taken, so the schema is fingerprinted and parsed again.
+        schema['fields'][0]['type'] = 'bytes'
+        reparsed = cache.parse(schema)
+        assert m_fingerprint.call_count == 2
+    assert reparsed is not parsed
+    assert reparsed['fields'][0]['type'] == 'bytes'
+
+
+def test_parsed_schemas_bypass_the_cache():
+    cache = SchemaCache(maxsize=4)
+    parsed = cache.parse(USER_SCHEMA)
+    with mock.patch('pycernan.avro.schema_cache.parse_schema', autospec=True) as m_parse:
+        assert cache.parse(parsed) is parsed
+    assert m_parse.call_args_list == []
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = SchemaCache(maxsize=2)
+    evictions = sample('schema_cache_eviction_count')
+    schemas = []
+    for name in ['A', 'B', 'C']:
+        schema = copy.deepcopy(USER_SCHEMA)
+        schema['name'] = name
+        schemas.append(schema)
+
+    first = cache.parse(schemas[0])
+    cache.parse(schemas[1])
+    assert cache.parse(schemas[0]) is first  # A is now most recently used.
+    cache.parse(schemas[2])                  # Evicts B.
+
+    assert len(cache) == 2
+    assert sample('schema_cache_eviction_count') - evictions == 1
+    assert cache.parse(schemas[0]) is first
+
+
+def test_parse_errors_are_not_cached():
+    cache = SchemaCache(maxsize=2)
+    schema = {"type": "record", "fields": []}
+    for _ in range(2):
+        with pytest.raises(SchemaParseException):
+            cache.parse(schema)
+    assert len(cache) == 0
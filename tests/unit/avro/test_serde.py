@@ -1,25 +1,16 @@
 from decimal import Decimal
+import pickle
 import pytest
 import types
 
-from fastavro import reader
+from fastavro import block_reader, reader
 from future.utils import string_types
 from io import BytesIO
 
-from pycernan.avro.exceptions import SchemaParseException, SchemaResolutionException, DatumTypeException
-from pycernan.avro.serde import parse_schema, serialize, deserialize
-
+from settings import USER_SCHEMA
 
-USER_SCHEMA = {
-    "namespace": "example.avro",
-    "type": "record",
-    "name": "User",
-    "fields": [
-        {"name": "name", "type": "string"},
-        {"name": "favorite_number",  "type": ["int", "null"]},
-        {"name": "favorite_color", "type": ["string", "null"]}
-    ]
-}
+from pycernan.avro.exceptions import SchemaParseException, SchemaResolutionException, DatumTypeException
+from pycernan.avro.serde import Codec, Encoder, as_codec, available_codecs, encode_record, parse_schema, serialize, serialize_block, deserialize
 
 
 BOOK_SCHEMA_WRITE = {
@@ -247,6 +238,39 @@ def test_serialize_and_deserialize_with_reader_schema():
         test_records = [value for value in test_generator]
 
 
+def test_serialize_batch_as_single_container():
+    users = [
+        {'name': 'User {}'.format(i), 'favorite_number': i, 'favorite_color': None}
+        for i in range(100)
+    ]
+    generated = (user for user in users[50:])
+
+    avro_blob = serialize(USER_SCHEMA, users[:50] + [generated])
+    assert avro_blob.count(b'Obj\x01') == 1
+
+    blocks = list(block_reader(BytesIO(avro_blob)))
+    assert len(blocks) == 1
+    assert blocks[0].num_records == len(users)
+
+    _, records = deserialize(avro_blob)
+    assert list(records) == users
+
+
+def test_serialize_block_size():
+    users = [
+        {'name': 'User {}'.format(i), 'favorite_number': i, 'favorite_color': None}
+        for i in range(100)
+    ]
+
+    avro_blob = serialize(USER_SCHEMA, users, block_size=64)
+    blocks = list(block_reader(BytesIO(avro_blob)))
+    assert len(blocks) > 1
+    assert sum(block.num_records for block in blocks) == len(users)
+
+    _, records = deserialize(avro_blob)
+    assert list(records) == users
+
+
 def test_serialize_with_metadata():
     metadata = {
         'foo.bar': 10,
@@ -265,6 +289,143 @@ def test_serialize_with_metadata():
         assert test_meta[k] == str(metadata[k])
 
 
+def codec_of(avro_blob):
+    return deserialize(avro_blob)[0]['avro.codec']
+
+
+@pytest.mark.parametrize('codec', available_codecs())
+def test_serialize_with_codec(codec):
+    users = [{'name': 'User {}'.format(i), 'favorite_number': i, 'favorite_color': None} for i in range(100)]
+    for value in [codec, Codec(codec)]:
+        avro_blob = serialize(USER_SCHEMA, users, codec=value)
+        assert codec_of(avro_blob) == codec
+        assert list(deserialize(avro_blob)[1]) == users
+
+
+def test_serialize_defaults_to_deflate():
+    assert codec_of(serialize(USER_SCHEMA, [{'name': 'Foo', 'favorite_number': None, 'favorite_color': None}])) == 'deflate'
+
+
+def test_deflate_levels():
+    users = [{'name': 'User {}'.format(i % 7), 'favorite_number': i, 'favorite_color': 'Red'} for i in range(1000)]
+    sizes = [len(serialize(USER_SCHEMA, users, codec=Codec('deflate', level=level))) for level in (0, 1, 9)]
+    assert sizes[0] > sizes[1] >= sizes[2]
+
+
+def test_adaptive_codec():
+    users = [{'name': 'User {}'.format(i), 'favorite_number': i, 'favorite_color': None} for i in range(100)]
+    small = serialize(USER_SCHEMA, users, codec=Codec('deflate', min_bytes=10 ** 6))
+    assert codec_of(small) == 'null'
+
+    # Blocks of an uncompressed container are recompressed once it is large enough.
+    uncompressed = serialize(USER_SCHEMA, users, block_size=64, codec='null')
+    large = serialize(USER_SCHEMA, users, block_size=64, codec=Codec('deflate', min_bytes=len(small)))
+    assert codec_of(large) == 'deflate'
+    assert len(large) < len(uncompressed)
+    assert len(list(block_reader(BytesIO(large)))) == len(list(block_reader(BytesIO(uncompressed)))) > 1
+    assert list(deserialize(large)[1]) == users
+
+
+def test_serialize_block_with_codec():
+    block = BytesIO()
+    assert encode_record(USER_SCHEMA, {'name': 'Foo', 'favorite_number': 0, 'favorite_color': None}, block) == 7
+    for codec, expected in [('null', 'null'), (Codec('deflate', min_bytes=7), 'deflate'), (Codec('deflate', min_bytes=8), 'null')]:
+        avro_blob = serialize_block(USER_SCHEMA, block, 1, codec=codec)
+        assert codec_of(avro_blob) == expected
+        assert list(deserialize(avro_blob)[1]) == [{'name': 'Foo', 'favorite_number': 0, 'favorite_color': None}]
+
+
+def test_codec_values():
+    codec = Codec('deflate', level=9, min_bytes=100)
+    assert pickle.loads(pickle.dumps(codec)) == codec
+    assert codec != Codec('deflate', level=9)
+    assert len(set([codec, Codec('deflate', level=9, min_bytes=100)])) == 1
+    assert as_codec(codec) is codec
+    assert as_codec('null') is as_codec('null')
+    assert as_codec(None) == Codec('deflate')
+
+    assert Codec('deflate', level=-1).level == -1
+    invalid = [{'name': 'lzma'}, {'name': 'null', 'level': 1}, {'min_bytes': -1}, {'level': 42}, {'level': -2}, {'level': '9'}]
+    for kwargs in invalid:
+        with pytest.raises(ValueError):
+            Codec(**kwargs)
+
+
+@pytest.mark.parametrize('codec', available_codecs())
+def test_encoder(codec):
+    users = [{'name': 'User {}'.format(i), 'favorite_number': i, 'favorite_color': None} for i in range(100)]
+    encoder = Encoder(USER_SCHEMA, codec=codec, ephemeral_storage=True, block_size=256, foo=1)
+    expected = serialize(USER_SCHEMA, users, ephemeral_storage=True, block_size=256, codec=codec, foo=1)
+
+    for _ in range(2):
+        avro_blob = encoder.encode(users)
+        assert avro_blob.startswith(encoder.header())
+        assert len(avro_blob) == len(expected)
+        meta, records = deserialize(avro_blob)
+        assert list(records) == users
+        assert meta['avro.codec'] == codec
+        assert meta['foo'] == '1'
+        assert meta['postmates.storage.ephemeral'] == '1'
+        assert len(list(block_reader(BytesIO(avro_blob)))) > 1
+
+    assert list(deserialize(encoder.encode([]))[1]) == []
+
+
+def test_encoder_adaptive_codec():
+    users = [{'name': 'User {}'.format(i), 'favorite_number': i, 'favorite_color': None} for i in range(100)]
+    encoder = Encoder(USER_SCHEMA, codec=Codec('deflate', min_bytes=1024), block_size=64)
+    assert codec_of(encoder.encode(users[:2])) == 'null'
+    avro_blob = encoder.encode(users)
+    assert codec_of(avro_blob) == 'deflate'
+    assert len(avro_blob) == len(serialize(USER_SCHEMA, users, block_size=64, codec=Codec('deflate', min_bytes=1024)))
+    assert list(deserialize(avro_blob)[1]) == users
+
+
+def test_encoder_discards_failed_batches():
+    encoder = Encoder(USER_SCHEMA)
+
+    def failing():
+        yield {'name': 'One', 'favorite_number': 1, 'favorite_color': None}
+        yield {'name': 'Two', 'favorite_number': 2, 'favorite_color': None}
+        raise RuntimeError("source failed")
+
+    with pytest.raises(RuntimeError):
+        encoder.encode([failing()])
+    assert [r['name'] for r in deserialize(encoder.encode([{'name': 'Three', 'favorite_number': 3, 'favorite_color': None}]))[1]] == ['Three']
+
+
+def test_encoder_blocks():
+    encoder = Encoder(USER_SCHEMA, codec=Codec('deflate', min_bytes=8))
+    block = BytesIO()
+    encode_record(USER_SCHEMA, {'name': 'Foo', 'favorite_number': 0, 'favorite_color': None}, block)
+
+    assert codec_of(encoder.encode_block(block, 1)) == 'null'
+    encode_record(USER_SCHEMA, {'name': 'Bar', 'favorite_number': 1, 'favorite_color': None}, block)
+    avro_blob = encoder.encode_block(block, 2)
+    assert codec_of(avro_blob) == 'deflate'
+    assert avro_blob.startswith(encoder.header('deflate'))
+    assert [r['name'] for r in deserialize(avro_blob)[1]] == ['Foo', 'Bar']
+
+    # Containers share the encoder's sync marker.
+    assert encoder.sync_marker in encoder.header('null') and encoder.sync_marker in encoder.header('deflate')
+
+
+def test_encoder_invalid_record():
+    encoder = Encoder(USER_SCHEMA)
+    for validation in ['always', 'never']:
+        encoder.validation = validation
+        with pytest.raises(DatumTypeException):
+            encoder.encode([{'name': 1}])
+    # Failed batches leave nothing behind.
+    assert list(deserialize(encoder.encode([{'name': 'Foo', 'favorite_number': None, 'favorite_color': None}]))[1])[0]['name'] == 'Foo'
+
+
+@pytest.mark.parametrize('codec', sorted(set(['snappy', 'zstandard']) - set(available_codecs())))
+def test_uninstalled_codecs(codec):
+    with pytest.raises(ValueError):
+        Codec(codec)
+
+
 def test_deserialize_bad_arg_to_deserialize():
     with pytest.raises(ValueError):
         deserialize(47)
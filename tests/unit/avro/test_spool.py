@@ -0,0 +1,215 @@
+import os
+import socket
+
+import mock
+import pytest
+
+from prometheus_client import REGISTRY
+
+from settings import USER_SCHEMA
+
+from pycernan.avro import v1, v2
+from pycernan.avro.buffered import BufferedClient
+from pycernan.avro.exceptions import SpoolFullException
+from pycernan.avro.framing import join
+from pycernan.avro.hashing import hash_u64
+from pycernan.avro.serde import deserialize
+from pycernan.avro.spool import Spool, frame_id
+
+
+def user(name):
+    return {'name': name, 'favorite_number': None, 'favorite_color': None}
+
+
+def framed(i, version=v1):
+    payload_id, sync, payload = version.frame('blob {}'.format(i).encode('utf-8'), payload_id=i + 1, shard_by=1)
+    return join(payload)
+
+
+def drain(spool):
+    frames = []
+    entry = spool.peek()
+    while entry is not None:
+        position, frame = entry
+        frames.append(frame)
+        spool.commit(position)
+        entry = spool.peek()
+    return frames
+
+
+def segments(directory):
+    return sorted(name for name in os.listdir(str(directory)) if name.endswith('.seg'))
+
+
+def test_value_errors(tmpdir):
+    with pytest.raises(ValueError):
+        Spool(str(tmpdir), fsync='sometimes')
+
+    with pytest.raises(ValueError):
+        Spool(str(tmpdir), max_bytes=0)
+
+
+@pytest.mark.parametrize('version', [v1, v2])
+def test_frame_id(version):
+    payload_id, sync, payload = version.frame(b'blob', sync=False, payload_id=42, shard_by=7)
+    assert frame_id(join(payload)) == (42, 0, hash_u64(7))
+
+
+@pytest.mark.parametrize('fsync', ['always', 'interval', 'never'])
+def test_frames_replay_in_order_across_segments(tmpdir, fsync):
+    spool = Spool(str(tmpdir), segment_bytes=100, fsync=fsync)
+    expected = [framed(i) for i in range(10)]
+    for frame in expected:
+        spool.append(frame)
+    assert len(segments(tmpdir)) > 1
+    assert spool.size_bytes == sum(len(frame) for frame in expected)
+
+    assert drain(spool) == expected
+    assert spool.empty()
+    assert len(segments(tmpdir)) == 1
+    spool.close()
+
+
+def test_appends_beyond_max_bytes_are_rejected(tmpdir):
+    frame = framed(0)
+    spool = Spool(str(tmpdir), max_bytes=len(frame) * 2)
+    full = REGISTRY.get_sample_value('pycernan_spool_full_count_total')
+
+    spool.append(frame)
+    spool.append(frame)
+    with pytest.raises(SpoolFullException):
+        spool.append(frame)
+    assert REGISTRY.get_sample_value('pycernan_spool_full_count_total') - full == 1
+
+    # Replay frees space.
+    position, _ = spool.peek()
+    spool.commit(position)
+    spool.append(frame)
+    spool.close()
+
+
+def test_replay_resumes_after_restart(tmpdir):
+    spool = Spool(str(tmpdir), segment_bytes=100)
+    expected = [framed(i) for i in range(6)]
+    for frame in expected:
+        spool.append(frame)
+
+    for _ in range(4):
+        position, _ = spool.peek()
+        spool.commit(position)
+    spool.close()
+
+    reopened = Spool(str(tmpdir), segment_bytes=100)
+    assert reopened.size_bytes == sum(len(frame) for frame in expected[4:])
+    assert drain(reopened) == expected[4:]
+    reopened.close()
+
+
+def test_cursor_is_written_in_batches(tmpdir):
+    spool = Spool(str(tmpdir), cursor_frames=3, cursor_interval=60)
+    expected = [framed(i) for i in range(6)]
+    for frame in expected:
+        spool.append(frame)
+
+    with mock.patch.object(spool, '_store_cursor', wraps=spool._store_cursor) as m_store:
+        for _ in range(4):
+            position, _ = spool.peek()
+            spool.commit(position)
+    assert m_store.call_count == 1
+
+    # Without a close, as after a crash, frames committed since the last cursor write are replayed again.
+    crashed = Spool(str(tmpdir))
+    assert drain(crashed) == expected[3:]
+    crashed.close()
+    spool._writer.close()
+
+
+def test_cursor_is_written_on_close_and_when_drained(tmpdir):
+    spool = Spool(str(tmpdir), cursor_frames=100, cursor_interval=60)
+    for i in range(2):
+        spool.append(framed(i))
+    position, _ = spool.peek()
+    spool.commit(position)
+    spool.close()
+
+    reopened = Spool(str(tmpdir), cursor_frames=100, cursor_interval=60)
+    assert drain(reopened) == [framed(1)]
+    crashed = Spool(str(tmpdir))
+    assert crashed.empty()
+    reopened.close()
+
+
+def test_torn_frames_are_truncated_on_recovery(tmpdir):
+    spool = Spool(str(tmpdir))
+    spool.append(framed(0))
+    spool.close()
+
+    with open(os.path.join(str(tmpdir), segments(tmpdir)[-1]), 'ab') as f:
+        f.write(framed(1)[:10])
+
+    reopened = Spool(str(tmpdir))
+    reopened.append(framed(2))
+    assert drain(reopened) == [framed(0), framed(2)]
+    reopened.close()
+
+
+def test_client_spools_and_replays_when_cernan_is_unreachable(tmpdir):
+    spool = Spool(str(tmpdir))
+    client = v2.Client(host='foobar', port=80, spool=spool)
+    client.replayer.stop()
+
+    with mock.patch.object(client.pool, '_create_connection', side_effect=socket.error):
+        assert client.publish_blob(b'first', payload_id=1, metadata={'a': 'b'}) is None
+
+    # Later payloads queue behind spooled ones without touching the network.
+    with mock.patch.object(client.pool, '_create_connection') as m_create:
+        client.publish_blob(b'second', payload_id=2)
+    assert m_create.call_count == 0
+    assert not spool.empty()
+
+    sock = mock.MagicMock()
+    with mock.patch.object(client.pool, '_create_connection', return_value=sock), \
+            mock.patch.object(client, '_wait_for_ack') as m_ack:
+        assert client.replayer.replay_once()
+        assert client.replayer.replay_once()
+        assert not client.replayer.replay_once()
+
+    assert [call[0][1] for call in m_ack.call_args_list] == [1, 2]
+    sent = b''.join(call[0][0] for call in sock.sendall.call_args_list)
+    assert b'first' in sent and b'second' in sent
+    assert spool.empty()
+    client.close()
+    spool.close()
+
+
+def test_client_raises_application_errors(tmpdir):
+    spool = Spool(str(tmpdir))
+    client = v1.Client(host='foobar', port=80, spool=spool)
+    with mock.patch.object(client.pool, '_create_connection', side_effect=ValueError):
+        with pytest.raises(ValueError):
+            client.publish_blob(b'blob')
+    assert spool.empty()
+    client.close()
+    spool.close()
+
+
+def test_spool_blob_requires_a_spool():
+    client = v1.Client(host='foobar', port=80)
+    with pytest.raises(ValueError):
+        client.spool_blob(b'blob')
+
+
+def test_buffered_spool_policy_spools_overflow(tmpdir):
+    m_client = mock.MagicMock(spool=None)
+    with pytest.raises(ValueError):
+        BufferedClient(m_client, full_policy='spool')
+
+    m_client.spool = Spool(str(tmpdir))
+    client = BufferedClient(m_client, linger_ms=60 * 1000, max_buffered_records=1, full_policy='spool')
+    client.publish(USER_SCHEMA, [user('a'), user('b')], shard_by='abc')
+
+    (args, kwargs), = m_client.spool_blob.call_args_list
+    assert list(deserialize(args[0])[1]) == [user('b')]
+    assert kwargs == {'shard_by': 'abc'}
+    client.close(timeout=5)
+    m_client.spool.close()
@@ -0,0 +1,146 @@
+import itertools
+import socket
+
+import pytest
+
+from settings import USER_SCHEMA
+
+from pycernan.avro import v1, v2
+from pycernan.avro.exceptions import InvalidAckException
+from pycernan.avro.serde import serialize
+from pycernan.avro.testing import FakeCernanServer, parse_frame
+
+
+USERS = [{'name': 'Foo', 'favorite_number': 1, 'favorite_color': None}, {'name': 'Bar', 'favorite_number': None, 'favorite_color': None}]
+
+
+def test_parse_frame():
+    _, _, payload = v2.frame(b'blob', payload_id=7, shard_by=1, metadata={'key': 'value'})
+    frame = parse_frame(b''.join(payload)[4:])
+    assert (frame.version, frame.sync, frame.payload_id, frame.metadata, frame.avro_blob) == (2, True, 7, {'key': 'value'}, b'blob')
+
+    with pytest.raises(ValueError):
+        parse_frame(b'\x00\x00\x00\x03' + b'\x00' * 20)
+
+    _, _, payload = v2.frame(b'blob', payload_id=7, shard_by=1, metadata={'key': b'\xff\xfe'})
+    frame = parse_frame(b''.join(payload)[4:])
+    assert frame.metadata['key'].encode('utf-8', 'surrogateescape') == b'\xff\xfe'
+    assert frame.avro_blob == b'blob'
+
+    # Truncated headers and metadata.
+    for truncated in [b''.join(payload)[4:20], b''.join(payload)[4:33], b''.join(payload)[4:36]]:
+        with pytest.raises(ValueError):
+            parse_frame(truncated)
+
+
+@pytest.mark.parametrize('client_class', [v1.Client, v2.Client])
+def test_decodes_and_records_events(client_class):
+    with FakeCernanServer(decode=True, record_frames=True) as server:
+        client = client_class(host=server.host, port=server.port)
+        client.publish(USER_SCHEMA, USERS)
+        client.publish_blob(b'not avro')
+        client.close()
+
+    assert server.frame_count == 2
+    assert server.event_count == 2
+    assert server.events == USERS
+    assert server.decode_error_count == 1
+    assert server.frames[0].version == client_class.VERSION
+
+
+def test_wrong_id_acks():
+    with FakeCernanServer(wrong_ack_rate=1) as server:
+        client = v1.Client(host=server.host, port=server.port)
+        with pytest.raises(InvalidAckException):
+            client.publish_blob(b'blob')
+        client.close()
+    assert server.wrong_ack_count == 1
+
+
+def test_dropped_frames_are_not_acked():
+    with FakeCernanServer(drop_rate=1) as server:
+        client = v1.Client(host=server.host, port=server.port, publish_timeout=0.1)
+        client.publish_blob(b'blob', sync=False)
+        with pytest.raises(socket.timeout):
+            client.publish_blob(b'blob')
+        client.close()
+    assert server.dropped_count == 1
+    assert server.frame_count == 2
+
+
+def test_reset_connections():
+    with FakeCernanServer(reset_rate=1) as server:
+        client = v1.Client(host=server.host, port=server.port)
+        with pytest.raises(socket.error):
+            client.publish_blob(b'blob')
+        client.close()
+    assert server.stats()['resets'] == 1
+
+
+def test_faults_are_reproducible_with_a_seed():
+    def faults(seed):
+        with FakeCernanServer(drop_rate=0.5, seed=seed) as server:
+            client = v1.Client(host=server.host, port=server.port, publish_timeout=0.05)
+            outcomes = []
+            for _ in range(10):
+                try:
+                    client.publish_blob(b'blob')
+                    outcomes.append(True)
+                except socket.timeout:
+                    outcomes.append(False)
+            client.close()
+        return outcomes
+
+    assert faults(3) == faults(3)
+
+
+def test_delayed_acks_stay_in_order():
+    # Later frames are given shorter delays, yet must still be acked after earlier ones.
+    delays = itertools.count(0)
+    with FakeCernanServer(ack_delay=lambda: max(0, 0.05 - next(delays) * 0.005)) as server:
+        client = v1.Client(host=server.host, port=server.port, maxsize=1, max_in_flight=20)
+        futures = [client.publish_blob(b'blob', payload_id=i + 1) for i in range(20)]
+        for future in futures:
+            assert future.result(5) is None
+        client.close()
+
+
+def test_sustains_high_frame_rates():
+    blob = serialize(USER_SCHEMA, USERS)
+    with FakeCernanServer(decode=True) as server:
+        client = v1.Client(host=server.host, port=server.port, maxsize=1)
+        for _ in range(4999):
+            client.publish_blob(blob, sync=False)
+        client.publish_blob(blob)
+        client.close()
+
+    assert server.frame_count == 5000
+    assert server.event_count == 10000
+
+
+def test_start_raises_when_the_port_is_in_use():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(1)
+    try:
+        server = FakeCernanServer(port=sock.getsockname()[1])
+        with pytest.raises(OSError):
+            server.start()
+        server.stop()
+    finally:
+        sock.close()
+
+
+def test_malformed_frames_close_the_connection():
+    with FakeCernanServer() as server:
+        sock = socket.create_connection(server.address)
+        sock.sendall(b'\x00\x00\x00\x04\x00\x00\x00\x02')
+        assert sock.recv(8) == b''
+        sock.close()
+
+        client = v2.Client(host=server.host, port=server.port)
+        client.publish_blob(b'blob', metadata={'key': b'\xff\xfe'})
+        client.close()
+
+    assert server.malformed_count == 1
+    assert server.frame_count == 1
@@ -45,7 +45,8 @@ def test_publish_blob(send_mock, ack_mock, _, payload_id, shard_by, avro_file):
     send_calls = send_mock.mock_calls
     assert (len(send_calls) == 1)
     send_call = send_calls[0]
-    (_self, _sock, payload_raw) = send_call[1]
+    (_self, _sock, payload_buffers) = send_call[1]
+    payload_raw = b''.join(payload_buffers)
 
     payload = struct.unpack(
         unpack_fmt(len(file_contents)),
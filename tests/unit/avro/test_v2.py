@@ -1,3 +1,4 @@
+# -*- coding: utf-8 -*-
 import io
 import random
 import string
@@ -8,7 +9,7 @@ import pytest
 
 import settings
 from pycernan.avro.base_client import _hash_u64
-from pycernan.avro.v2 import Client
+from pycernan.avro.v2 import Client, PreparedMetadata, encode_metadata, frame
 
 HEADER_FMT = ">LLLQQ"
 METADATA_ENTRIES_FMT = ">B"
@@ -60,7 +61,8 @@ def test_publish_blob(send_mock, ack_mock, _, payload_id, shard_by, avro_file, m
     send_calls = send_mock.mock_calls
     assert (len(send_calls) == 1)
     send_call = send_calls[0]
-    (_self, _sock, payload_raw) = send_call[1]
+    (_self, _sock, payload_buffers) = send_call[1]
+    payload_raw = b''.join(payload_buffers)
 
     payload_reader = io.BytesIO(payload_raw)
 
@@ -96,3 +98,66 @@ def test_publish_blob(send_mock, ack_mock, _, payload_id, shard_by, avro_file, m
 
     if payload_id:
         assert (len(ack_mock.mock_calls) == 1)
+
+
+def decode_metadata(kv_encoded):
+    reader = io.BytesIO(kv_encoded)
+    decoded = {}
+    for _ in range(read_unpack(reader, METADATA_ENTRIES_FMT)[0]):
+        key = reader.read(read_unpack(reader, KEY_LEN_FMT)[0])
+        decoded[key] = reader.read(read_unpack(reader, VAL_LEN_FMT)[0])
+    assert reader.read() == b''
+    return decoded
+
+
+def test_metadata_lengths_are_encoded_byte_lengths():
+    metadata = {u'clé': u'☃' * 10, b'raw': b'\x00\xff'}
+    assert decode_metadata(encode_metadata(metadata)) == {u'clé'.encode('utf-8'): u'☃'.encode('utf-8') * 10, b'raw': b'\x00\xff'}
+
+
+@pytest.mark.parametrize("metadata", [
+    {str(i): '' for i in range(256)},
+    {'k' * 256: ''},
+    {u'é' * 128: ''},
+    {'k': 'v' * 65536},
+    {'k': u'☃' * 21846},
+])
+def test_metadata_limits(metadata):
+    with pytest.raises(ValueError):
+        encode_metadata(metadata)
+
+    with pytest.raises(ValueError):
+        Client().publish_blob(b'blob', metadata=metadata)
+
+
+def test_metadata_at_limits():
+    metadata = {u'é' * 127 + 'k': u'☃' * 21845}
+    assert decode_metadata(encode_metadata(metadata)) == {k.encode('utf-8'): v.encode('utf-8') for k, v in metadata.items()}
+
+
+def test_metadata_types():
+    with pytest.raises(TypeError):
+        encode_metadata({'count': 1})
+
+    with pytest.raises(TypeError):
+        encode_metadata({'tags': ['a']})
+
+
+def test_metadata_encodings_are_cached():
+    assert encode_metadata(None) == encode_metadata({}) == b'\x00'
+    first = encode_metadata({'source': 'checkout'})
+    assert encode_metadata({'source': 'checkout'}) is first
+    assert encode_metadata({'source': 'cart'}) is not first
+
+
+def test_prepared_metadata():
+    prepared = PreparedMetadata({'source': 'checkout'})
+    assert encode_metadata(prepared) is prepared.encoded
+    assert decode_metadata(prepared.encoded) == {b'source': b'checkout'}
+
+    _, _, (header, kv_encoded, blob) = frame(b'blob', metadata=prepared)
+    assert kv_encoded is prepared.encoded
+    assert struct.unpack(">L", header[:4])[0] == len(header) - 4 + len(kv_encoded) + len(blob)
+
+    with pytest.raises(ValueError):
+        PreparedMetadata({'k' * 256: ''})
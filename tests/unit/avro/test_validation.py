@@ -0,0 +1,93 @@
+import mock
+import pytest
+
+from prometheus_client import REGISTRY
+
+from settings import USER_SCHEMA
+
+from pycernan.avro import batch, serde, validation
+from pycernan.avro.dummy import DummyClient
+from pycernan.avro.exceptions import DatumTypeException
+from pycernan.avro.serde import serialize
+from pycernan.avro.validation import Validation, as_validation
+
+
+def users(n):
+    return [{'name': 'User {}'.format(i), 'favorite_number': i, 'favorite_color': None} for i in range(n)]
+
+
+def counted(mode, validated):
+    return REGISTRY.get_sample_value('pycernan_validation_count_total', {'mode': mode, 'validated': validated}) or 0
+
+
+def test_modes():
+    assert [Validation('always').should_validate(USER_SCHEMA) for _ in range(3)] == [True] * 3
+    assert [Validation('never').should_validate(USER_SCHEMA) for _ in range(3)] == [False] * 3
+
+    sampled = Validation('sampled', sample_rate=3)
+    assert [sampled.should_validate(USER_SCHEMA) for _ in range(7)] == [True, False, False, True, False, False, True]
+
+    first_n = Validation('first_n', first_n=2)
+    other = dict(USER_SCHEMA)
+    assert [first_n.should_validate(USER_SCHEMA) for _ in range(3)] == [True, True, False]
+    # Schemas are told apart by identity.
+    assert [first_n.should_validate(other) for _ in range(3)] == [True, True, False]
+
+
+def test_invalid_policies():
+    for kwargs in [{'mode': 'sometimes'}, {'mode': 'sampled', 'sample_rate': 0}, {'mode': 'first_n', 'first_n': -1}]:
+        with pytest.raises(ValueError):
+            Validation(**kwargs)
+
+
+def test_as_validation():
+    policy = Validation('sampled')
+    assert as_validation(policy) is policy
+    assert as_validation('sampled') is as_validation('sampled')
+    assert as_validation(True).mode == 'always'
+    assert as_validation(False).mode == 'never'
+    assert as_validation(None) is validation.default()
+    assert validation.default().mode == 'always'
+
+
+def test_decisions_are_counted():
+    before = counted('sampled', 'true'), counted('sampled', 'false')
+    policy = Validation('sampled', sample_rate=2)
+    for _ in range(5):
+        policy.should_validate(USER_SCHEMA)
+    assert (counted('sampled', 'true') - before[0], counted('sampled', 'false') - before[1]) == (3, 2)
+
+
+@pytest.mark.parametrize('policy, validated', [('always', True), ('never', False), (Validation('first_n', first_n=0), False)])
+def test_serialize_validation(policy, validated):
+    with mock.patch.object(serde, 'writer', wraps=serde.writer) as m_writer:
+        avro_blob = serialize(USER_SCHEMA, users(3), validation=policy)
+    assert m_writer.call_args[1]['validator'] is validated
+    assert list(serde.deserialize(avro_blob)[1]) == users(3)
+
+
+@pytest.mark.parametrize('policy', ['always', 'never'])
+def test_records_fastavro_cannot_encode_raise(policy):
+    for record in [{}, {'name': 1, 'favorite_number': 1}, {'name': 'Foo', 'favorite_number': 'one'}]:
+        with pytest.raises(DatumTypeException):
+            serialize(USER_SCHEMA, [record], validation=policy)
+
+
+def test_client_validation():
+    c = DummyClient(validation=Validation('sampled', sample_rate=2))
+    with mock.patch.object(c, 'publish_blob', autospec=True), \
+            mock.patch.object(batch, 'validate', wraps=batch.validate) as m_validate:
+        # Consulted once per payload, validating the records of every other payload.
+        assert c.publish_iter(USER_SCHEMA, users(8), max_records=2) == 4
+        assert len(m_validate.call_args_list) == 4
+
+        m_validate.reset_mock()
+        c.publish_iter(USER_SCHEMA, users(2), validation='always')
+        assert len(m_validate.call_args_list) == 2
+
+    with mock.patch.object(c, 'publish_blob', autospec=True), \
+            mock.patch.object(serde, 'serialize', wraps=serde.serialize):
+        with mock.patch('pycernan.avro.client.serialize') as m_serialize:
+            c.publish(USER_SCHEMA, users(1))
+            c.publish(USER_SCHEMA, users(1), validation='never')
+    assert [call[1]['validation'] for call in m_serialize.call_args_list] == [c.validation, 'never']